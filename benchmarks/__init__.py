@@ -0,0 +1,4 @@
+"""
+Benchmarks of the DCC contexts, run against synthetic stand-ins of the host
+modules (see the stubs directory) so they work without any DCC installed.
+"""
@@ -0,0 +1,124 @@
+"""
+Command line entry point: python -m benchmarks --help
+"""
+import argparse
+import sys
+
+from dccutils.trace import format_report
+
+from . import coordinator, publish, runner
+from .hosts import HOSTS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Benchmark the DCC contexts against synthetic hosts.",
+    )
+    parser.add_argument(
+        "--hosts",
+        nargs="+",
+        choices=sorted(HOSTS),
+        default=sorted(HOSTS),
+        help="hosts to benchmark",
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=[10, 100, 1000],
+        help="number of objects of the synthetic scenes",
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.05,
+        help="minimum duration of a measure, in seconds",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="measures per method"
+    )
+    parser.add_argument("--output", help="save the results to this file")
+    parser.add_argument("--baseline", help="compare with this baseline file")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="slowdown ratio above which a timing is a regression",
+    )
+    parser.add_argument(
+        "--replay",
+        help="replay this trace (see dccutils.trace) instead of timing "
+        "every method",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="replay speed relative to the recording, 0 for back to back "
+        "calls",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="replays running at the same time",
+    )
+    parser.add_argument(
+        "--publish",
+        action="store_true",
+        help="check the uploads against a local stub server instead",
+    )
+    parser.add_argument(
+        "--coordinator",
+        action="store_true",
+        help="check the coordinator with worker processes sharing a broker "
+        "instead",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="worker processes of the coordinator check",
+    )
+    args = parser.parse_args(argv)
+
+    if args.coordinator:
+        problems, report = coordinator.run(args.workers)
+        print(coordinator.format_report(problems, report))
+        return 1 if problems else 0
+
+    if args.publish:
+        results = publish.run()
+        print(publish.format_results(results))
+        return 1 if any(error for _, error, _ in results) else 0
+
+    if args.replay:
+        host_name = args.hosts[0] if len(args.hosts) == 1 else None
+        report = runner.replay(
+            args.replay, host_name, args.speed, args.concurrency
+        )
+        print(format_report(report))
+        if args.output:
+            runner.save(report, args.output)
+        return 0
+
+    results = runner.run(args.hosts, args.sizes, args.min_time, args.repeat)
+    print(runner.format_results(results))
+    if args.output:
+        runner.save(results, args.output)
+
+    if args.baseline:
+        regressions = runner.compare(
+            runner.load(args.baseline), results, args.threshold
+        )
+        if regressions:
+            print("\nRegressions:")
+            print(runner.format_regressions(regressions))
+            return 1
+        print("\nNo regression above %d%%." % (args.threshold * 100))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""
+Check of dccutils.coordinator with several worker processes sharing one
+SQLite broker on localhost: python -m benchmarks --coordinator
+
+Jobs sleep instead of running a host. Two workers crash with a leased job,
+two others have their clock an hour ahead and behind, and a process keeps
+locking the database longer than the busy timeout of the workers. Every job
+must run once, except the crashed ones, queued again when their lease
+expires, or failed if they have no attempts left.
+"""
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from dccutils.coordinator import Broker, CoordinatorWorker
+
+LEASE_TIME = 2.0
+BUSY_TIMEOUT = 0.1
+CLOCK_SKEWS = (3600, -3600)
+
+
+def run_fake_job(job):
+    time.sleep(job["duration"])
+    marker = "%s.%d.%f" % (job["output"], os.getpid(), time.time())
+    with open(marker, "w"):
+        pass
+    return {"status": "done", "output": job["output"]}
+
+
+def crash(job):
+    os._exit(1)
+
+
+def run_worker(broker_path, name, clock_skew=0, crashes=False):
+    if clock_skew:
+        real_time = time.time
+        time.time = lambda: real_time() + clock_skew
+    broker = Broker(broker_path, timeout=BUSY_TIMEOUT)
+    worker = CoordinatorWorker(
+        broker,
+        name,
+        lease_time=LEASE_TIME,
+        run_job=crash if crashes else run_fake_job,
+    )
+    worker.run(exit_when_empty=True, poll_interval=0.05)
+
+
+def lock_database(broker_path, stop_event):
+    # Hold the write lock for longer than the busy timeout, over and over.
+    connection = sqlite3.connect(broker_path, isolation_level=None)
+    while not stop_event.is_set():
+        connection.execute("BEGIN EXCLUSIVE")
+        time.sleep(3 * BUSY_TIMEOUT)
+        connection.execute("COMMIT")
+        time.sleep(5 * BUSY_TIMEOUT)
+    connection.close()
+
+
+def get_jobs(workdir, count):
+    jobs = []
+    for index in range(count):
+        jobs.append(
+            {
+                "scene": os.path.join(workdir, "scene.blend"),
+                "output": os.path.join(workdir, "out", "%03d.png" % index),
+                "capture": "render_screenshot",
+                "host": "blender",
+                "duration": 0.01 + (index % 5) * 0.01,
+                # The job leased by the second crash can't be run again.
+                "retries": 0 if index == 1 else 1,
+            }
+        )
+    return jobs
+
+
+def start_process(target, *args):
+    process = multiprocessing.Process(target=target, args=args)
+    process.start()
+    return process
+
+
+def run(workers=4, job_count=60):
+    """
+    Run the check and return its report: a list of problems, empty if
+    everything went as expected, and the broker report.
+    """
+    workdir = tempfile.mkdtemp(prefix="dccutils-coordinator-")
+    try:
+        os.makedirs(os.path.join(workdir, "out"))
+        broker_path = os.path.join(workdir, "broker.db")
+        broker = Broker(broker_path)
+        jobs = get_jobs(workdir, job_count)
+        run_id = broker.submit(jobs)
+        start = time.perf_counter()
+
+        # The crashed workers lease the first two jobs.
+        for index in range(2):
+            start_process(run_worker, broker_path, "crash%d" % index, 0, True)
+            while broker.get_counts(run_id)["leased"] <= index:
+                time.sleep(0.01)
+
+        stop_event = multiprocessing.Event()
+        locker = start_process(lock_database, broker_path, stop_event)
+        processes = [
+            start_process(
+                run_worker,
+                broker_path,
+                "worker%d" % index,
+                CLOCK_SKEWS[index] if index < len(CLOCK_SKEWS) else 0,
+            )
+            for index in range(workers)
+        ]
+        for process in processes:
+            process.join(120)
+        stop_event.set()
+        locker.join()
+        wall_time = time.perf_counter() - start
+
+        report = broker.get_report(run_id)
+        markers = os.listdir(os.path.join(workdir, "out"))
+        problems = []
+        for process in processes:
+            if process.exitcode != 0:
+                problems.append("a worker exited with %s" % process.exitcode)
+        for index, job in enumerate(report["jobs"]):
+            name = os.path.basename(job["output"])
+            runs = len([m for m in markers if m.startswith(name + ".")])
+            if index == 1:
+                expected = ("failed", 1, 0)
+            elif index == 0:
+                expected = ("done", 2, 1)
+            else:
+                expected = ("done", 1, 1)
+            if (job["status"], job["attempts"], runs) != expected:
+                problems.append(
+                    "job %s: %s after %d attempts, run %d times, expected "
+                    "%s after %d attempts, run %d times"
+                    % ((name, job["status"], job["attempts"], runs) + expected)
+                )
+        report["summary"]["wall_time"] = wall_time
+        return problems, report
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def format_report(problems, report):
+    summary = report["summary"]
+    lines = [
+        "%d jobs, %d done, %d failed by %d workers in %.3fs"
+        % (
+            summary["jobs"],
+            summary["done"],
+            summary["failed"],
+            summary["workers"],
+            summary["wall_time"],
+        )
+    ]
+    for worker in report["workers"]:
+        lines.append("%-12s%6d jobs" % (worker["id"], worker["jobs_done"]))
+    lines += ["problem: %s" % problem for problem in problems]
+    lines.append("ok" if not problems else "FAILED")
+    return "\n".join(lines)
@@ -0,0 +1,540 @@
+"""
+Description of the benchmarked hosts: how to build a synthetic scene for each
+of them and how to call every public method of their context.
+"""
+import importlib
+import os
+import sys
+
+from dccutils.image import ImageBuffer
+
+STUBS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs")
+
+
+def install_stubs():
+    """
+    Make the synthetic ``bpy``, ``hou``, ``maya`` and ``unreal`` modules
+    importable.
+    """
+    if STUBS_DIR not in sys.path:
+        sys.path.insert(0, STUBS_DIR)
+
+
+def get_scene_counts(size):
+    """
+    Return the number of objects, cameras, render nodes and assets of a
+    scene of the given size.
+    """
+    return {
+        "objects": size,
+        "cameras": max(1, size // 10),
+        "rops": max(1, size // 10),
+        "assets": size,
+    }
+
+
+class Setting(object):
+    """
+    Host independent setting, to benchmark the state recording.
+    """
+
+    def __init__(self):
+        self.value = 1
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+def _pop_state(context, env):
+    context.push_state()
+    context.set_property(env.setting, "value", 2)
+    context.pop_state()
+
+
+def _preserved_state(context, env):
+    with context.preserved_state():
+        context.set_property(env.setting, "value", 2)
+
+
+class Environment(object):
+    """
+    Scene and output location shared by the calls of a benchmark run.
+    """
+
+    def __init__(self, workdir, scene_module, scene_path):
+        self.workdir = workdir
+        self.scene_module = scene_module
+        self.scene_path = scene_path
+        self.renderer = None
+        self.setting = Setting()
+        self.image = ImageBuffer(64, 36)
+
+    def noop(self):
+        pass
+
+    def output(self, extension):
+        return os.path.join(self.workdir, "output." + extension)
+
+
+class Host(object):
+    name = None
+    stub_module = None
+    context_module = None
+    context_class = None
+
+    # Methods that can't run against the stubs, with the reason why.
+    skipped = {}
+    common_skipped = {
+        "disable_derivation": "configuration",
+        "disable_publishing": "configuration",
+        "disable_render_cache": "configuration",
+        "disable_tracing": "configuration",
+        "enable_derivation": "configuration",
+        "enable_publishing": "configuration",
+        "enable_render_cache": "configuration",
+        "enable_tracing": "configuration",
+        "publish_output": "uploads the output",
+        "run_capture": "benchmarked through the take_* methods",
+        "stream_animation": "encodes the frames with ffmpeg",
+        "take_incremental_animation": "encodes the frames with ffmpeg",
+    }
+
+    def load_context_class(self):
+        install_stubs()
+        module = importlib.import_module(self.context_module)
+        return getattr(module, self.context_class)
+
+    def build(self, size, workdir):
+        install_stubs()
+        scene_module = importlib.import_module(self.stub_module)
+        scene_path = os.path.join(workdir, "scene")
+        with open(scene_path, "wb"):
+            pass
+        scene_module.build_scene(
+            filepath=scene_path, output_dir=workdir, **get_scene_counts(size)
+        )
+        return Environment(workdir, scene_module, scene_path)
+
+    def prepare(self, context, env):
+        """
+        Put the context in the state every benchmarked call expects.
+        """
+        context.push_state()
+
+    def tick(self, context, env):
+        """
+        Run the work the host does between two calls, like an editor tick.
+        """
+        pass
+
+    def get_common_calls(self):
+        """
+        Return the calls of the methods shared by every context.
+        """
+        return {
+            "can_defer": lambda c, e: c.can_defer(),
+            "execute_deferred": lambda c, e: c.execute_deferred(e.noop),
+            "get_capabilities": lambda c, e: c.get_capabilities(),
+            "get_color_spaces": lambda c, e: c.get_color_spaces(),
+            "get_current_frame": lambda c, e: c.get_current_frame(),
+            "free_memory": lambda c, e: c.free_memory(),
+            "restore_state": lambda c, e: c.restore_state([]),
+            "clear_state_cache": lambda c, e: c.clear_state_cache(),
+            "get_state_value": lambda c, e: (
+                c.get_state_value("frame", c.get_current_frame)
+            ),
+            "handle_output": lambda c, e: c.handle_output(
+                "take_render_screenshot", e.output("png")
+            ),
+            "on_capture_finished": lambda c, e: c.on_capture_finished(
+                e.output("png")
+            ),
+            "get_current_project_path": lambda c, e: (
+                c.get_current_project_path()
+            ),
+            "get_dcc_name": lambda c, e: c.get_dcc_name(),
+            "get_dcc_version": lambda c, e: c.get_dcc_version(),
+            "get_frame_fingerprint": lambda c, e: c.get_frame_fingerprint(1),
+            "has_unsaved_changes": lambda c, e: c.has_unsaved_changes(),
+            "get_render_settings": lambda c, e: c.get_render_settings(),
+            "get_frame_range": lambda c, e: c.get_frame_range(),
+            "get_frame_rate": lambda c, e: c.get_frame_rate(),
+            "get_plugins_signature": lambda c, e: c.get_plugins_signature(),
+            "is_capture_in_progress": lambda c, e: c.is_capture_in_progress(),
+            "load_capabilities": lambda c, e: (
+                c.load_capabilities(e.workdir, revalidate=False)
+            ),
+            "get_render_cache_inputs": lambda c, e: (
+                c.get_render_cache_inputs()
+            ),
+            "open_scene": lambda c, e: c.open_scene(e.scene_path),
+            "pop_state": _pop_state,
+            "preserved_state": _preserved_state,
+            "push_state": lambda c, e: (c.push_state(), c.pop_state()),
+            "remember_state": lambda c, e: (
+                c.remember_state("setting", e.setting.get, e.setting.set)
+            ),
+            "render_frame": lambda c, e: (
+                c.render_frame(e.renderer, 1, e.output("png"))
+            ),
+            "set_current_frame": lambda c, e: c.set_current_frame(1),
+            "set_property": lambda c, e: c.set_property(e.setting, "value", 1),
+            "save_pixels": lambda c, e: (
+                c.save_pixels(e.image, e.output("png"))
+            ),
+            "set_state_value": lambda c, e: (
+                c.set_state_value("setting", e.setting.get, e.setting.set, 1)
+            ),
+            "software_print": lambda c, e: c.software_print("message"),
+            "take_render_pixels": lambda c, e: (
+                c.take_render_pixels(e.renderer)
+            ),
+            "take_viewport_pixels": lambda c, e: c.take_viewport_pixels(),
+        }
+
+    def get_calls(self):
+        """
+        Return a dict mapping method names to a function calling the method
+        with the arguments a pipeline would usually give.
+        """
+        return self.get_common_calls()
+
+    def get_public_methods(self):
+        context_class = self.load_context_class()
+        return sorted(
+            name
+            for name in dir(context_class)
+            if not name.startswith("_")
+            and callable(getattr(context_class, name))
+            and name not in self.common_skipped
+        )
+
+
+class BlenderHost(Host):
+    name = "blender"
+    stub_module = "bpy"
+    context_module = "dccutils.blender"
+    context_class = "BlenderContext"
+    skipped = {
+        "take_viewport_pixels": "draws with the gpu module in a 3D view",
+    }
+
+    def prepare(self, context, env):
+        env.renderer = "CYCLES"
+        context.set_camera("Camera.0000")
+        context.push_state()
+
+    def get_calls(self):
+        calls = self.get_common_calls()
+        calls.update(
+            {
+                "get_available_renderers": lambda c, e: (
+                    c.get_available_renderers()
+                ),
+                "get_blender_version": lambda c, e: c.get_blender_version(),
+                "get_cameras": lambda c, e: c.get_cameras(with_objects=True),
+                "get_current_color_space": lambda c, e: (
+                    c.get_current_color_space()
+                ),
+                "get_current_scene": lambda c, e: c.get_current_scene(),
+                "get_extensions": lambda c, e: c.get_extensions(True),
+                "set_camera": lambda c, e: c.set_camera("Camera.0000"),
+                "set_current_color_space": lambda c, e: (
+                    c.set_current_color_space("sRGB")
+                ),
+                "setup_colorspace_settings": lambda c, e: (
+                    c.setup_colorspace_settings(False)
+                ),
+                "setup_preview": lambda c, e: (
+                    c.setup_preview(e.output("png"), "PNG")
+                ),
+                "setup_preview_animation": lambda c, e: (
+                    c.setup_preview_animation(
+                        e.output("mp4"), "FFMPEG", "MPEG4"
+                    )
+                ),
+                "setup_render": lambda c, e: c.setup_render("CYCLES"),
+                "setup_viewport_view_transform": lambda c, e: (
+                    c.setup_viewport_view_transform()
+                ),
+                "take_render_animation": lambda c, e: (
+                    c.take_render_animation("CYCLES", e.output("mp4"), "MPEG4")
+                ),
+                "take_render_screenshot": lambda c, e: (
+                    c.take_render_screenshot("CYCLES", e.output("png"), "PNG")
+                ),
+                "take_viewport_animation": lambda c, e: (
+                    c.take_viewport_animation(e.output("mp4"), "MPEG4")
+                ),
+                "take_viewport_screenshot": lambda c, e: (
+                    c.take_viewport_screenshot(e.output("png"), "PNG")
+                ),
+                "get_view3d_region": lambda c, e: c.get_view3d_region(),
+                "setup_viewer_node": lambda c, e: c.setup_viewer_node(),
+                "take_render_pixels": lambda c, e: (
+                    c.take_render_pixels("CYCLES")
+                ),
+            }
+        )
+        del calls["take_viewport_pixels"]
+        return calls
+
+
+class MayaHost(Host):
+    name = "maya"
+    stub_module = "maya.cmds"
+    context_module = "dccutils.maya"
+    context_class = "MayaContext"
+    skipped = {
+        "launch_render": "spawns the Maya Render executable",
+        "take_render_animation": "spawns the Maya Render executable",
+    }
+
+    def prepare(self, context, env):
+        env.renderer = "mayaSoftware"
+        context.set_camera("camera1Shape")
+        context.push_state()
+
+    def get_calls(self):
+        calls = self.get_common_calls()
+        calls.update(
+            {
+                "activate_color_management": lambda c, e: (
+                    c.activate_color_management(True)
+                ),
+                "clear_color_management_cache": lambda c, e: (
+                    c.clear_color_management_cache()
+                ),
+                "get_available_renderers": lambda c, e: (
+                    c.get_available_renderers()
+                ),
+                "get_camera": lambda c, e: c.get_camera(),
+                "get_cameras": lambda c, e: c.get_cameras(),
+                "get_current_color_space": lambda c, e: (
+                    c.get_current_color_space()
+                ),
+                "get_current_file_path": lambda c, e: (
+                    c.get_current_file_path()
+                ),
+                "get_extensions": lambda c, e: c.get_extensions(False),
+                "is_color_management_available": lambda c, e: (
+                    c.is_color_management_available("arnold")
+                ),
+                "on_scene_opened": lambda c, e: c.on_scene_opened(),
+                "render_image": lambda c, e: (
+                    c.render_image(e.renderer, e.output("png"), ("png", 32))
+                ),
+                "render_maya_software": lambda c, e: (
+                    c.render_maya_software(e.output("png"), "camera1Shape")
+                ),
+                "set_arnold_threads": lambda c, e: (
+                    c.set_arnold_threads(8, 1920, 1080)
+                ),
+                "set_attribute": lambda c, e: (
+                    c.set_attribute("defaultRenderGlobals.imageFormat", 32)
+                ),
+                "set_camera": lambda c, e: c.set_camera("camera1Shape"),
+                "set_color_management_pref": lambda c, e: (
+                    c.set_color_management_pref("cmEnabled", True)
+                ),
+                "set_current_color_space": lambda c, e: (
+                    c.set_current_color_space()
+                ),
+                "set_current_id_extension": lambda c, e: (
+                    c.set_current_id_extension(32)
+                ),
+                "set_file_rule": lambda c, e: (
+                    c.set_file_rule("images", e.workdir)
+                ),
+                "set_render_region": lambda c, e: (
+                    c.set_render_region((0, 0, 960, 540))
+                ),
+                "take_render_screenshot": lambda c, e: (
+                    c.take_render_screenshot(
+                        "mayaSoftware", e.output("png"), ("png", 32)
+                    )
+                ),
+                "take_viewport_animation": lambda c, e: (
+                    c.take_viewport_animation(e.output("mov"), ("mov", 22))
+                ),
+                "take_viewport_screenshot": lambda c, e: (
+                    c.take_viewport_screenshot(e.output("png"), ("png", 32))
+                ),
+                "watch_attribute": lambda c, e: (
+                    c.watch_attribute("defaultRenderGlobals.imageFormat")
+                ),
+                "write_through_quicktime": lambda c, e: (
+                    c.write_through_quicktime(
+                        lambda path: None, e.output("mov")
+                    )
+                ),
+                "watch_scene_events": lambda c, e: c.watch_scene_events(),
+            }
+        )
+        return calls
+
+
+class HoudiniHost(Host):
+    name = "houdini"
+    stub_module = "hou"
+    context_module = "dccutils.houdini"
+    context_class = "HoudiniContext"
+    skipped = {
+        "stream_frame_range": "encodes the frames with ffmpeg",
+        "take_render_animation": "encodes the frames with ffmpeg",
+        "take_viewport_animation": "encodes the frames with ffmpeg",
+    }
+
+    def prepare(self, context, env):
+        hou = env.scene_module
+        env.camera = hou.node("/obj/cam1")
+        env.render_node = hou.node("/out").children()[0]
+        env.renderer = env.render_node
+        render_type = context.get_node_render_type(env.render_node)
+        env.camera_parm = env.render_node.parm(
+            context.renderers[render_type]["parm_camera"]
+        )
+        context.set_camera(env.camera, render_node=env.render_node)
+        context.push_state()
+
+    def get_calls(self):
+        calls = self.get_common_calls()
+        calls.update(
+            {
+                "check_node": lambda c, e: c.check_node(e.render_node),
+                "get_all_nodes": lambda c, e: c.get_all_nodes(),
+                "get_available_renderers": lambda c, e: (
+                    c.get_available_renderers()
+                ),
+                "get_cameras": lambda c, e: c.get_cameras(),
+                "get_current_color_space": lambda c, e: (
+                    c.get_current_color_space()
+                ),
+                "get_extensions": lambda c, e: c.get_extensions(False),
+                "get_node_render_type": lambda c, e: (
+                    c.get_node_render_type(e.render_node)
+                ),
+                "get_scene_viewer": lambda c, e: c.get_scene_viewer(),
+                "get_viewport_camera": lambda c, e: c.get_viewport_camera(),
+                "remember_viewport_camera": lambda c, e: (
+                    c.remember_viewport_camera(
+                        c.get_scene_viewer().curViewport()
+                    )
+                ),
+                "set_camera": lambda c, e: (
+                    c.set_camera(e.camera, render_node=e.render_node)
+                ),
+                "set_current_color_space": lambda c, e: (
+                    c.set_current_color_space("sRGB")
+                ),
+                "set_parm": lambda c, e: (
+                    c.set_parm(e.camera_parm, "/obj/cam1")
+                ),
+                "setup_preview": lambda c, e: (
+                    c.setup_preview(e.output("png"), ".png")
+                ),
+                "setup_preview_animation": lambda c, e: (
+                    c.setup_preview_animation(e.output("mp4"), ".png", ".mp4")
+                ),
+                "take_render_screenshot": lambda c, e: (
+                    c.take_render_screenshot(
+                        e.render_node, e.output("png"), ".png"
+                    )
+                ),
+                "take_viewport_screenshot": lambda c, e: (
+                    c.take_viewport_screenshot(e.output("png"), ".png")
+                ),
+                "take_viewport_shots": lambda c, e: c.take_viewport_shots(
+                    [
+                        {"output_path": e.output("png"), "camera": e.camera},
+                        {
+                            "output_path": e.output("$F4.png"),
+                            "frame_range": (1, 4),
+                        },
+                    ]
+                ),
+            }
+        )
+        return calls
+
+
+def _tick(result, env):
+    env.scene_module.tick()
+    return result
+
+
+class UnrealHost(Host):
+    name = "unreal"
+    stub_module = "unreal"
+    context_module = "dccutils.unreal"
+    context_class = "UnrealContext"
+    skipped = {
+        "on_render_movie_finished": "editor callback",
+        "on_render_movie_written": "editor callback",
+        "on_render_screenshot_finished": "editor callback",
+        "on_viewport_animation_finished": "editor callback",
+        "take_viewport_animation": "encodes the frames with ffmpeg",
+    }
+
+    def prepare(self, context, env):
+        env.renderer = None
+        context.set_camera("CameraActor0")
+        context.set_sequence("Asset0")
+        context.push_state()
+
+    def tick(self, context, env):
+        env.scene_module.tick()
+
+    def get_calls(self):
+        calls = self.get_common_calls()
+        calls.update(
+            {
+                "bind_camera_index_delegates": lambda c, e: (
+                    c.bind_camera_index_delegates()
+                ),
+                "find_camera": lambda c, e: c.find_camera("CameraActor0"),
+                "get_available_renderers": lambda c, e: (
+                    c.get_available_renderers()
+                ),
+                "get_camera_index": lambda c, e: c.get_camera_index(),
+                "get_cameras": lambda c, e: c.get_cameras(with_objects=True),
+                "get_current_color_space": lambda c, e: (
+                    c.get_current_color_space()
+                ),
+                "get_extensions": lambda c, e: c.get_extensions(True),
+                "get_sequences": lambda c, e: c.get_sequences(with_path=True),
+                "invalidate_camera_index": lambda c, e: (
+                    c.invalidate_camera_index()
+                ),
+                "open_level_sequence": lambda c, e: (
+                    c.open_level_sequence("/Game/Asset0.Asset0")
+                ),
+                "remember_viewport_camera": lambda c, e: (
+                    c.remember_viewport_camera()
+                ),
+                "set_camera": lambda c, e: c.set_camera("CameraActor0"),
+                "set_current_color_space": lambda c, e: (
+                    c.set_current_color_space("SRGB")
+                ),
+                "set_sequence": lambda c, e: c.set_sequence("Asset0"),
+                "take_render_animation": lambda c, e: _tick(
+                    c.take_render_animation(e.output("avi"), ".avi"), e
+                ),
+                "take_render_screenshot": lambda c, e: _tick(
+                    c.take_render_screenshot(e.output("png")), e
+                ),
+                "take_viewport_screenshot": lambda c, e: _tick(
+                    c.take_viewport_screenshot(e.output("png")), e
+                ),
+            }
+        )
+        return calls
+
+
+HOSTS = dict(
+    (host.name, host)
+    for host in (BlenderHost(), MayaHost(), HoudiniHost(), UnrealHost())
+)
@@ -0,0 +1,208 @@
+"""
+Checks of the uploads of dccutils.publish against the local stub server
+(see stubs/upload_server.py), with faults injected to exercise the retries:
+python -m benchmarks --publish
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+from dccutils.exceptions import PublishError
+from dccutils.publish import Publisher
+
+from .hosts import HOSTS
+from .stubs.upload_server import UploadServer
+
+CHUNK_SIZE = 64 * 1024
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def check(condition, message, *args):
+    if not condition:
+        raise CheckFailed(message % args)
+
+
+def write_file(workdir, name, size):
+    path = os.path.join(workdir, name)
+    with open(path, "wb") as output_file:
+        output_file.write(os.urandom(size))
+    return path
+
+
+def get_publisher(server, retries=3):
+    return Publisher(
+        server.url,
+        chunk_size=CHUNK_SIZE,
+        retries=retries,
+        retry_delay=0.01,
+        request_timeout=0.5,
+    )
+
+
+def check_uploaded(server, path, metadata=None):
+    name = os.path.basename(path)
+    upload = server.get_upload(name)
+    check(upload is not None, "%s was not uploaded", name)
+    with open(path, "rb") as uploaded_file:
+        data = uploaded_file.read()
+    check(bytes(upload.data) == data, "%s was corrupted", name)
+    check(upload.completed is not None, "%s was not completed", name)
+    if metadata is not None:
+        check(upload.completed == metadata, "metadata of %s differ", name)
+
+
+def publish(server, path, metadata=None, retries=3):
+    with get_publisher(server, retries) as publisher:
+        report = publisher.publish(path, metadata).result(30)
+    check_uploaded(server, path, metadata)
+    return report
+
+
+def check_chunks(server, workdir):
+    path = write_file(workdir, "chunks.bin", 5 * CHUNK_SIZE + 123)
+    report = publish(server, path, {"capture": "take_render_screenshot"})
+    check(report["attempts"] == 1, "%d attempts", report["attempts"])
+    check(server.requests["PUT"] == 6, "%d chunks", server.requests["PUT"])
+    with open(path, "rb") as uploaded_file:
+        sha256 = hashlib.sha256(uploaded_file.read()).hexdigest()
+    check(report["response"]["sha256"] == sha256, "wrong checksum")
+
+
+def check_empty_file(server, workdir):
+    publish(server, write_file(workdir, "empty.bin", 0), {})
+
+
+def check_faults(server, workdir):
+    # One fault of each kind, each followed by a successful retry.
+    server.add_faults(
+        ("PUT", 503),
+        ("PUT", "drop"),
+        ("PUT", "malformed"),
+        ("PUT", "lose"),
+        ("HEAD", "malformed"),
+    )
+    path = write_file(workdir, "faults.bin", 4 * CHUNK_SIZE)
+    report = publish(server, path, {}, retries=10)
+    check(report["attempts"] == 6, "%d attempts", report["attempts"])
+
+
+def check_lost_completion(server, workdir):
+    # The upload completes but the client never hears of it.
+    server.add_faults(("POST", "lose"))
+    path = write_file(workdir, "lost.bin", CHUNK_SIZE)
+    report = publish(server, path, {"capture": "lost"})
+    check(report["attempts"] == 2, "%d attempts", report["attempts"])
+    check(server.requests["POST"] == 1, "completed twice")
+
+
+def check_unresponsive_server(server, workdir):
+    # The server accepts the request but never answers it.
+    server.add_faults(("PUT", "hang"))
+    path = write_file(workdir, "hang.bin", CHUNK_SIZE)
+    report = publish(server, path, {})
+    check(report["attempts"] == 2, "%d attempts", report["attempts"])
+
+
+def check_large_metadata(server, workdir):
+    # Far above the 64 KiB header lines most servers accept.
+    derivatives = [
+        {"path": "thumbnail.%d.png" % index, "width": 512, "height": 288}
+        for index in range(5000)
+    ]
+    metadata = {"derivatives": {"thumbnails": derivatives}}
+    publish(server, write_file(workdir, "metadata.bin", 1000), metadata)
+
+
+def check_exhausted_retries(server, workdir):
+    server.add_faults(*[("PUT", 503)] * 3)
+    path = write_file(workdir, "exhausted.bin", 1000)
+    try:
+        publish(server, path, {}, retries=2)
+    except PublishError:
+        return
+    raise CheckFailed("no error after the retries")
+
+
+def check_client_error(server, workdir):
+    server.add_faults(("PUT", 403))
+    path = write_file(workdir, "forbidden.bin", 1000)
+    try:
+        publish(server, path, {})
+    except PublishError:
+        check(server.requests["PUT"] == 1, "client error retried")
+        return
+    raise CheckFailed("no error for HTTP 403")
+
+
+def check_asynchronous_capture(server, workdir):
+    # An earlier capture left a file at the output path: the new one must
+    # be published once the editor wrote it, not the old one.
+    host = HOSTS["unreal"]
+    env = host.build(10, workdir)
+    context = host.load_context_class()()
+    host.prepare(context, env)
+    output_path = os.path.join(workdir, "screenshot.png")
+    with open(output_path, "wb") as output_file:
+        output_file.write(b"stale")
+    with get_publisher(server) as publisher:
+        context.enable_publishing(publisher)
+        context.take_viewport_screenshot(output_path)
+        check(not server.uploads, "published before the capture ended")
+        while context.is_capture_in_progress():
+            host.tick(context, env)
+    check_uploaded(server, output_path)
+    check(
+        bytes(server.get_upload("screenshot.png").data) != b"stale",
+        "the stale output was published",
+    )
+
+
+CHECKS = (
+    check_chunks,
+    check_empty_file,
+    check_faults,
+    check_lost_completion,
+    check_unresponsive_server,
+    check_large_metadata,
+    check_exhausted_retries,
+    check_client_error,
+    check_asynchronous_capture,
+)
+
+
+def run():
+    """
+    Run the checks, each against a new server, and return their results:
+    (name, error or None, duration) tuples.
+    """
+    results = []
+    for function in CHECKS:
+        workdir = tempfile.mkdtemp(prefix="dccutils-publish-")
+        start = time.perf_counter()
+        error = None
+        try:
+            with UploadServer() as server:
+                function(server, workdir)
+        except Exception as exception:
+            error = "%s: %s" % (type(exception).__name__, exception)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        name = function.__name__[len("check_") :]
+        results.append((name, error, time.perf_counter() - start))
+    return results
+
+
+def format_results(results):
+    lines = []
+    for name, error, duration in results:
+        status = "ok" if error is None else "FAILED"
+        line = "%-24s%8s%10.3fs" % (name, status, duration)
+        if error is not None:
+            line += "  " + error
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,207 @@
+"""
+Time the context methods against synthetic scenes of growing size, save the
+timings as a JSON baseline and compare them with a previous baseline.
+"""
+import json
+import platform
+import shutil
+import tempfile
+import time
+
+from .hosts import HOSTS
+
+BASELINE_FORMAT = 1
+
+
+def time_call(function, min_time=0.05, repeat=3):
+    """
+    Return the best time per call, in seconds, of the given function.
+    The number of calls per measure grows until a measure lasts at least
+    min_time seconds.
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1 << 20:
+            break
+        number *= 2 if elapsed <= 0 else max(2, int(min_time / elapsed))
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def run_host(host, sizes, min_time=0.05, repeat=3):
+    """
+    Benchmark every public method of the host context for every scene size.
+    Return the timings and the list of methods that were not benchmarked.
+    """
+    calls = host.get_calls()
+    context_class = host.load_context_class()
+    results = {}
+    for size in sizes:
+        workdir = tempfile.mkdtemp(prefix="dccutils-bench-")
+        try:
+            env = host.build(size, workdir)
+            context = context_class()
+            host.prepare(context, env)
+            for name, call in sorted(calls.items()):
+                timing = time_call(
+                    lambda: call(context, env), min_time, repeat
+                )
+                results.setdefault(name, {})[str(size)] = timing
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    missing = [
+        name
+        for name in host.get_public_methods()
+        if name not in calls and name not in host.skipped
+    ]
+    return results, missing
+
+
+def run(host_names, sizes, min_time=0.05, repeat=3):
+    """
+    Benchmark the given hosts and return a baseline dict.
+    """
+    results = {}
+    missing = {}
+    for host_name in host_names:
+        host = HOSTS[host_name]
+        results[host_name], host_missing = run_host(
+            host, sizes, min_time, repeat
+        )
+        if host_missing:
+            missing[host_name] = host_missing
+    return {
+        "format": BASELINE_FORMAT,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "sizes": list(sizes),
+        "results": results,
+        "missing": missing,
+    }
+
+
+def get_trace_host(header):
+    """
+    Return the name of the host a trace was recorded in.
+    """
+    dcc_name = (header.get("dcc") or "").lower()
+    for host_name in HOSTS:
+        if dcc_name.startswith(host_name):
+            return host_name
+    raise ValueError("No synthetic host for %s traces" % header.get("dcc"))
+
+
+def get_trace_size(header):
+    """
+    Return the size of the synthetic scene with as many cameras as the
+    recorded scene (see get_scene_counts).
+    """
+    cameras = header.get("scene", {}).get("cameras")
+    return 10 * cameras if cameras else 100
+
+
+def replay(trace_path, host_name=None, speed=0, concurrency=1):
+    """
+    Replay a trace recorded with dccutils.trace against the synthetic host
+    and return the replay report.
+    """
+    from dccutils.trace import TraceReplayer
+
+    workdir = tempfile.mkdtemp(prefix="dccutils-replay-")
+    try:
+        replayer = TraceReplayer(trace_path, speed, concurrency, workdir)
+        host = HOSTS[host_name or get_trace_host(replayer.header)]
+        env = host.build(get_trace_size(replayer.header), workdir)
+        context_class = host.load_context_class()
+        replayer.after_call = lambda context: host.tick(context, env)
+
+        def create_context():
+            context = context_class()
+            host.prepare(context, env)
+            return context
+
+        return replayer.replay(create_context)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def save(baseline, path):
+    with open(path, "w") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get("format") != BASELINE_FORMAT:
+        raise ValueError("Unsupported baseline format in %s" % path)
+    return baseline
+
+
+def compare(reference, current, threshold=0.25, min_delta=5e-6):
+    """
+    Return the list of timings of current that are slower than reference by
+    more than threshold (a ratio) and min_delta (in seconds). Each entry is a
+    (host, method, size, reference time, current time) tuple.
+    """
+    regressions = []
+    for host_name, methods in sorted(current["results"].items()):
+        reference_methods = reference["results"].get(host_name, {})
+        for method, timings in sorted(methods.items()):
+            reference_timings = reference_methods.get(method, {})
+            for size, timing in sorted(timings.items(), key=_size_key):
+                reference_timing = reference_timings.get(size)
+                if reference_timing is None:
+                    continue
+                if (
+                    timing > reference_timing * (1.0 + threshold)
+                    and timing - reference_timing > min_delta
+                ):
+                    regressions.append(
+                        (host_name, method, size, reference_timing, timing)
+                    )
+    return regressions
+
+
+def format_results(baseline):
+    lines = []
+    sizes = [str(size) for size in baseline["sizes"]]
+    header = "%-34s" % "method" + "".join("%14s" % s for s in sizes)
+    for host_name, methods in sorted(baseline["results"].items()):
+        lines.append("[%s]" % host_name)
+        lines.append(header)
+        for method, timings in sorted(methods.items()):
+            lines.append(
+                "%-34s" % method
+                + "".join(
+                    "%12.2fus" % (timings[size] * 1e6)
+                    if size in timings
+                    else "%14s" % "-"
+                    for size in sizes
+                )
+            )
+        for method in baseline["missing"].get(host_name, []):
+            lines.append("%-34s%14s" % (method, "not benchmarked"))
+    return "\n".join(lines)
+
+
+def format_regressions(regressions):
+    return "\n".join(
+        "%s.%s (size %s): %.2fus -> %.2fus (x%.2f)"
+        % (host, method, size, before * 1e6, after * 1e6, after / before)
+        for host, method, size, before, after in regressions
+    )
+
+
+def _size_key(item):
+    return int(item[0])
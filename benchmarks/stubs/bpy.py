@@ -0,0 +1,441 @@
+"""
+Synthetic stand-in for the Blender ``bpy`` module.
+
+Only the parts of the API used by dccutils are implemented. Call
+``build_scene`` to populate ``data`` with a scene of a given size.
+"""
+import array
+import os
+
+
+class _Timers(object):
+    def __init__(self):
+        self.functions = []
+
+    def register(self, function, first_interval=0.0, persistent=False):
+        self.functions.append(function)
+
+    def run(self):
+        """
+        Run the registered timers once, like the event loop would.
+        """
+        functions, self.functions = self.functions, []
+        for function in functions:
+            function()
+
+
+class app(object):
+    version = (3, 6, 0)
+    binary_path = "blender"
+    background = True
+    timers = _Timers()
+
+
+class _EnumItem(object):
+    def __init__(self, name, identifier=None):
+        self.name = name
+        self.identifier = identifier or name.upper().replace(" ", "_")
+
+
+class _Property(object):
+    def __init__(self, enum_items):
+        self.enum_items = enum_items
+
+
+class _RNA(object):
+    def __init__(self, properties):
+        self.properties = properties
+
+
+class _ImageSettings(object):
+    def __init__(self):
+        self.file_format = "PNG"
+
+
+class _FFmpegSettings(object):
+    def __init__(self):
+        self.codec = "NONE"
+        self.format = "MPEG4"
+
+
+class _RenderSettings(object):
+    bl_rna = _RNA(
+        {
+            "engine": _Property(
+                [
+                    _EnumItem("Eevee", "BLENDER_EEVEE"),
+                    _EnumItem("Cycles", "CYCLES"),
+                ]
+            )
+        }
+    )
+
+    def __init__(self):
+        self.engine = "BLENDER_EEVEE"
+        self.filepath = "/tmp/"
+        self.image_settings = _ImageSettings()
+        self.ffmpeg = _FFmpegSettings()
+        self.resolution_x = 1920
+        self.resolution_y = 1080
+        self.resolution_percentage = 100
+        self.film_transparent = False
+        self.fps = 24
+        self.fps_base = 1.0
+        self.use_compositing = True
+
+
+class _ColorspaceSettings(object):
+    bl_rna = _RNA(
+        {
+            "name": _Property(
+                [
+                    _EnumItem("Filmic Log"),
+                    _EnumItem("Linear"),
+                    _EnumItem("sRGB"),
+                    _EnumItem("XYZ"),
+                ]
+            )
+        }
+    )
+
+    def __init__(self):
+        self.name = "sRGB"
+
+
+class _ViewSettings(object):
+    def __init__(self):
+        self.view_transform = "Filmic"
+        self.look = "None"
+        self.exposure = 0.0
+        self.gamma = 1.0
+
+
+class _Socket(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class _Node(object):
+    def __init__(self, node_type, name):
+        self.type = node_type
+        self.name = name
+        self.use_alpha = False
+        self.inputs = {"Image": _Socket("Image")}
+        self.outputs = {"Image": _Socket("Image")}
+
+
+class _Nodes(object):
+    types = {
+        "CompositorNodeRLayers": ("R_LAYERS", "Render Layers"),
+        "CompositorNodeComposite": ("COMPOSITE", "Composite"),
+        "CompositorNodeViewer": ("VIEWER", "Viewer"),
+    }
+
+    def __init__(self):
+        self._items = []
+        self.active = None
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __getitem__(self, name):
+        node = self.get(name)
+        if node is None:
+            raise KeyError(name)
+        return node
+
+    def get(self, name, default=None):
+        for node in self._items:
+            if node.name == name:
+                return node
+        return default
+
+    def new(self, node_type):
+        node = _Node(*self.types[node_type])
+        self._items.append(node)
+        return node
+
+    def remove(self, node):
+        self._items.remove(node)
+        if self.active is node:
+            self.active = None
+
+
+class _Links(object):
+    def __init__(self):
+        self.links = []
+
+    def new(self, output, input):
+        self.links.append((output, input))
+
+
+class _NodeTree(object):
+    def __init__(self):
+        self.nodes = _Nodes()
+        self.links = _Links()
+        self.nodes.new("CompositorNodeRLayers")
+        self.nodes.new("CompositorNodeComposite")
+
+
+class _Pixels(object):
+    def __init__(self, image):
+        self.image = image
+
+    def __len__(self):
+        return len(self.image._pixels)
+
+    def foreach_get(self, seq):
+        seq[:] = self.image._pixels
+
+
+class _Image(object):
+    def __init__(self, name, width, height, channels=4):
+        self.name = name
+        self.type = "COMPOSITING"
+        self.size = (width, height)
+        self.channels = channels
+        self._pixels = array.array("f", [0.5]) * (width * height * channels)
+        self.pixels = _Pixels(self)
+
+    def buffers_free(self):
+        pass
+
+
+class _Scene(object):
+    def __init__(self):
+        self.name = "Scene"
+        self.use_nodes = False
+        self.node_tree = _NodeTree()
+        self.render = _RenderSettings()
+        self.sequencer_colorspace_settings = _ColorspaceSettings()
+        self.view_settings = _ViewSettings()
+        self.camera = None
+        self.world = None
+        self.frame_start = 1
+        self.frame_end = 24
+        self.frame_current = 1
+
+    @property
+    def objects(self):
+        return data.objects.values()
+
+    def frame_set(self, frame):
+        self.frame_current = frame
+
+
+class _Collection(object):
+    def __init__(self):
+        self._items = {}
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __getitem__(self, name):
+        return self._items[name]
+
+    def get(self, name, default=None):
+        return self._items.get(name, default)
+
+    def keys(self):
+        return list(self._items.keys())
+
+    def values(self):
+        return list(self._items.values())
+
+    def clear(self):
+        self._items.clear()
+
+    def add(self, item):
+        self._items[item.name] = item
+        return item
+
+
+class _Data(object):
+    def __init__(self):
+        self.filepath = ""
+        self.is_dirty = False
+        self.objects = _Collection()
+        self.materials = _Collection()
+        self.images = _Collection()
+        self.actions = _Collection()
+
+    def orphans_purge(self, do_recursive=False, **kwargs):
+        return 0
+
+
+class _Vertices(object):
+    def __init__(self, count):
+        self._coordinates = array.array("f", [0.0]) * (3 * count)
+
+    def __len__(self):
+        return len(self._coordinates) // 3
+
+    def foreach_get(self, attribute, seq):
+        seq[:] = self._coordinates
+
+
+class _Mesh(object):
+    def __init__(self, vertex_count=8):
+        self.vertices = _Vertices(vertex_count)
+
+
+class _FCurve(object):
+    def __init__(self, data_path, array_index):
+        self.data_path = data_path
+        self.array_index = array_index
+
+    def evaluate(self, frame):
+        return float(frame) * (self.array_index + 1)
+
+
+class _Action(object):
+    def __init__(self, name):
+        self.name = name
+        self.fcurves = [_FCurve("location", index) for index in range(3)]
+
+
+class _Camera(object):
+    def __init__(self):
+        self.lens = 50.0
+        self.clip_start = 0.1
+        self.clip_end = 1000.0
+
+
+class _WindowManager(object):
+    def __init__(self):
+        self.windows = []
+
+
+class _Preferences(object):
+    def __init__(self):
+        self.addons = {"cycles": None, "io_scene_fbx": None}
+
+
+class _Context(object):
+    def __init__(self):
+        self.scene = _Scene()
+        self.window_manager = _WindowManager()
+        self.preferences = _Preferences()
+
+    def evaluated_depsgraph_get(self):
+        return None
+
+
+class types(object):
+    class Object(object):
+        def __init__(self, name, object_type):
+            self.name = name
+            self.type = object_type
+            self.hide_render = False
+            self.matrix_world = tuple(
+                tuple(float(row == column) for column in range(4))
+                for row in range(4)
+            )
+            self.data = _Camera() if object_type == "CAMERA" else None
+            self.pose = None
+
+        def evaluated_get(self, depsgraph):
+            return self
+
+        def to_mesh(self):
+            return _Mesh() if self.type == "MESH" else None
+
+        def to_mesh_clear(self):
+            pass
+
+    class Material(object):
+        def __init__(self, name):
+            self.name = name
+            self.diffuse_color = (0.8, 0.8, 0.8, 1.0)
+            self.node_tree = None
+
+    class RenderEngine(object):
+        pass
+
+
+def _write_output(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, "wb") as output_file:
+        output_file.write(b"\x89PNG\r\n\x1a\n")
+
+
+def _update_viewer_image():
+    """
+    Fill the Viewer Node image when the compositor has a Viewer node.
+    Its size is a fraction of the render resolution, to keep runs short.
+    """
+    scene = context.scene
+    if not scene.use_nodes:
+        return
+    if not any(node.type == "VIEWER" for node in scene.node_tree.nodes):
+        return
+    width = scene.render.resolution_x // 16
+    height = scene.render.resolution_y // 16
+    image = data.images.get("Viewer Node")
+    if image is None or image.size != (width, height):
+        data.images.add(_Image("Viewer Node", width, height))
+
+
+class _RenderOps(object):
+    @staticmethod
+    def render(animation=False, write_still=False):
+        if write_still or animation:
+            _write_output(context.scene.render.filepath)
+        _update_viewer_image()
+        return {"FINISHED"}
+
+    @staticmethod
+    def opengl(animation=False, write_still=False):
+        if write_still or animation:
+            _write_output(context.scene.render.filepath)
+        return {"FINISHED"}
+
+
+class _ConsoleOps(object):
+    @staticmethod
+    def scrollback_append(override, text="", type="OUTPUT"):
+        return {"FINISHED"}
+
+
+class _WindowManagerOps(object):
+    @staticmethod
+    def open_mainfile(filepath=""):
+        data.filepath = filepath
+        return {"FINISHED"}
+
+
+class ops(object):
+    wm = _WindowManagerOps
+    render = _RenderOps
+    console = _ConsoleOps
+
+
+data = _Data()
+context = _Context()
+
+
+def build_scene(objects=10, cameras=1, **kwargs):
+    """
+    Reset the scene and fill it with the given number of meshes and cameras.
+    """
+    global data, context
+    data = _Data()
+    context = _Context()
+    data.filepath = kwargs.get("filepath", "")
+    for index in range(objects):
+        data.objects.add(types.Object("Mesh.%04d" % index, "MESH"))
+    for index in range(cameras):
+        data.objects.add(types.Object("Camera.%04d" % index, "CAMERA"))
+    for index in range(max(1, objects // 10)):
+        data.materials.add(types.Material("Material.%04d" % index))
+        data.actions.add(_Action("Action.%04d" % index))
+    context.scene.camera = data.objects.get("Camera.0000")
+    return data
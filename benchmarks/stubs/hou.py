@@ -0,0 +1,312 @@
+"""
+Synthetic stand-in for the Houdini ``hou`` module.
+
+Call ``build_scene`` to populate ``/obj`` with geometry and cameras and
+``/out`` with render nodes.
+"""
+import os
+
+
+class paneTabType(object):
+    SceneViewer = "SceneViewer"
+
+
+class _Parm(object):
+    def __init__(self, node, name, value=""):
+        self._node = node
+        self._name = name
+        self._value = value
+
+    def name(self):
+        return self._name
+
+    def path(self):
+        return self._node.path() + "/" + self._name
+
+    def eval(self):
+        return self._value
+
+    def evalAsString(self):
+        return str(self._value)
+
+    def set(self, value):
+        self._value = value
+
+
+class _NodeType(object):
+    def __init__(self, name):
+        self._name = name
+        self._instances = []
+
+    def name(self):
+        return self._name
+
+    def description(self):
+        return self._name.replace("_", " ").title()
+
+    def instances(self):
+        return tuple(self._instances)
+
+
+class Node(object):
+    def __init__(self, name, parent=None, node_type=None, parms=()):
+        self._name = name
+        self._parent = parent
+        self._children = []
+        self._type = node_type
+        self._parms = dict((parm, _Parm(self, parm)) for parm in parms)
+        if parent is not None:
+            parent._children.append(self)
+        if node_type is not None:
+            node_type._instances.append(self)
+
+    def name(self):
+        return self._name
+
+    def path(self):
+        if self._parent is None:
+            return "/"
+        parent_path = self._parent.path().rstrip("/")
+        return parent_path + "/" + self._name
+
+    def type(self):
+        return self._type
+
+    def parm(self, name):
+        return self._parms.get(name)
+
+    def parms(self):
+        return tuple(self._parms.values())
+
+    def children(self):
+        return tuple(self._children)
+
+    def allSubChildren(self):
+        nodes = []
+        for child in self._children:
+            nodes.append(child)
+            nodes.extend(child.allSubChildren())
+        return tuple(nodes)
+
+    def __repr__(self):
+        return "<hou.%s at %s>" % (type(self).__name__, self.path())
+
+
+class ObjNode(Node):
+    pass
+
+
+class RopNode(Node):
+    def render(self, frame_range=(), output_file=None, **kwargs):
+        if output_file:
+            if frame_range:
+                start, end = int(frame_range[0]), int(frame_range[1])
+                for frame in range(start, end + 1):
+                    _touch(_expand_frame(output_file, frame))
+            else:
+                _touch(_expand_frame(output_file, int(_state["frame"])))
+
+
+class _GeometryViewportCamera(object):
+    def stash(self):
+        return _GeometryViewportCamera()
+
+
+class _Viewport(object):
+    def name(self):
+        return "persp1"
+
+    def camera(self):
+        return _state.get("viewport_camera")
+
+    def setCamera(self, camera_node):
+        _state["viewport_camera"] = camera_node
+
+    def defaultCamera(self):
+        return _GeometryViewportCamera()
+
+    def setDefaultCamera(self, camera):
+        _state["viewport_camera"] = None
+
+
+class _SceneViewer(object):
+    def name(self):
+        return "panetab1"
+
+    def curViewport(self):
+        return _Viewport()
+
+
+class _Desktop(object):
+    def name(self):
+        return "Build"
+
+    def paneTabOfType(self, pane_tab_type):
+        return _SceneViewer()
+
+
+class ui(object):
+    @staticmethod
+    def curDesktop():
+        return _Desktop()
+
+    @staticmethod
+    def postEventCallback(function):
+        function()
+
+
+class Color(object):
+    @staticmethod
+    def ocio_spaces():
+        return ("ACEScg", "Linear Rec.709 (sRGB)", "sRGB - Texture")
+
+
+class hda(object):
+    @staticmethod
+    def loadedFiles():
+        return ("oplib:/OPlibSop.hda",)
+
+
+class _NodeTypeCategory(object):
+    def nodeTypes(self):
+        return dict(
+            (name, _get_node_type(name)) for name in sorted(_RENDERER_PARMS)
+        )
+
+
+class playbar(object):
+    @staticmethod
+    def frameRange():
+        return (1.0, 24.0)
+
+
+def fps():
+    return 24.0
+
+
+def isUIAvailable():
+    return True
+
+
+class hipFile(object):
+    @staticmethod
+    def path():
+        return _state["hip"]
+
+    @staticmethod
+    def load(path, suppress_save_prompt=False, ignore_load_warnings=False):
+        _state["hip"] = path
+
+    @staticmethod
+    def hasUnsavedChanges():
+        return False
+
+
+def _touch(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, "wb") as output_file:
+        output_file.write(b"\x89PNG\r\n\x1a\n")
+
+
+def _expand_frame(path, frame):
+    return path.replace("$F4", "%04d" % frame).replace("$F", str(frame))
+
+
+_state = {}
+_node_types = {}
+_RENDERER_PARMS = {
+    "ifd": ("camera", "vm_picture", "f1", "f2"),
+    "opengl": ("camera", "picture", "f1", "f2"),
+    "Redshift_ROP": ("RS_renderCamera", "RS_outputFileNamePrefix"),
+}
+
+
+def _get_node_type(name):
+    if name not in _node_types:
+        _node_types[name] = _NodeType(name)
+    return _node_types[name]
+
+
+def objNodeTypeCategory():
+    return "Object"
+
+
+def ropNodeTypeCategory():
+    return _NodeTypeCategory()
+
+
+def nodeType(category, name):
+    return _get_node_type(name)
+
+
+def node(path):
+    if path == "/":
+        return _state["root"]
+    for child in _state["root"].allSubChildren():
+        if child.path() == path:
+            return child
+    return None
+
+
+def frame():
+    return _state["frame"]
+
+
+def setFrame(frame):
+    _state["frame"] = frame
+
+
+def applicationVersion():
+    return (19, 5, 640)
+
+
+def applicationVersionString():
+    return "19.5.640"
+
+
+def hscript(command):
+    for command in command.split(";"):
+        words = command.split()
+        if words[0] == "viewwrite":
+            path = command.rsplit(" ", 1)[-1].strip("'")
+            start, end = int(float(words[2])), int(float(words[3]))
+            for frame_number in range(start, end + 1):
+                _touch(_expand_frame(path, frame_number))
+        elif words[0] == "viewcamera":
+            _state["viewport_camera"] = node(words[2])
+    return ("", "")
+
+
+def build_scene(objects=10, cameras=1, rops=1, **kwargs):
+    """
+    Reset the hip file and create geometry, cameras and render nodes.
+    """
+    _node_types.clear()
+    root = Node("")
+    obj = Node("obj", root)
+    out = Node("out", root)
+    _state.clear()
+    _state.update(
+        {"root": root, "frame": 1.0, "hip": kwargs.get("filepath", "")}
+    )
+    geo_type = _get_node_type("geo")
+    cam_type = _get_node_type("cam")
+    for index in range(objects):
+        ObjNode("geo%d" % (index + 1), obj, geo_type, ("tx", "ty", "tz"))
+    for index in range(cameras):
+        ObjNode("cam%d" % (index + 1), obj, cam_type, ("tx", "ty", "tz"))
+    renderer_names = sorted(_RENDERER_PARMS)
+    for index in range(rops):
+        renderer = renderer_names[index % len(renderer_names)]
+        RopNode(
+            "%s%d" % (renderer.lower(), index + 1),
+            out,
+            _get_node_type(renderer),
+            _RENDERER_PARMS[renderer],
+        )
+    return root
+
+
+build_scene()
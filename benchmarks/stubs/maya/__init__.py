@@ -0,0 +1,3 @@
+"""
+Synthetic stand-in for the Maya ``maya`` package.
+"""
@@ -0,0 +1,267 @@
+"""
+Synthetic stand-in for ``maya.cmds``.
+
+Nodes and attributes live in plain dictionaries. Call ``build_scene`` to
+populate the scene with a given number of transforms and cameras.
+"""
+import os
+import tempfile
+
+_attributes = {}
+_cameras = {}
+_transforms = []
+_color_management = {
+    "cmEnabled": True,
+    "viewTransformName": "sRGB gamma",
+    "viewTransformNames": ["sRGB gamma", "Raw", "Log"],
+}
+_scene = {"name": "", "modified": False, "time": 1.0}
+_file_rules = {}
+_script_jobs = {}
+
+_RENDERERS = [
+    ("mayaSoftware", "Maya Software"),
+    ("mayaHardware2", "Maya Hardware 2.0"),
+    ("arnold", "Arnold Renderer"),
+]
+
+_DEFAULT_ATTRIBUTES = {
+    "defaultRenderGlobals.imageFormat": 32,
+    "defaultRenderGlobals.imageFilePrefix": "",
+    "defaultRenderGlobals.startFrame": 1.0,
+    "defaultRenderGlobals.endFrame": 24.0,
+    "defaultResolution.width": 1920,
+    "defaultResolution.height": 1080,
+    "defaultArnoldDriver.ai_translator": "exr",
+    "defaultArnoldDriver.pre": "",
+    "defaultRenderGlobals.numCpusToUse": 0,
+    "defaultRenderGlobals.useRenderRegion": False,
+    "defaultRenderGlobals.leftRegion": 0,
+    "defaultRenderGlobals.bottomRegion": 0,
+    "defaultRenderGlobals.rightRegion": 1919,
+    "defaultRenderGlobals.topRegion": 1079,
+    "defaultArnoldRenderOptions.threads_autodetect": True,
+    "defaultArnoldRenderOptions.threads": 0,
+    "defaultArnoldRenderOptions.bucketSize": 64,
+    "lambert1.color": [(0.5, 0.5, 0.5)],
+    "lambert1.transparency": [(0.0, 0.0, 0.0)],
+}
+
+
+def build_scene(objects=10, cameras=1, **kwargs):
+    """
+    Reset the scene and fill it with transforms and cameras.
+    """
+    _attributes.clear()
+    _attributes.update(_DEFAULT_ATTRIBUTES)
+    _file_rules.clear()
+    _file_rules["images"] = os.path.join(
+        kwargs.get("output_dir") or tempfile.gettempdir(), "images"
+    )
+    for job_id, job in list(_script_jobs.items()):
+        if job[2]:
+            del _script_jobs[job_id]
+    _cameras.clear()
+    del _transforms[:]
+    _scene["name"] = kwargs.get("filepath", "")
+    _scene["modified"] = False
+    for index in range(objects):
+        _transforms.append("pCube%d" % (index + 1))
+    for index in range(cameras):
+        camera_name = "camera%d" % (index + 1)
+        camera_shape = camera_name + "Shape"
+        _cameras[camera_name] = camera_shape
+        _attributes[camera_shape + ".renderable"] = index == 0
+        _attributes[camera_shape + ".focalLength"] = 35.0
+
+
+def about(version=False, **kwargs):
+    if version:
+        return "2024"
+    return None
+
+
+def ls(type=None, **kwargs):
+    if kwargs.get("materials"):
+        return ["lambert1"]
+    if kwargs.get("lights"):
+        return []
+    if type == "animCurve":
+        return []
+    if type == "camera":
+        return list(_cameras.values())
+    if type == "transform":
+        return list(_transforms) + list(_cameras.keys())
+    return list(_transforms) + list(_cameras.keys())
+
+
+def objExists(name):
+    return name in _attributes or any(
+        attribute.split(".")[0] == name for attribute in _attributes
+    )
+
+
+def listCameras(**kwargs):
+    return list(_cameras.keys())
+
+
+def listRelatives(node, type=None, s=False, **kwargs):
+    if type == "camera" and node in _cameras:
+        return [_cameras[node]]
+    return None
+
+
+def getAttr(attribute, **kwargs):
+    return _attributes[attribute]
+
+
+def setAttr(attribute, value, type=None, **kwargs):
+    _attributes[attribute] = value
+    for kind, name, _, function in list(_script_jobs.values()):
+        if kind == "attributeChange" and name == attribute:
+            function()
+
+
+def scriptJob(event=None, attributeChange=None, killWithScene=False, **kwargs):
+    """
+    Register a job, run by setAttr for attributeChange jobs and by
+    _fire_event for event jobs.
+    """
+    if event is not None:
+        job = ("event", event[0], killWithScene, event[1])
+    else:
+        job = (
+            "attributeChange",
+            attributeChange[0],
+            killWithScene,
+            attributeChange[1],
+        )
+    job_id = len(_script_jobs) + 1
+    while job_id in _script_jobs:
+        job_id += 1
+    _script_jobs[job_id] = job
+    return job_id
+
+
+def _fire_event(name):
+    for kind, job_name, _, function in list(_script_jobs.values()):
+        if kind == "event" and job_name == name:
+            function()
+
+
+def refresh(cv=False, fe=None, fn=None, **kwargs):
+    if fn:
+        _touch(fn)
+
+
+def playblast(filename=None, **kwargs):
+    if filename:
+        _touch(filename)
+    return filename
+
+
+def pluginInfo(*args, **kwargs):
+    if kwargs.get("listPlugins"):
+        return ["mtoa", "fbxmaya"]
+    if args and kwargs.get("loaded"):
+        return args[0] in ("mtoa", "fbxmaya")
+    return None
+
+
+def flushUndo():
+    pass
+
+
+def clearCache(all=False):
+    pass
+
+
+def arnoldFlushCache(**kwargs):
+    pass
+
+
+def renderer(name=None, query=False, **kwargs):
+    if kwargs.get("namesOfAvailableRenderers"):
+        return [renderer_id for renderer_id, _ in _RENDERERS]
+    if kwargs.get("rendererUIName"):
+        return dict(_RENDERERS)[name]
+    return None
+
+
+def colorManagementPrefs(q=False, e=False, edit=False, **kwargs):
+    if q or kwargs.pop("query", False):
+        for key in kwargs:
+            return _color_management.get(key)
+        return None
+    _color_management.update(kwargs)
+    _fire_event("colorMgtPrefsChanged")
+
+
+def file(*args, **kwargs):
+    if kwargs.get("q") or kwargs.get("query"):
+        if kwargs.get("sn") or kwargs.get("sceneName"):
+            return _scene["name"]
+        if kwargs.get("modified"):
+            return _scene["modified"]
+    elif args and (kwargs.get("o") or kwargs.get("open")):
+        _scene["name"] = args[0]
+        _scene["modified"] = False
+    return None
+
+
+def sysFile(path, rename=None, **kwargs):
+    if rename:
+        os.rename(path, rename)
+    return True
+
+
+def xform(node, query=False, ws=False, matrix=False, **kwargs):
+    if query and matrix:
+        return [float(index % 5 == 0) for index in range(16)]
+    return None
+
+
+def attributeQuery(attribute, node=None, exists=False, **kwargs):
+    return node + "." + attribute in _attributes
+
+
+def currentUnit(query=False, time=False, **kwargs):
+    if query and time:
+        return "film"
+    return None
+
+
+def currentTime(*args, **kwargs):
+    if args:
+        _scene["time"] = float(args[0])
+    return _scene["time"]
+
+
+def _touch(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, "wb") as output_file:
+        output_file.write(b"\x89PNG\r\n\x1a\n")
+
+
+def workspace(fileRuleEntry=None, fileRule=None, **kwargs):
+    if fileRuleEntry is not None:
+        return _file_rules.get(fileRuleEntry, "")
+    if fileRule is not None:
+        _file_rules[fileRule[0]] = fileRule[1]
+    return None
+
+
+def _render_image():
+    """
+    Write an image in the images folder of the workspace, named after the
+    image file prefix, like the render command does.
+    """
+    prefix = _attributes["defaultRenderGlobals.imageFilePrefix"] or "render"
+    path = os.path.join(_file_rules["images"], "tmp", prefix + ".png")
+    _touch(path)
+    return path
+
+
+build_scene()
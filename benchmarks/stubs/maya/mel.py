@@ -0,0 +1,10 @@
+"""
+Synthetic stand-in for ``maya.mel``.
+"""
+from . import cmds
+
+
+def eval(command):
+    if command.startswith("render"):
+        return cmds._render_image()
+    return None
@@ -0,0 +1,8 @@
+"""
+Synthetic stand-in for ``maya.utils``.
+"""
+
+
+def executeDeferred(function, *args):
+    # Like Maya in batch mode, run the function right away.
+    function(*args)
@@ -0,0 +1,343 @@
+"""
+Synthetic stand-in for the Unreal Editor ``unreal`` module.
+
+Latent commands are queued on the ``AutomationScheduler`` instances and
+only run when ``tick`` is called, mimicking the editor tick loop. Call
+``build_scene`` to populate the level with actors and the asset registry
+with assets.
+"""
+import os
+import tempfile
+
+_state = {}
+_schedulers = []
+
+
+def _touch(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, "wb") as output_file:
+        output_file.write(b"\x89PNG\r\n\x1a\n")
+
+
+def log(data):
+    pass
+
+
+def tick():
+    """
+    Run the latent commands queued so far, once.
+    """
+    for scheduler in _schedulers:
+        commands = scheduler._commands
+        scheduler._commands = []
+        for command in commands:
+            command()
+
+
+class Name(str):
+    pass
+
+
+class OnRenderMovieStopped(object):
+    def __init__(self):
+        self._callable = None
+
+    def bind_callable(self, function):
+        self._callable = function
+
+    def call(self, success):
+        if self._callable is not None:
+            self._callable(success)
+
+
+class _Delegate(object):
+    def __init__(self):
+        self._callables = []
+
+    def add_callable(self, function):
+        self._callables.append(function)
+
+    def broadcast(self, *args):
+        for function in self._callables:
+            function(*args)
+
+
+class AutomationScheduler(object):
+    def __init__(self):
+        self._commands = []
+        _schedulers.append(self)
+
+    def add_latent_command(self, function):
+        self._commands.append(function)
+
+
+class Actor(object):
+    def __init__(self, label):
+        self._label = label
+        self._destroyed = False
+
+    def get_actor_label(self):
+        return self._label
+
+    def set_actor_label(self, label):
+        self._label = label
+
+    def get_path_name(self):
+        return "/Game/Maps/Main.Main:PersistentLevel." + self._label
+
+
+class StaticMeshActor(Actor):
+    pass
+
+
+class CameraActor(Actor):
+    pass
+
+
+class SystemLibrary(object):
+    @staticmethod
+    def get_engine_version():
+        return "5.3.2-29314046+++UE5+Release-5.3"
+
+    @staticmethod
+    def collect_garbage():
+        pass
+
+    @staticmethod
+    def is_valid(obj):
+        return obj is not None and not getattr(obj, "_destroyed", False)
+
+
+class Paths(object):
+    @staticmethod
+    def get_project_file_path():
+        return _state.get("project", "")
+
+    @staticmethod
+    def screen_shot_dir():
+        return _state["screenshot_dir"]
+
+    @staticmethod
+    def video_capture_dir():
+        return _state["video_dir"]
+
+
+class LevelSequenceEditorBlueprintLibrary(object):
+    @staticmethod
+    def get_current_level_sequence():
+        return _state.get("level_sequence")
+
+    @staticmethod
+    def open_level_sequence(sequence):
+        _state["level_sequence"] = sequence
+        return True
+
+    @staticmethod
+    def get_current_time():
+        return _state.get("time", 0)
+
+    @staticmethod
+    def set_current_time(frame):
+        _state["time"] = frame
+
+    @staticmethod
+    def is_camera_cut_locked_to_viewport():
+        return _state.get("camera_cut_locked", False)
+
+    @staticmethod
+    def set_lock_camera_cut_to_viewport(lock):
+        _state["camera_cut_locked"] = lock
+
+
+class _World(object):
+    pass
+
+
+class UnrealEditorSubsystem(object):
+    def get_level_viewport_camera_info(self):
+        return _state.get("viewport_camera_info", ((0, 0, 0), (0, 0, 0)))
+
+    def set_level_viewport_camera_info(self, location, rotation):
+        _state["viewport_camera_info"] = (location, rotation)
+
+    def get_editor_world(self):
+        return _state["world"]
+
+
+class EditorActorSubsystem(object):
+    def __init__(self):
+        self.on_new_actors_dropped = _Delegate()
+        self.on_delete_actors_end = _Delegate()
+        self.on_duplicate_actors_end = _Delegate()
+        self.on_edit_paste_actors_end = _Delegate()
+        self.on_edit_cut_actors_end = _Delegate()
+
+
+class LevelEditorSubsystem(object):
+    def __init__(self):
+        self.on_map_changed = _Delegate()
+        self.on_map_opened = _Delegate()
+
+    def pilot_level_actor(self, actor):
+        _state["pilot"] = actor
+
+    def eject_pilot_level_actor(self):
+        _state["pilot"] = None
+
+
+def get_editor_subsystem(subsystem_class):
+    subsystems = _state.setdefault("subsystems", {})
+    if subsystem_class not in subsystems:
+        subsystems[subsystem_class] = subsystem_class()
+    return subsystems[subsystem_class]
+
+
+class EditorLoadingAndSavingUtils(object):
+    @staticmethod
+    def load_map(path):
+        _state["map"] = path
+        return _state["world"]
+
+    @staticmethod
+    def get_dirty_map_packages():
+        return []
+
+    @staticmethod
+    def get_dirty_content_packages():
+        return []
+
+
+class AutomationLibrary(object):
+    @staticmethod
+    def take_high_res_screenshot(res_x, res_y, filename, camera=None, *args):
+        _touch(os.path.join(_state["screenshot_dir"], filename))
+        return True
+
+
+class _AssetData(object):
+    def __init__(self, asset_name, object_path, asset_class):
+        self.asset_name = Name(asset_name)
+        self.object_path = Name(object_path)
+        self.asset_class = Name(asset_class)
+
+
+class _AssetRegistry(object):
+    def get_assets_by_path(self, path, recursive=False):
+        return list(_state["assets"])
+
+
+class AssetRegistryHelpers(object):
+    @staticmethod
+    def get_asset_registry():
+        return _AssetRegistry()
+
+
+class FrameRate(object):
+    def __init__(self, numerator=24, denominator=1):
+        self.numerator = numerator
+        self.denominator = denominator
+
+
+class LevelSequence(object):
+    def __init__(self, path):
+        self.path = path
+
+    def get_display_rate(self):
+        return FrameRate(24, 1)
+
+    def get_playback_start(self):
+        return 0
+
+    def get_playback_end(self):
+        return _state.get("frames", 24)
+
+
+def load_asset(path):
+    return LevelSequence(path)
+
+
+class SoftObjectPath(object):
+    def __init__(self, path):
+        self.path = path
+
+
+class _Resolution(object):
+    def __init__(self):
+        self.res_x = 1280
+        self.res_y = 720
+
+
+class _CaptureSettings(object):
+    def __init__(self):
+        self.output_format = ""
+        self.overwrite_existing = False
+        self.resolution = _Resolution()
+
+
+class AutomatedLevelSequenceCapture(object):
+    def __init__(self):
+        self.settings = _CaptureSettings()
+        self.level_sequence_asset = None
+
+
+class SequencerTools(object):
+    @staticmethod
+    def render_movie(capture_settings, on_finished):
+        filename = capture_settings.settings.output_format + ".avi"
+        _touch(os.path.join(_state["video_dir"], filename))
+        on_finished.call(True)
+        return True
+
+
+class GameplayStatics(object):
+    @staticmethod
+    def get_all_actors_of_class(world, actor_class):
+        return [
+            actor
+            for actor in _state["actors"]
+            if isinstance(actor, actor_class)
+        ]
+
+
+class _ColorSpace(object):
+    def __init__(self, name):
+        self.name = name
+
+
+TextureColorSpace = [_ColorSpace(name) for name in ("NONE", "SRGB", "REC709")]
+
+
+class TextureSourceColorSettings(object):
+    def __init__(self):
+        self.color_space = TextureColorSpace[1]
+
+
+def build_scene(objects=10, cameras=1, assets=10, **kwargs):
+    """
+    Reset the level and the asset registry.
+    """
+    output_dir = kwargs.get("output_dir") or tempfile.mkdtemp()
+    _state.clear()
+    _state.update(
+        {
+            "project": kwargs.get("filepath", ""),
+            "screenshot_dir": os.path.join(output_dir, "Screenshots"),
+            "video_dir": os.path.join(output_dir, "VideoCaptures"),
+            "world": _World(),
+            "assets": [],
+            "actors": [],
+        }
+    )
+    for index in range(objects):
+        _state["actors"].append(StaticMeshActor("Cube%d" % index))
+    for index in range(cameras):
+        _state["actors"].append(CameraActor("CameraActor%d" % index))
+    for index in range(assets):
+        asset_class = "LevelSequence" if index % 10 == 0 else "StaticMesh"
+        name = "Asset%d" % index
+        _state["assets"].append(
+            _AssetData(name, "/Game/%s.%s" % (name, name), asset_class)
+        )
+    return _state
@@ -0,0 +1,196 @@
+"""
+Local stand-in for the upload server of ``dccutils.publish``.
+
+It keeps the uploads in memory and implements the chunked protocol: PUT
+chunks answered with 308, HEAD to resume and POST to complete. Faults can
+be queued to test the retries: each is a (method, fault) tuple applied to
+the next request with that method, fault being one of:
+
+* "drop": close the connection without answering,
+* "lose": handle the request, then close the connection without answering,
+* "hang": keep the connection open without answering until the server
+  stops,
+* "malformed": answer with a status line that is not HTTP,
+* an HTTP status code, answered without handling the request.
+"""
+import collections
+import hashlib
+import io
+import json
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer was added in Python 3.7.
+    daemon_threads = True
+
+
+class StoredUpload(object):
+    def __init__(self):
+        self.data = bytearray()
+        self.completed = None
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def get_fault(self):
+        server = self.server
+        with server.lock:
+            server.requests[self.command] += 1
+            if server.faults and server.faults[0][0] == self.command:
+                return server.faults.popleft()[1]
+        return None
+
+    def get_upload(self, create=False):
+        with self.server.lock:
+            upload = self.server.uploads.get(self.path)
+            if upload is None and create:
+                upload = self.server.uploads[self.path] = StoredUpload()
+            return upload
+
+    def answer(self, status, headers=None, body=b""):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def answer_received(self, upload):
+        headers = {}
+        if upload is not None and upload.data:
+            headers["Range"] = "bytes=0-%d" % (len(upload.data) - 1)
+        self.answer(308, headers)
+
+    def handle_request(self, handler):
+        body = self.read_body() if self.command != "HEAD" else b""
+        fault = self.get_fault()
+        if fault == "hang":
+            self.server.stopped.wait()
+            self.close_connection = True
+            return
+        if fault == "drop":
+            self.close_connection = True
+            return
+        if fault == "malformed":
+            self.wfile.write(b"garbage\r\n\r\n")
+            self.close_connection = True
+            return
+        if isinstance(fault, int):
+            self.answer(fault)
+            return
+        if fault == "lose":
+            # Handle the request but don't answer it.
+            self.wfile = io.BytesIO()
+            self.close_connection = True
+        handler(body)
+
+    def do_HEAD(self):
+        def handle(body):
+            upload = self.get_upload()
+            if upload is None:
+                self.answer(404)
+            elif upload.completed is not None:
+                self.answer(200)
+            else:
+                self.answer_received(upload)
+
+        self.handle_request(handle)
+
+    def do_PUT(self):
+        def handle(body):
+            upload = self.get_upload(create=True)
+            value = self.headers["Content-Range"].split(" ")[1]
+            start = int(value.split("-")[0])
+            with self.server.lock:
+                if start > len(upload.data):
+                    self.answer(416)
+                    return
+                del upload.data[start:]
+                upload.data += body
+            self.answer_received(upload)
+
+        self.handle_request(handle)
+
+    def do_POST(self):
+        def handle(body):
+            upload = self.get_upload(create=True)
+            request = json.loads(body.decode("utf-8"))
+            sha256 = hashlib.sha256(bytes(upload.data)).hexdigest()
+            if request["sha256"] != sha256:
+                self.answer(422, body=b"Checksum mismatch")
+                return
+            upload.completed = request["metadata"]
+            response = {"size": len(upload.data), "sha256": sha256}
+            self.answer(
+                201,
+                {"Content-Type": "application/json"},
+                json.dumps(response).encode("utf-8"),
+            )
+
+        self.handle_request(handle)
+
+
+class UploadServer(object):
+    def __init__(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), UploadHandler)
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.uploads = {}
+        self.server.faults = collections.deque()
+        self.server.requests = collections.Counter()
+        self.server.stopped = threading.Event()
+        self.thread = None
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d/uploads" % self.server.server_address[1]
+
+    @property
+    def uploads(self):
+        return self.server.uploads
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def add_faults(self, *faults):
+        self.server.faults.extend(faults)
+
+    def get_upload(self, name):
+        """
+        Return the upload whose URL ends with name.
+        """
+        for path, upload in self.server.uploads.items():
+            if path.endswith("/" + name):
+                return upload
+        return None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,)
+        )
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,238 @@
+"""
+Command line entry point: python -m dccutils --help
+"""
+import argparse
+import sys
+
+from . import batch, coordinator, worker
+
+
+def run_batch(args):
+    jobs = batch.load_manifest(args.manifest)
+    runner = batch.BatchRunner(
+        args.workers, args.retries, args.timeout, args.warm
+    )
+    report = runner.run(jobs)
+    batch.write_report(report, args.report)
+    return 0 if report["summary"]["failed"] == 0 else 1
+
+
+def run_pool(args):
+    pool = worker.WorkerPool(
+        args.dcc,
+        args.workers,
+        args.max_jobs,
+        args.max_rss * 1024**2 if args.max_rss else None,
+        free_rss=args.free_rss * 1024**2 if args.free_rss else None,
+    )
+    pool.start()
+    server = pool.serve((args.bind, args.port))
+    print(
+        "Serving %d %s workers on %s:%d"
+        % (pool.size, args.dcc, args.bind, server.server_address[1])
+    )
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+    return 0
+
+
+def run_submit(args):
+    broker = coordinator.Broker(args.broker)
+    run = broker.submit(
+        batch.load_manifest(args.manifest), args.chunk_size, args.retries
+    )
+    print(run)
+    return 0
+
+
+def run_work(args):
+    jobs_done = coordinator.run_workers(
+        args.broker,
+        args.workers,
+        args.hosts,
+        args.lease,
+        args.timeout,
+        args.warm,
+        args.exit_when_empty,
+    )
+    print("%d jobs done" % jobs_done)
+    return 0
+
+
+def run_status(args):
+    broker = coordinator.Broker(args.broker)
+    if args.wait and not broker.wait(args.run, args.timeout):
+        print("Timed out waiting for the jobs.", file=sys.stderr)
+    report = broker.get_report(args.run)
+    batch.write_report(report, args.report)
+    summary = report["summary"]
+    if summary["failed"] or (args.wait and broker.is_pending(args.run)):
+        return 1
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m dccutils",
+        description="Capture previews from DCC scene files.",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    batch_parser = subparsers.add_parser(
+        "batch",
+        help="run the captures of a manifest in background DCC processes",
+    )
+    batch_parser.add_argument("manifest", help="JSON file listing the jobs")
+    batch_parser.add_argument(
+        "--workers",
+        type=int,
+        help="processes running at the same time (default: number of cores)",
+    )
+    batch_parser.add_argument(
+        "--retries",
+        type=int,
+        default=1,
+        help="times a failed job is run again",
+    )
+    batch_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=3600,
+        help="time in seconds after which a job is killed",
+    )
+    batch_parser.add_argument(
+        "--report", help="write the JSON report to this file (default: stdout)"
+    )
+    batch_parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="run the jobs in persistent workers rather than one process "
+        "per job",
+    )
+    batch_parser.set_defaults(function=run_batch)
+
+    pool_parser = subparsers.add_parser(
+        "pool",
+        help="share a pool of warm DCC workers with other processes",
+    )
+    pool_parser.add_argument(
+        "dcc", choices=sorted(batch.HOST_EXECUTABLES), help="host to run"
+    )
+    pool_parser.add_argument(
+        "--workers",
+        type=int,
+        help="number of workers (default: number of cores)",
+    )
+    pool_parser.add_argument("--bind", default="127.0.0.1")
+    pool_parser.add_argument("--port", type=int, default=7600)
+    pool_parser.add_argument(
+        "--max-jobs",
+        type=int,
+        default=50,
+        help="jobs after which a worker is restarted",
+    )
+    pool_parser.add_argument(
+        "--max-rss",
+        type=int,
+        help="memory usage in MB above which a worker is restarted",
+    )
+    pool_parser.add_argument(
+        "--free-rss",
+        type=int,
+        help="memory usage in MB above which a worker frees the DCC caches "
+        "after a job",
+    )
+    pool_parser.set_defaults(function=run_pool)
+
+    submit_parser = subparsers.add_parser(
+        "submit",
+        help="queue the jobs of a manifest in a broker shared by many nodes",
+    )
+    submit_parser.add_argument("broker", help="SQLite database of the jobs")
+    submit_parser.add_argument("manifest", help="JSON file listing the jobs")
+    submit_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        help="split the animations with a frame_range in chunks of this "
+        "many frames",
+    )
+    submit_parser.add_argument(
+        "--retries",
+        type=int,
+        default=1,
+        help="times a failed job is run again",
+    )
+    submit_parser.set_defaults(function=run_submit)
+
+    work_parser = subparsers.add_parser(
+        "work", help="run the jobs queued in a broker on this node"
+    )
+    work_parser.add_argument("broker", help="SQLite database of the jobs")
+    work_parser.add_argument(
+        "--workers",
+        type=int,
+        help="jobs running at the same time (default: number of cores)",
+    )
+    work_parser.add_argument(
+        "--hosts",
+        nargs="+",
+        choices=sorted(batch.HOST_EXECUTABLES),
+        help="hosts installed on this node (default: all)",
+    )
+    work_parser.add_argument(
+        "--lease",
+        type=float,
+        default=60,
+        help="time in seconds after which the job of a silent worker is "
+        "given to another one",
+    )
+    work_parser.add_argument(
+        "--timeout",
+        type=float,
+        default=3600,
+        help="time in seconds after which a job is killed",
+    )
+    work_parser.add_argument(
+        "--warm",
+        action="store_true",
+        help="run the jobs in persistent workers rather than one process "
+        "per job",
+    )
+    work_parser.add_argument(
+        "--exit-when-empty",
+        action="store_true",
+        help="exit once no job is pending instead of waiting for new ones",
+    )
+    work_parser.set_defaults(function=run_work)
+
+    status_parser = subparsers.add_parser(
+        "status", help="report the jobs of a broker"
+    )
+    status_parser.add_argument("broker", help="SQLite database of the jobs")
+    status_parser.add_argument("run", nargs="?", help="run to report")
+    status_parser.add_argument(
+        "--wait",
+        action="store_true",
+        help="wait until the jobs are done or failed",
+    )
+    status_parser.add_argument(
+        "--timeout", type=float, help="time in seconds to wait at most"
+    )
+    status_parser.add_argument(
+        "--report", help="write the JSON report to this file (default: stdout)"
+    )
+    status_parser.set_defaults(function=run_status)
+
+    args = parser.parse_args(argv)
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
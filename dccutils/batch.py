@@ -0,0 +1,388 @@
+"""
+Module that runs captures on many scene files in background DCC processes.
+
+A manifest lists the jobs; each job is run in its own host process (blender
+-b, mayapy, hython) by a bounded pool, with retries and a timeout per job.
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+
+from .compat import cpu_count
+from .exceptions import CaptureFailed
+from .software import SoftwareContext
+
+HOST_EXTENSIONS = {
+    ".blend": "blender",
+    ".ma": "maya",
+    ".mb": "maya",
+    ".hip": "houdini",
+    ".hipnc": "houdini",
+    ".hiplc": "houdini",
+}
+
+HOST_EXECUTABLES = {
+    "blender": ("DCCUTILS_BLENDER", "blender"),
+    "maya": ("DCCUTILS_MAYAPY", "mayapy"),
+    "houdini": ("DCCUTILS_HYTHON", "hython"),
+}
+
+CAPTURES = (
+    "render_screenshot",
+    "viewport_screenshot",
+    "render_animation",
+    "viewport_animation",
+    "incremental_animation",
+    "render_frames",
+)
+
+HOST_SCRIPT = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "batch_host.py"
+)
+
+
+def load_manifest(path):
+    """
+    Load a JSON manifest: a list of jobs, or a dict with a "jobs" list.
+    Each job needs a "scene" and an "output". "capture" (render_screenshot by
+    default), "camera", "renderer", "extension", "options", "host",
+    "timeout" and "retries" are optional. render_frames jobs render the
+    frames of "frame_range" to PNG images, output being a printf style
+    pattern (frame.%04d.png), with the viewport if "viewport" is set.
+    """
+    with open(path) as manifest_file:
+        manifest = json.load(manifest_file)
+    jobs = manifest["jobs"] if isinstance(manifest, dict) else manifest
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for index, job in enumerate(jobs):
+        for key in ("scene", "output"):
+            if key not in job:
+                raise ValueError("Job %d has no %s." % (index, key))
+            job[key] = os.path.join(base_dir, os.path.expanduser(job[key]))
+        job.setdefault("capture", "render_screenshot")
+        if job["capture"] not in CAPTURES:
+            raise ValueError(
+                "Job %d: unknown capture %s." % (index, job["capture"])
+            )
+        job.setdefault("host", get_scene_host(job["scene"]))
+    return jobs
+
+
+def get_scene_host(scene_path):
+    extension = os.path.splitext(scene_path)[1].lower()
+    if extension not in HOST_EXTENSIONS:
+        raise ValueError("No DCC known to open %s." % scene_path)
+    return HOST_EXTENSIONS[extension]
+
+
+def get_host_executable(host):
+    variable, default = HOST_EXECUTABLES[host]
+    return os.environ.get(variable) or default
+
+
+def get_host_threads(workers):
+    """
+    Return the number of render threads of each host when the given number
+    of hosts run at the same time, so they don't oversubscribe the cores.
+    """
+    return max(1, cpu_count() // workers)
+
+
+def get_host_command(host, scene_path, arguments, threads=None):
+    """
+    Return the command line running the batch host script in a background
+    host process, with the given script arguments. Blender loads scene_path
+    at startup, if given.
+    """
+    executable = get_host_executable(host)
+    if host == "blender":
+        command = [executable, "-b"]
+        if threads:
+            command += ["--threads", str(threads)]
+        if scene_path:
+            command.append(scene_path)
+        return command + ["--python", HOST_SCRIPT, "--"] + arguments
+    return [executable, HOST_SCRIPT] + arguments
+
+
+def get_host_environment(threads=None):
+    """
+    Make dccutils importable from the host process, and limit its number of
+    render threads if threads is given.
+    """
+    environment = dict(os.environ)
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    python_path = environment.get("PYTHONPATH")
+    environment["PYTHONPATH"] = (
+        package_dir + os.pathsep + python_path if python_path else package_dir
+    )
+    if threads:
+        # Read by the Maya context, Houdini reads its own variable.
+        environment["DCCUTILS_THREADS"] = str(threads)
+        environment["HOUDINI_MAXTHREADS"] = str(threads)
+    return environment
+
+
+def resolve(value, choices):
+    """
+    Return the object matching value among choices, a list of names or of
+    (name, object) tuples as returned by get_cameras and
+    get_available_renderers. Node paths match too.
+    """
+    if value is None:
+        return None
+    for choice in choices or []:
+        if not isinstance(choice, tuple):
+            if choice == value:
+                return choice
+            continue
+        name, obj = choice
+        if value == name or value == obj:
+            return obj
+        if hasattr(obj, "path") and callable(obj.path):
+            if obj.path() == value:
+                return obj
+    return value
+
+
+def get_extension_argument(context, output_path, is_video):
+    """
+    Return the host specific extension argument matching the extension of
+    output_path.
+    """
+    extension = os.path.splitext(output_path)[1].lower()
+    for name, argument in context.get_extensions(is_video) or []:
+        if name == extension:
+            return argument
+    return extension
+
+
+def run_job(context, job):
+    """
+    Run a capture job in the current host and return its result. The job
+    fails if an output is missing or empty once the capture returned.
+    """
+    if type(context) is SoftwareContext:
+        # Its captures do nothing: the host context failed to import.
+        raise CaptureFailed("No DCC context could be loaded in this host.")
+    start = time.time()
+    scene_path = os.path.abspath(job["scene"])
+    current_path = context.get_current_project_path()
+    if not current_path or os.path.abspath(current_path) != scene_path:
+        context.open_scene(scene_path)
+
+    capture = job.get("capture", "render_screenshot")
+    output_path = job["output"]
+    output_dir = os.path.dirname(output_path)
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    renderer = resolve(job.get("renderer"), context.get_available_renderers())
+    extension = job.get("extension")
+    if extension is None and capture != "render_frames":
+        is_video = capture.endswith("animation")
+        extension = get_extension_argument(context, output_path, is_video)
+    options = job.get("options", {})
+
+    with context.preserved_state():
+        if job.get("camera"):
+            camera = resolve(job["camera"], context.get_cameras())
+            context.set_camera(camera, render_node=renderer)
+        if capture == "render_screenshot":
+            context.take_render_screenshot(
+                renderer, output_path, extension, **options
+            )
+        elif capture == "viewport_screenshot":
+            context.take_viewport_screenshot(output_path, extension, **options)
+        elif capture == "render_animation":
+            context.take_render_animation(
+                renderer, output_path, extension, **options
+            )
+        elif capture == "viewport_animation":
+            context.take_viewport_animation(output_path, extension, **options)
+        elif capture == "render_frames":
+            first_frame, last_frame = job["frame_range"]
+            for frame in range(first_frame, last_frame + 1):
+                context.render_frame(
+                    renderer,
+                    frame,
+                    output_path % frame,
+                    viewport=job.get("viewport", False),
+                )
+        else:
+            context.take_incremental_animation(
+                renderer, output_path, **options
+            )
+    if capture == "render_frames":
+        first_frame, last_frame = job["frame_range"]
+        output_paths = [
+            output_path % frame for frame in range(first_frame, last_frame + 1)
+        ]
+    else:
+        output_paths = [output_path]
+    for path in output_paths:
+        if not os.path.isfile(path) or not os.path.getsize(path):
+            raise CaptureFailed("The capture didn't write %s." % path)
+    result = {
+        "status": "done",
+        "output": output_path,
+        "capture_duration": time.time() - start,
+    }
+    if capture == "render_frames":
+        result["frame_rate"] = context.get_frame_rate()
+    return result
+
+
+def get_error_message(exception):
+    if str(exception):
+        return "%s: %s" % (type(exception).__name__, exception)
+    return type(exception).__name__
+
+
+def run_job_safely(context, job):
+    """
+    Run a capture job like run_job, but return a failed result rather than
+    raising.
+    """
+    try:
+        return run_job(context, job)
+    except Exception as exception:
+        return {
+            "status": "failed",
+            "error": get_error_message(exception),
+            "log": traceback.format_exc()[-4000:],
+        }
+
+
+class BatchRunner(object):
+    def __init__(self, workers=None, retries=1, timeout=3600, warm=False):
+        """
+        :param workers: Number of host processes running at the same time,
+        the number of cores by default. The cores are shared between their
+        render threads
+        :param retries: Number of times a failed job is run again
+        :param timeout: Time in seconds after which a job is killed
+        :param warm: Run the jobs in persistent workers rather than in a new
+        process per job
+        """
+        self.workers = workers or cpu_count()
+        self.threads = get_host_threads(self.workers)
+        self.retries = retries
+        self.timeout = timeout
+        self.warm = warm
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def get_pool(self, host):
+        from .worker import WorkerPool
+
+        with self.lock:
+            if host not in self.pools:
+                self.pools[host] = WorkerPool(
+                    host, self.workers, threads=self.threads
+                )
+            return self.pools[host]
+
+    def run_process(self, job, job_dir):
+        """
+        Run a job once in a host process and return its result.
+        """
+        if self.warm:
+            return self.get_pool(job["host"]).run_job(
+                job, job.get("timeout", self.timeout)
+            )
+        job_path = os.path.join(job_dir, "job.json")
+        result_path = os.path.join(job_dir, "result.json")
+        with open(job_path, "w") as job_file:
+            json.dump(job, job_file)
+        if os.path.exists(result_path):
+            os.remove(result_path)
+        command = get_host_command(
+            job["host"], job["scene"], [job_path, result_path], self.threads
+        )
+        try:
+            process = subprocess.run(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                env=get_host_environment(self.threads),
+                timeout=job.get("timeout", self.timeout),
+            )
+        except subprocess.TimeoutExpired:
+            return {"status": "timeout", "error": "Job timed out."}
+        except OSError as exception:
+            return {"status": "failed", "error": str(exception)}
+        if os.path.isfile(result_path):
+            with open(result_path) as result_file:
+                return json.load(result_file)
+        log = process.stdout.decode("utf-8", "replace")
+        return {
+            "status": "failed",
+            "error": "The host exited with code %d." % process.returncode,
+            "log": log[-4000:],
+        }
+
+    def run_job(self, index, job):
+        start = time.time()
+        job_dir = tempfile.mkdtemp(prefix="dccutils-job-")
+        try:
+            retries = job.get("retries", self.retries)
+            for attempt in range(1, retries + 2):
+                result = self.run_process(job, job_dir)
+                if result["status"] == "done":
+                    break
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+        result.update(
+            {
+                "index": index,
+                "scene": job["scene"],
+                "output": job["output"],
+                "capture": job["capture"],
+                "attempts": attempt,
+                "duration": time.time() - start,
+            }
+        )
+        return result
+
+    def run(self, jobs):
+        """
+        Run the jobs and return a report: the result of every job, in the
+        manifest order, and a summary.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        start = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = list(
+                    executor.map(self.run_job, range(len(jobs)), jobs)
+                )
+        finally:
+            for pool in self.pools.values():
+                pool.close()
+        done = len([r for r in results if r["status"] == "done"])
+        return {
+            "jobs": results,
+            "summary": {
+                "jobs": len(results),
+                "done": done,
+                "failed": len(results) - done,
+                "workers": self.workers,
+                "duration": time.time() - start,
+            },
+        }
+
+
+def write_report(report, path=None):
+    if path is None:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+    with open(path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
@@ -0,0 +1,63 @@
+"""
+Script run by the batch command inside a background DCC process:
+
+    blender -b scene.blend --python batch_host.py -- job.json result.json
+    mayapy batch_host.py job.json result.json
+    hython batch_host.py job.json result.json
+
+It runs the job and writes its result. With "worker" as first argument, it
+serves jobs instead (see dccutils.worker). It is run as a script, so it
+only uses absolute imports.
+"""
+import json
+import os
+import sys
+
+# Blender ignores PYTHONPATH unless it is run with --python-use-system-env.
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if PACKAGE_DIR not in sys.path:
+    sys.path.insert(0, PACKAGE_DIR)
+
+
+def get_arguments(argv):
+    # Blender passes the script arguments after "--".
+    if "--" in argv:
+        return argv[argv.index("--") + 1 :]
+    return argv[1:]
+
+
+def initialize_host():
+    try:
+        import maya.standalone
+    except ImportError:
+        return
+    maya.standalone.initialize()
+
+
+def run_job_file(job_path, result_path):
+    from dccutils.batch import run_job_safely
+    from dccutils.guess import GuessedContext
+    from dccutils.memory import MemoryGovernor
+
+    with open(job_path) as job_file:
+        job = json.load(job_file)
+    context = GuessedContext()
+    result, memory = MemoryGovernor(context).run(run_job_safely, context, job)
+    result["memory"] = memory
+    with open(result_path, "w") as result_file:
+        json.dump(result, result_file)
+    return 0 if result["status"] == "done" else 1
+
+
+def main(argv):
+    arguments = get_arguments(argv)
+    initialize_host()
+    if arguments[0] == "worker":
+        from dccutils.worker import serve_worker
+
+        return serve_worker(arguments[1:])
+    return run_job_file(arguments[0], arguments[1])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
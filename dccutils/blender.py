@@ -1,10 +1,17 @@
 """
 Module that implements the software interface for Blender mode.
 """
+import hashlib
+
 import bpy
 
-from .software import SoftwareContext
-from .exceptions import CameraNotFound
+from .software import SoftwareContext, capture
+from .exceptions import CameraNotFound, RenderNotSupported
+from .image import ImageBuffer, allocate_pixels
+
+VIEWER_NODE_NAME = "dccutils Viewer"
+# Object types whose evaluated geometry is hashed by get_frame_fingerprint.
+GEOMETRY_TYPES = ("MESH", "CURVE", "SURFACE", "FONT", "META")
 
 
 class BlenderContext(SoftwareContext):
@@ -35,35 +42,19 @@ class BlenderContext(SoftwareContext):
     def get_dcc_name():
         return "Blender"
 
+    @staticmethod
+    def get_blender_version():
+        return tuple(bpy.app.version)
+
     @staticmethod
     def get_current_project_path():
         return bpy.data.filepath
 
-    def push_state(self):
-        """
-        Save the variables we need to modify.
-        """
-        scene = self.get_current_scene()
-        self.saved_extension = scene.render.image_settings.file_format
-        self.saved_output_path = scene.render.filepath
-        self.saved_codec = scene.render.ffmpeg.codec
-        self.saved_format = scene.render.ffmpeg.format
-        self.saved_camera = scene.camera
-        self.saved_color_space = scene.sequencer_colorspace_settings.name
-        self.renderer = scene.render.engine
+    def has_unsaved_changes(self):
+        return bpy.data.is_dirty
 
-    def pop_state(self):
-        """
-        Set back the variables we've modified.
-        """
-        scene = self.get_current_scene()
-        scene.render.image_settings.file_format = self.saved_extension
-        scene.render.filepath = self.saved_output_path
-        scene.render.ffmpeg.codec = self.saved_codec
-        scene.render.ffmpeg.format = self.saved_format
-        scene.render.engine = self.renderer
-        scene.camera = self.saved_camera
-        scene.sequencer_colorspace_settings.name = self.saved_color_space
+    def open_scene(self, path):
+        bpy.ops.wm.open_mainfile(filepath=path)
 
     def setup_preview(self, output_path, extension):
         """
@@ -71,15 +62,16 @@ class BlenderContext(SoftwareContext):
         :param output_path: Output path for the preview
         :param extension: Format setting for Blender
         """
-        bpy.context.scene.render.image_settings.file_format = extension
-        bpy.context.scene.render.filepath = output_path
+        render = self.get_current_scene().render
+        self.set_property(render.image_settings, "file_format", extension)
+        self.set_property(render, "filepath", output_path)
 
     def setup_render(self, renderer):
         """
         Setup render.
         :param renderer: Id of the renderer in Blender
         """
-        bpy.context.scene.render.engine = renderer
+        self.set_property(self.get_current_scene().render, "engine", renderer)
 
     def setup_colorspace_settings(self, use_colorspace):
         if use_colorspace:
@@ -103,9 +95,19 @@ class BlenderContext(SoftwareContext):
         :param container: Container.
         """
         self.setup_preview(output_path, extension)
-        bpy.context.scene.render.ffmpeg.codec = "H264"
-        bpy.context.scene.render.ffmpeg.format = container
+        ffmpeg = self.get_current_scene().render.ffmpeg
+        self.set_property(ffmpeg, "codec", "H264")
+        self.set_property(ffmpeg, "format", container)
 
+    def setup_viewport_view_transform(self):
+        """
+        Viewport captures use the Standard view transform (Blender 2.80+).
+        """
+        if self.get_blender_version() >= (2, 80, 0):
+            view_settings = self.get_current_scene().view_settings
+            self.set_property(view_settings, "view_transform", "Standard")
+
+    @capture(cacheable=True)
     def take_render_screenshot(
         self, renderer, output_path, extension, use_colorspace=True, **kwargs
     ):
@@ -119,19 +121,18 @@ class BlenderContext(SoftwareContext):
         bpy.ops.render.render(write_still=True)
         return output_path
 
+    @capture()
     def take_viewport_screenshot(self, output_path, extension, **kwargs):
         """
         Take a screenshot using OpenGL.
         Save the image at the given path with the given extension.
         """
         self.setup_preview(output_path, extension)
-        if self.get_blender_version() < (2, 80, 0):
-            bpy.ops.render.opengl(write_still=True)
-        else:
-            bpy.context.scene.view_settings.view_transform = "Standard"
-            bpy.ops.render.opengl(write_still=True)
+        self.setup_viewport_view_transform()
+        bpy.ops.render.opengl(write_still=True)
         return output_path
 
+    @capture(cacheable=True)
     def take_render_animation(
         self, renderer, output_path, extension, use_colorspace=True, **kwargs
     ):
@@ -145,17 +146,257 @@ class BlenderContext(SoftwareContext):
         bpy.ops.render.render(animation=True, write_still=True)
         return output_path
 
+    @capture()
     def take_viewport_animation(self, output_path, extension, **kwargs):
         """
         Take an animation using OpenGL.
         Save the video at the given path with the given extension (container).
         """
         self.setup_preview_animation(output_path, "FFMPEG", extension)
-        if self.get_blender_version() < (2, 80, 0):
-            bpy.ops.render.opengl(animation=True, write_still=True)
+        self.setup_viewport_view_transform()
+        bpy.ops.render.opengl(animation=True, write_still=True)
+        return output_path
+
+    def setup_viewer_node(self):
+        """
+        Link a Viewer node to the render layers in the compositor. Renders
+        then fill the Viewer Node image, whose pixels can be read (those of
+        the Render Result can't).
+        """
+        scene = self.get_current_scene()
+        self.set_property(scene, "use_nodes", True)
+        self.set_property(scene.render, "use_compositing", True)
+        tree = scene.node_tree
+
+        def has_viewer_node():
+            return tree.nodes.get(VIEWER_NODE_NAME) is not None
+
+        def set_viewer_node(enabled):
+            if not enabled:
+                tree.nodes.remove(tree.nodes[VIEWER_NODE_NAME])
+                return
+            layers = [node for node in tree.nodes if node.type == "R_LAYERS"]
+            if layers:
+                layers_node = layers[0]
+            else:
+                layers_node = tree.nodes.new("CompositorNodeRLayers")
+            viewer = tree.nodes.new("CompositorNodeViewer")
+            viewer.name = VIEWER_NODE_NAME
+            viewer.use_alpha = True
+            tree.links.new(
+                layers_node.outputs["Image"], viewer.inputs["Image"]
+            )
+            tree.nodes.active = viewer
+
+        self.set_state_value(
+            (scene.name, VIEWER_NODE_NAME),
+            has_viewer_node,
+            set_viewer_node,
+            True,
+        )
+
+    def get_view3d_region(self):
+        """
+        Return the space and the main region of the first 3D view, (None,
+        None) if there is none.
+        """
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                if area.type != "VIEW_3D":
+                    continue
+                for region in area.regions:
+                    if region.type == "WINDOW":
+                        return area.spaces.active, region
+        return None, None
+
+    @capture()
+    def take_render_pixels(
+        self,
+        renderer,
+        output_path=None,
+        use_colorspace=True,
+        buffer=None,
+        executor=None,
+        **kwargs
+    ):
+        """
+        Render the current frame and read its pixels from the Viewer Node
+        image into a float32 buffer, scene linear and bottom row first.
+        """
+        self.setup_render(renderer)
+        self.setup_colorspace_settings(use_colorspace)
+        self.setup_viewer_node()
+        bpy.ops.render.render()
+        viewer_image = bpy.data.images["Viewer Node"]
+        width, height = viewer_image.size
+        channels = viewer_image.channels
+        if buffer is None:
+            buffer = allocate_pixels(width * height * channels)
+        viewer_image.pixels.foreach_get(buffer)
+        image = ImageBuffer(
+            width, height, channels, buffer, linear=True, bottom_up=True
+        )
+        if output_path:
+            self.save_pixels(image, output_path, executor)
+        return image
+
+    @capture()
+    def take_viewport_pixels(
+        self, output_path=None, buffer=None, executor=None, **kwargs
+    ):
+        """
+        Draw the 3D view from the scene camera offscreen and read its pixels,
+        display encoded and bottom row first. It needs the user interface.
+        """
+        space, region = self.get_view3d_region()
+        if space is None:
+            raise RenderNotSupported(
+                "Viewport pixels need a 3D view, they are not available in "
+                "background mode."
+            )
+        import gpu
+
+        scene = self.get_current_scene()
+        render = scene.render
+        width = render.resolution_x * render.resolution_percentage // 100
+        height = render.resolution_y * render.resolution_percentage // 100
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        projection_matrix = scene.camera.calc_matrix_camera(
+            depsgraph, x=width, y=height
+        )
+        offscreen = gpu.types.GPUOffScreen(width, height)
+        try:
+            offscreen.draw_view3d(
+                scene,
+                bpy.context.view_layer,
+                space,
+                region,
+                scene.camera.matrix_world.inverted(),
+                projection_matrix,
+                do_color_management=True,
+            )
+            with offscreen.bind():
+                framebuffer = gpu.state.active_framebuffer_get()
+                pixels = framebuffer.read_color(
+                    0, 0, width, height, 4, 0, "FLOAT"
+                )
+        finally:
+            offscreen.free()
+        if buffer is None:
+            buffer = allocate_pixels(width * height * 4)
+        memoryview(buffer).cast("B")[:] = memoryview(pixels).cast("B")
+        image = ImageBuffer(width, height, 4, buffer, bottom_up=True)
+        if output_path:
+            self.save_pixels(image, output_path, executor)
+        return image
+
+    def get_frame_range(self):
+        scene = self.get_current_scene()
+        return scene.frame_start, scene.frame_end
+
+    def get_frame_rate(self):
+        render = self.get_current_scene().render
+        return float(render.fps) / render.fps_base
+
+    def get_current_frame(self):
+        return self.get_current_scene().frame_current
+
+    def set_current_frame(self, frame):
+        self.get_current_scene().frame_set(int(frame))
+
+    def get_frame_fingerprint(self, frame):
+        """
+        Hash the evaluated transforms and geometry (after shape keys,
+        modifiers and geometry nodes) of the renderable objects, the pose of
+        the armatures, the camera lens, the lights, the material and world
+        inputs and the values of the F-curves at the given frame, so edited
+        keyframes only change the frames they affect.
+        """
+        scene = self.get_current_scene()
+        scene.frame_set(int(frame))
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+        digest = hashlib.sha1()
+        digest.update(repr(scene.camera and scene.camera.name).encode())
+        for obj in scene.objects:
+            if obj.hide_render:
+                continue
+            evaluated = obj.evaluated_get(depsgraph)
+            values = [obj.name, _matrix_values(evaluated.matrix_world)]
+            if obj.type == "CAMERA":
+                camera = evaluated.data
+                values += [camera.lens, camera.clip_start, camera.clip_end]
+            elif obj.type == "ARMATURE" and evaluated.pose is not None:
+                values += [
+                    _matrix_values(bone.matrix)
+                    for bone in evaluated.pose.bones
+                ]
+            elif obj.type == "LIGHT":
+                light = evaluated.data
+                values += [
+                    light.type,
+                    light.energy,
+                    tuple(light.color),
+                    light.shadow_soft_size,
+                    getattr(light, "spot_size", None),
+                ]
+                if light.node_tree is not None:
+                    values += _node_tree_values(light.node_tree)
+            digest.update(repr(values).encode())
+            if obj.type in GEOMETRY_TYPES:
+                _update_geometry_digest(digest, evaluated)
+        for action in bpy.data.actions:
+            values = [action.name] + [
+                (fcurve.data_path, fcurve.array_index, fcurve.evaluate(frame))
+                for fcurve in action.fcurves
+            ]
+            digest.update(repr(values).encode())
+        for material in bpy.data.materials:
+            values = [material.name, tuple(material.diffuse_color)]
+            if material.node_tree is not None:
+                values += _node_tree_values(material.node_tree)
+            digest.update(repr(values).encode())
+        world = scene.world
+        if world is not None:
+            values = [world.name, tuple(world.color)]
+            if world.node_tree is not None:
+                values += _node_tree_values(world.node_tree)
+            digest.update(repr(values).encode())
+        return digest.hexdigest()
+
+    def get_render_settings(self):
+        scene = self.get_current_scene()
+        render = scene.render
+        view_settings = scene.view_settings
+        settings = {
+            "resolution": [
+                render.resolution_x,
+                render.resolution_y,
+                render.resolution_percentage,
+            ],
+            "film_transparent": render.film_transparent,
+            "view_transform": view_settings.view_transform,
+            "look": view_settings.look,
+            "exposure": view_settings.exposure,
+            "gamma": view_settings.gamma,
+        }
+        # Engine settings exist once their add-on is loaded.
+        cycles = getattr(scene, "cycles", None)
+        if cycles is not None:
+            settings["cycles_samples"] = cycles.samples
+        eevee = getattr(scene, "eevee", None)
+        if eevee is not None:
+            settings["eevee_samples"] = eevee.taa_render_samples
+        return settings
+
+    def render_frame(self, renderer, frame, output_path, viewport=False):
+        self.set_current_frame(frame)
+        self.setup_preview(output_path, "PNG")
+        if viewport:
+            self.setup_viewport_view_transform()
+            bpy.ops.render.opengl(write_still=True)
         else:
-            bpy.context.scene.view_settings.view_transform = "Standard"
-            bpy.ops.render.opengl(animation=True, write_still=True)
+            self.setup_render(renderer)
+            bpy.ops.render.render(write_still=True)
         return output_path
 
     def get_cameras(self, with_objects=False):
@@ -183,9 +424,32 @@ class BlenderContext(SoftwareContext):
         if camera_found is None or camera_found.type != "CAMERA":
             raise CameraNotFound
         self.camera = camera_found
-        bpy.context.scene.camera = self.camera
+        self.set_property(self.get_current_scene(), "camera", self.camera)
         return self.camera
 
+    def get_render_cache_inputs(self, use_digest=False):
+        inputs = super(BlenderContext, self).get_render_cache_inputs(
+            use_digest
+        )
+        if inputs is None:
+            return None
+        scene = self.get_current_scene()
+        render = scene.render
+        inputs.update(
+            {
+                "scene": scene.name,
+                "camera": scene.camera.name if scene.camera else None,
+                "frame_range": (scene.frame_start, scene.frame_end),
+                "frame": scene.frame_current,
+                "resolution": (
+                    render.resolution_x,
+                    render.resolution_y,
+                    render.resolution_percentage,
+                ),
+            }
+        )
+        return inputs
+
     def get_current_scene(self):
         return bpy.context.scene
 
@@ -201,7 +465,44 @@ class BlenderContext(SoftwareContext):
         Set the current color space.
         """
         scene = self.get_current_scene()
-        scene.sequencer_colorspace_settings.name = color_space
+        self.set_property(
+            scene.sequencer_colorspace_settings, "name", color_space
+        )
+
+    def get_color_spaces(self):
+        scene = self.get_current_scene()
+        settings_type = type(scene.sequencer_colorspace_settings)
+        return [
+            item.name
+            for item in settings_type.bl_rna.properties["name"].enum_items
+        ]
+
+    def get_plugins_signature(self):
+        return sorted(bpy.context.preferences.addons.keys())
+
+    def can_defer(self):
+        # Timers don't run in background mode, which has no event loop.
+        return not bpy.app.background
+
+    def execute_deferred(self, function):
+        def run_once():
+            # Returning None unregisters the timer.
+            function()
+
+        bpy.app.timers.register(run_once, first_interval=0.0)
+
+    def free_memory(self):
+        """
+        Free the pixels of the render and compositing images and purge the
+        orphan data-blocks.
+        """
+        for image in bpy.data.images:
+            if image.type in ("RENDER_RESULT", "COMPOSITING"):
+                image.buffers_free()
+        if hasattr(bpy.data, "orphans_purge"):
+            bpy.data.orphans_purge(do_recursive=True)
+        else:
+            bpy.ops.outliner.orphans_purge()
 
     def get_available_renderers(self):
         """
@@ -239,3 +540,46 @@ class BlenderContext(SoftwareContext):
             if is_video
             else [(".png", "PNG"), (".jpg", "JPEG")]
         )
+
+
+def _matrix_values(matrix):
+    return tuple(tuple(row) for row in matrix)
+
+
+def _update_geometry_digest(digest, evaluated):
+    """
+    Hash the vertex positions of the mesh of an evaluated object.
+    """
+    mesh = evaluated.to_mesh()
+    try:
+        if mesh is None:
+            return
+        coordinates = allocate_pixels(3 * len(mesh.vertices))
+        mesh.vertices.foreach_get("co", coordinates)
+        digest.update(coordinates)
+    finally:
+        evaluated.to_mesh_clear()
+
+
+def _node_tree_values(node_tree):
+    """
+    Return the default values of the inputs of the nodes of a node tree.
+    """
+    values = []
+    for node in node_tree.nodes:
+        for socket in node.inputs:
+            if hasattr(socket, "default_value"):
+                values.append(_flatten(socket.default_value))
+    return values
+
+
+def _flatten(value):
+    """
+    Convert Blender vectors and arrays to tuples.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    try:
+        return tuple(_flatten(item) for item in value)
+    except TypeError:
+        return value
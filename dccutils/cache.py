@@ -0,0 +1,149 @@
+"""
+Module that implements a content-addressed cache for rendered outputs.
+Entries are plain files named after the hash of the inputs that produced
+them, so several processes can share the same cache directory.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from .compat import replace_file
+
+
+def get_file_signature(path, use_digest=False):
+    """
+    Return what identifies the current version of the given scene file: its
+    modification time, or a digest of its content.
+    """
+    stat = os.stat(path)
+    if not use_digest:
+        return {"mtime": stat.st_mtime, "size": stat.st_size}
+    digest = hashlib.sha256()
+    with open(path, "rb") as scene_file:
+        for chunk in iter(lambda: scene_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return {"sha256": digest.hexdigest(), "size": stat.st_size}
+
+
+class RenderCache(object):
+    def __init__(self, cache_dir, max_size=10 * 1024**3, use_digest=False):
+        """
+        :param cache_dir: Directory where the cached outputs are stored
+        :param max_size: Size in bytes above which least recently used
+        entries are evicted
+        :param use_digest: Identify the scene file by a digest of its content
+        instead of its modification time
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.use_digest = use_digest
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get_key(self, inputs):
+        """
+        Return the cache key of the given inputs (a JSON serializable dict).
+        """
+        data = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def get_entry_path(self, key, extension):
+        return os.path.join(self.cache_dir, key[:2], key + extension)
+
+    def restore(self, key, output_path):
+        """
+        Hardlink (or copy when linking is not possible) the cached output of
+        the given key to output_path. Return False if there is no such entry.
+        """
+        extension = os.path.splitext(output_path)[1]
+        entry_path = self.get_entry_path(key, extension)
+        if not os.path.isfile(entry_path):
+            with self.lock:
+                self.misses += 1
+            return False
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        if os.path.lexists(output_path):
+            os.remove(output_path)
+        try:
+            os.link(entry_path, output_path)
+        except OSError:
+            shutil.copyfile(entry_path, output_path)
+        now = time.time()
+        os.utime(entry_path, (now, now))
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, output_path):
+        """
+        Copy the output to the cache under the given key, then evict the
+        least recently used entries if the cache got too big.
+        """
+        if not os.path.isfile(output_path):
+            return False
+        extension = os.path.splitext(output_path)[1]
+        entry_path = self.get_entry_path(key, extension)
+        entry_dir = os.path.dirname(entry_path)
+        if not os.path.isdir(entry_dir):
+            os.makedirs(entry_dir)
+        tmp_path = "%s.%d.tmp" % (entry_path, os.getpid())
+        shutil.copyfile(output_path, tmp_path)
+        replace_file(tmp_path, entry_path)
+        self.evict()
+        return True
+
+    def get_entries(self):
+        """
+        Return a list of (last use, size, path) tuples, one per entry.
+        """
+        entries = []
+        for root, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                if filename.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in max_size.
+        """
+        entries = sorted(self.get_entries())
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+            with self.lock:
+                self.evictions += 1
+
+    def get_stats(self):
+        entries = self.get_entries()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": float(self.hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(entries),
+            "size": sum(size for _, size, _ in entries),
+            "max_size": self.max_size,
+        }
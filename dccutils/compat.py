@@ -0,0 +1,140 @@
+"""
+Module that irons out the differences between Python 2.7, still run by
+Maya 2020 and older, and Python 3.
+"""
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    string_types = (str, unicode)
+    integer_types = (int, long)
+except NameError:
+    string_types = (str,)
+    integer_types = (int,)
+
+# Python 2 has neither a monotonic clock nor perf_counter.
+monotonic = getattr(time, "monotonic", time.time)
+perf_counter = getattr(time, "perf_counter", time.time)
+
+
+def replace_file(source, destination):
+    """
+    Move source to destination, overwriting it, like os.replace.
+    """
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+        return
+    # Python 2 can't rename over an existing file on Windows.
+    if os.name == "nt" and os.path.exists(destination):
+        os.remove(destination)
+    os.rename(source, destination)
+
+
+def which(name):
+    if hasattr(shutil, "which"):
+        return shutil.which(name)
+    for folder in os.environ.get("PATH", "").split(os.pathsep):
+        path = os.path.join(folder, name)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+def cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+try:
+    from concurrent.futures import CancelledError, Future, TimeoutError
+except ImportError:
+
+    class CancelledError(Exception):
+        pass
+
+    class TimeoutError(Exception):
+        pass
+
+    class Future(object):
+        """
+        Subset of concurrent.futures.Future for Python 2 without the futures
+        backport: the result of a call made by the owner of the future.
+        """
+
+        def __init__(self):
+            self.condition = threading.Condition()
+            self.state = "pending"
+            self.value = None
+            self.error = None
+            self.callbacks = []
+
+        def cancel(self):
+            return self.finish("cancelled")
+
+        def cancelled(self):
+            return self.state == "cancelled"
+
+        def running(self):
+            return False
+
+        def done(self):
+            return self.state != "pending"
+
+        def set_result(self, result):
+            self.finish("finished", value=result)
+
+        def set_exception(self, exception):
+            self.finish("finished", error=exception)
+
+        def finish(self, state, value=None, error=None):
+            with self.condition:
+                if self.state != "pending":
+                    return False
+                self.state = state
+                self.value = value
+                self.error = error
+                self.condition.notify_all()
+                callbacks, self.callbacks = self.callbacks, []
+            for callback in callbacks:
+                callback(self)
+            return True
+
+        def wait(self, timeout=None):
+            end = None if timeout is None else time.time() + timeout
+            with self.condition:
+                while self.state == "pending":
+                    if end is None:
+                        self.condition.wait()
+                    elif time.time() < end:
+                        self.condition.wait(end - time.time())
+                    else:
+                        raise TimeoutError()
+                if self.state == "cancelled":
+                    raise CancelledError()
+
+        def result(self, timeout=None):
+            self.wait(timeout)
+            if self.error is not None:
+                raise self.error
+            return self.value
+
+        def exception(self, timeout=None):
+            self.wait(timeout)
+            return self.error
+
+        def add_done_callback(self, callback):
+            with self.condition:
+                if self.state == "pending":
+                    self.callbacks.append(callback)
+                    return
+            callback(self)
@@ -0,0 +1,707 @@
+"""
+Module that spreads capture jobs over many nodes through a SQLite broker.
+
+The coordinator splits a manifest into jobs and queues them in a SQLite
+database, on a filesystem every node can reach (or on a single machine).
+Workers lease one job at a time, renew their lease with heartbeats while it
+runs, then store its result. The jobs of workers that stop sending
+heartbeats are queued again when their lease expires, until they run out of
+attempts. A lease expires once the node checking it saw no heartbeat for
+the lease time, measured with its own monotonic clock: leases don't depend
+on the clocks of the nodes agreeing (SQLite has no server clock, even
+julianday('now') is read from the calling node).
+
+Animations with a "frame_range" are split into chunks of frames rendered on
+different nodes. Once every chunk is done, one more job encodes the frames
+into the movie.
+
+Network filesystems don't all lock files reliably: prefer a local disk of
+the coordinator node exported to the workers, or a filesystem with working
+POSIX locks.
+"""
+import contextlib
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+
+from . import batch
+from .compat import cpu_count
+from .encode import encode_image_sequence
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run TEXT NOT NULL,
+    group_id INTEGER,
+    host TEXT,
+    spec TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    worker TEXT,
+    lease_time REAL,
+    beats INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_group ON jobs (group_id);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    started REAL,
+    heartbeat REAL,
+    job INTEGER,
+    jobs_done INTEGER NOT NULL DEFAULT 0
+);
+"""
+# Statuses of the jobs. Blocked jobs wait for the jobs of their group.
+STATUSES = ("blocked", "queued", "leased", "done", "failed")
+PENDING_STATUSES = ("blocked", "queued", "leased")
+# Times a worker calls the broker again while the database stays locked
+# longer than its busy timeout.
+LOCK_RETRIES = 10
+
+
+def get_frames_pattern(output_path):
+    """
+    Return the pattern of the frames of a split animation: frames are
+    rendered next to the movie, in a <name>_frames folder.
+    """
+    root = os.path.splitext(output_path)[0]
+    return os.path.join(root + "_frames", os.path.basename(root) + ".%04d.png")
+
+
+def split_manifest(jobs, chunk_size=None):
+    """
+    Return the jobs of a manifest as a list of (job, chunks) tuples. With a
+    chunk_size, animations with a frame_range come with the render_frames
+    jobs of their chunks, and the job is changed into the encoding of the
+    frames. chunks is None for the other jobs.
+    """
+    split_jobs = []
+    for job in jobs:
+        frame_range = job.get("frame_range")
+        if (
+            not chunk_size
+            or not frame_range
+            or job["capture"] not in ("render_animation", "viewport_animation")
+        ):
+            split_jobs.append((job, None))
+            continue
+        first_frame, last_frame = frame_range
+        pattern = get_frames_pattern(job["output"])
+        chunks = []
+        for start in range(first_frame, last_frame + 1, chunk_size):
+            chunk = dict(job)
+            chunk.update(
+                {
+                    "capture": "render_frames",
+                    "frame_range": [
+                        start,
+                        min(last_frame, start + chunk_size - 1),
+                    ],
+                    "output": pattern,
+                    "viewport": job["capture"] == "viewport_animation",
+                }
+            )
+            chunks.append(chunk)
+        encode_job = {
+            "capture": "encode_frames",
+            "scene": job["scene"],
+            "output": job["output"],
+            "pattern": pattern,
+            "first_frame": first_frame,
+            "frame_rate": job.get("frame_rate"),
+            "host": None,
+        }
+        split_jobs.append((encode_job, chunks))
+    return split_jobs
+
+
+def retry_locked(function, *args):
+    """
+    Call function again while the database stays locked longer than the
+    busy timeout, so a busy broker neither stops a worker nor loses a
+    result.
+    """
+    delay = 0.1
+    for attempt in range(LOCK_RETRIES):
+        try:
+            return function(*args)
+        except sqlite3.OperationalError as exception:
+            message = str(exception)
+            if "locked" not in message and "busy" not in message:
+                raise
+            if attempt == LOCK_RETRIES - 1:
+                raise
+        time.sleep(delay)
+        delay = min(2 * delay, 1.0)
+
+
+def get_worker_id(index=0):
+    return "%s:%d:%d" % (socket.gethostname(), os.getpid(), index)
+
+
+class Broker(object):
+    def __init__(self, path, timeout=60):
+        """
+        :param path: SQLite database shared by the coordinator and the
+        workers, created if needed
+        :param timeout: Time in seconds to wait for the database lock (the
+        busy timeout of the connections)
+        """
+        self.path = path
+        self.timeout = timeout
+        self.local = threading.local()
+        # Heartbeat count of the leased jobs, with the time it was first
+        # seen, to tell the expired leases.
+        self.observed_leases = {}
+        retry_locked(self.get_connection().executescript, SCHEMA)
+
+    def get_connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=self.timeout, isolation_level=None
+            )
+            self.local.connection = connection
+        return connection
+
+    def close(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        connection = self.get_connection()
+        # Take the write lock at once, so two workers can't lease the same
+        # job.
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            # COMMIT can fail too when the database is locked.
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+
+    def submit(self, jobs, chunk_size=None, retries=1, run=None):
+        """
+        Queue the jobs of a manifest (see batch.load_manifest) and return
+        the run they belong to.
+
+        :param chunk_size: Number of frames of the chunks animations are
+        split in, None to render each animation on one node
+        :param retries: Number of times a failed job is run again, unless
+        the job sets its own "retries"
+        """
+        if run is None:
+            run = "%s-%s" % (
+                time.strftime("%Y%m%d-%H%M%S"),
+                os.urandom(3).hex(),
+            )
+        now = time.time()
+        with self.transaction() as connection:
+            for job, chunks in split_manifest(jobs, chunk_size):
+                job_id = self.insert(
+                    connection,
+                    run,
+                    job,
+                    "blocked" if chunks else "queued",
+                    retries,
+                    now,
+                )
+                for chunk in chunks or []:
+                    self.insert(
+                        connection, run, chunk, "queued", retries, now, job_id
+                    )
+        return run
+
+    def insert(self, connection, run, job, status, retries, now, group=None):
+        cursor = connection.execute(
+            "INSERT INTO jobs (run, group_id, host, spec, status, "
+            "max_attempts, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                run,
+                group,
+                job.get("host"),
+                json.dumps(job),
+                status,
+                job.get("retries", retries) + 1,
+                now,
+            ),
+        )
+        return cursor.lastrowid
+
+    def register_worker(self, worker_id):
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO workers (id, host, pid, started, "
+                "heartbeat) VALUES (?, ?, ?, ?, ?)",
+                (worker_id, socket.gethostname(), os.getpid(), now, now),
+            )
+
+    def lease(self, worker_id, lease_time=60, hosts=None):
+        """
+        Lease the oldest queued job the worker can run, for lease_time
+        seconds. Return a (job id, job) tuple, or None if there is no job.
+
+        :param hosts: Hosts the worker can run (default: all)
+        """
+        now = time.time()
+        query = "SELECT id, spec FROM jobs WHERE status = 'queued'"
+        parameters = []
+        if hosts is not None:
+            query += " AND (host IS NULL OR host IN (%s))" % ", ".join(
+                "?" * len(hosts)
+            )
+            parameters += list(hosts)
+        query += " ORDER BY id LIMIT 1"
+        with self.transaction() as connection:
+            self.requeue_expired(connection)
+            row = connection.execute(query, parameters).fetchone()
+            connection.execute(
+                "UPDATE workers SET heartbeat = ?, job = ? WHERE id = ?",
+                (now, row[0] if row else None, worker_id),
+            )
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE jobs SET status = 'leased', worker = ?, "
+                "lease_time = ?, beats = beats + 1, "
+                "attempts = attempts + 1, started = ? WHERE id = ?",
+                (worker_id, lease_time, now, row[0]),
+            )
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, worker_id, job_id=None, lease_time=60):
+        """
+        Tell the broker the worker is alive and extend the lease of its job.
+        Return False if the job was leased to another worker meanwhile.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE workers SET heartbeat = ? WHERE id = ?",
+                (now, worker_id),
+            )
+            if job_id is None:
+                return True
+            cursor = connection.execute(
+                "UPDATE jobs SET lease_time = ?, beats = beats + 1 "
+                "WHERE id = ? AND status = 'leased' AND worker = ?",
+                (lease_time, job_id, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, worker_id, job_id, result):
+        """
+        Store the result of a leased job. Failed jobs are queued again while
+        they have attempts left. Return False if the lease was lost: the
+        result is then ignored.
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            row = connection.execute(
+                "SELECT status, worker, attempts, max_attempts, group_id "
+                "FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            if row is None or row[0] != "leased" or row[1] != worker_id:
+                return False
+            _, _, attempts, max_attempts, group_id = row
+            if result.get("status") == "done":
+                status = "done"
+            elif attempts < max_attempts:
+                status = "queued"
+            else:
+                status = "failed"
+            connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished = ?, "
+                "lease_time = NULL WHERE id = ?",
+                (status, json.dumps(result), now, job_id),
+            )
+            connection.execute(
+                "UPDATE workers SET heartbeat = ?, job = NULL, "
+                "jobs_done = jobs_done + 1 WHERE id = ?",
+                (now, worker_id),
+            )
+            if group_id is not None and status != "queued":
+                self.update_group(connection, group_id)
+        return True
+
+    def get_expired_leases(self, connection):
+        """
+        Return the leased jobs whose heartbeat count didn't change for their
+        lease time since this broker first saw it. Called in transactions,
+        which the database lock serializes across threads.
+        """
+        now = time.monotonic()
+        observed = {}
+        expired = []
+        for row in connection.execute(
+            "SELECT id, attempts, max_attempts, group_id, worker, beats, "
+            "lease_time FROM jobs WHERE status = 'leased'"
+        ):
+            job_id, beats, lease_time = row[0], row[5], row[6]
+            seen = self.observed_leases.get(job_id)
+            if seen is None or seen[0] != beats:
+                seen = (beats, now)
+            observed[job_id] = seen
+            if now - seen[1] > lease_time:
+                expired.append(row[:5])
+        self.observed_leases = observed
+        return expired
+
+    def requeue_expired(self, connection):
+        """
+        Queue again the jobs whose lease expired, or fail them if they have
+        no attempts left.
+        """
+        now = time.time()
+        rows = self.get_expired_leases(connection)
+        for job_id, attempts, max_attempts, group_id, worker_id in rows:
+            if attempts < max_attempts:
+                connection.execute(
+                    "UPDATE jobs SET status = 'queued', lease_time = NULL "
+                    "WHERE id = ?",
+                    (job_id,),
+                )
+                continue
+            result = {
+                "status": "failed",
+                "error": "Worker %s stopped sending heartbeats." % worker_id,
+            }
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', result = ?, "
+                "finished = ?, lease_time = NULL WHERE id = ?",
+                (json.dumps(result), now, job_id),
+            )
+            if group_id is not None:
+                self.update_group(connection, group_id)
+        return len(rows)
+
+    def update_group(self, connection, group_id):
+        """
+        Queue the job waiting for the group once all its jobs are done, or
+        fail it if one of them failed.
+        """
+        rows = connection.execute(
+            "SELECT status, result FROM jobs WHERE group_id = ?", (group_id,)
+        ).fetchall()
+        statuses = [status for status, _ in rows]
+        if "failed" in statuses:
+            result = {
+                "status": "failed",
+                "error": "%d chunks failed." % statuses.count("failed"),
+            }
+            connection.execute(
+                "UPDATE jobs SET status = 'failed', result = ?, finished = ? "
+                "WHERE id = ? AND status = 'blocked'",
+                (json.dumps(result), time.time(), group_id),
+            )
+        elif all(status == "done" for status in statuses):
+            spec = json.loads(
+                connection.execute(
+                    "SELECT spec FROM jobs WHERE id = ?", (group_id,)
+                ).fetchone()[0]
+            )
+            if not spec.get("frame_rate"):
+                frame_rates = [
+                    json.loads(result).get("frame_rate") for _, result in rows
+                ]
+                spec["frame_rate"] = next(
+                    (rate for rate in frame_rates if rate), 24
+                )
+            connection.execute(
+                "UPDATE jobs SET status = 'queued', spec = ? "
+                "WHERE id = ? AND status = 'blocked'",
+                (json.dumps(spec), group_id),
+            )
+
+    def get_counts(self, run=None):
+        """
+        Return the number of jobs per status.
+        """
+        query = "SELECT status, COUNT(*) FROM jobs"
+        parameters = ()
+        if run is not None:
+            query += " WHERE run = ?"
+            parameters = (run,)
+        counts = dict((status, 0) for status in STATUSES)
+        for status, count in self.get_connection().execute(
+            query + " GROUP BY status", parameters
+        ):
+            counts[status] = count
+        return counts
+
+    def is_pending(self, run=None):
+        counts = self.get_counts(run)
+        return any(counts[status] for status in PENDING_STATUSES)
+
+    def wait(self, run=None, timeout=None, poll_interval=1.0):
+        """
+        Wait until the jobs of the run are done or failed. Return False if
+        the timeout expired first.
+        """
+        start = time.time()
+        while True:
+            with self.transaction() as connection:
+                self.requeue_expired(connection)
+            if not self.is_pending(run):
+                return True
+            if timeout is not None and time.time() - start > timeout:
+                return False
+            time.sleep(poll_interval)
+
+    def get_report(self, run=None, worker_timeout=120):
+        """
+        Return the results of the jobs of the run (all runs by default), a
+        summary like the batch command report, and the state of the
+        workers. Workers without heartbeat for worker_timeout seconds are
+        reported dead.
+        """
+        query = (
+            "SELECT id, run, group_id, spec, status, attempts, worker, "
+            "result, created, started, finished FROM jobs"
+        )
+        parameters = ()
+        if run is not None:
+            query += " WHERE run = ?"
+            parameters = (run,)
+        connection = self.get_connection()
+        jobs = []
+        for row in connection.execute(query + " ORDER BY id", parameters):
+            spec = json.loads(row[3])
+            job = dict(json.loads(row[7]) if row[7] else {})
+            job.update(
+                {
+                    "id": row[0],
+                    "run": row[1],
+                    "group": row[2],
+                    "status": row[4],
+                    "scene": spec.get("scene"),
+                    "output": spec.get("output"),
+                    "capture": spec.get("capture"),
+                    "attempts": row[5],
+                    "worker": row[6],
+                    "created": row[8],
+                    "finished": row[10],
+                }
+            )
+            if row[9] is not None and row[10] is not None:
+                job["duration"] = row[10] - row[9]
+            jobs.append(job)
+        now = time.time()
+        workers = []
+        for row in connection.execute(
+            "SELECT id, host, pid, heartbeat, job, jobs_done FROM workers "
+            "ORDER BY id"
+        ):
+            workers.append(
+                {
+                    "id": row[0],
+                    "host": row[1],
+                    "pid": row[2],
+                    "heartbeat_age": now - row[3],
+                    "alive": now - row[3] < worker_timeout,
+                    "job": row[4],
+                    "jobs_done": row[5],
+                }
+            )
+        summary = self.get_counts(run)
+        summary["jobs"] = len(jobs)
+        summary["workers"] = len(set(job["worker"] for job in jobs) - {None})
+        finished = [job["finished"] for job in jobs if job["finished"]]
+        if finished:
+            summary["duration"] = max(finished) - min(
+                job["created"] for job in jobs
+            )
+        return {"jobs": jobs, "summary": summary, "workers": workers}
+
+
+def encode_frames(job):
+    """
+    Encode the frames rendered by the chunks of a split animation.
+    """
+    start = time.time()
+    output_dir = os.path.dirname(job["output"])
+    if output_dir and not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    encode_image_sequence(
+        job["pattern"], job["first_frame"], job["output"], job["frame_rate"]
+    )
+    return {
+        "status": "done",
+        "output": job["output"],
+        "capture_duration": time.time() - start,
+    }
+
+
+class CoordinatorWorker(object):
+    def __init__(
+        self,
+        broker,
+        worker_id=None,
+        hosts=None,
+        lease_time=60,
+        timeout=3600,
+        runner=None,
+        run_job=None,
+    ):
+        """
+        :param broker: Broker the jobs are leased from
+        :param hosts: Hosts this node can run (default: all)
+        :param lease_time: Time in seconds after which the job of a worker
+        that stopped sending heartbeats is given to another worker
+        :param timeout: Time in seconds after which a job is killed
+        :param runner: BatchRunner running the jobs in host processes
+        :param run_job: Function running a job and returning its result,
+        instead of the runner
+        """
+        self.broker = broker
+        self.worker_id = worker_id or get_worker_id()
+        self.hosts = hosts
+        self.lease_time = lease_time
+        self.runner = runner or batch.BatchRunner(1, 0, timeout)
+        self.run_job = run_job or self.run_in_host
+        self.jobs_done = 0
+
+    def run_in_host(self, job):
+        if job["capture"] == "encode_frames":
+            return encode_frames(job)
+        job_dir = tempfile.mkdtemp(prefix="dccutils-job-")
+        try:
+            return self.runner.run_process(job, job_dir)
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+    def run_leased_job(self, job_id, job):
+        """
+        Run a leased job while a thread sends heartbeats, until its result
+        is stored.
+        """
+        done = threading.Event()
+
+        def send_heartbeats():
+            interval = self.lease_time / 3.0
+            try:
+                while not done.wait(interval):
+                    try:
+                        if not self.broker.heartbeat(
+                            self.worker_id, job_id, self.lease_time
+                        ):
+                            return
+                        interval = self.lease_time / 3.0
+                    except sqlite3.Error:
+                        # The broker is busy or unreachable for now: try
+                        # again soon, the lease lasts until it expires.
+                        interval = min(0.1, self.lease_time / 10.0)
+            finally:
+                self.broker.close()
+
+        thread = threading.Thread(target=send_heartbeats)
+        thread.daemon = True
+        thread.start()
+        try:
+            try:
+                result = self.run_job(job)
+            except Exception as exception:
+                result = {
+                    "status": "failed",
+                    "error": batch.get_error_message(exception),
+                }
+            result["worker"] = self.worker_id
+            retry_locked(self.broker.complete, self.worker_id, job_id, result)
+        finally:
+            done.set()
+            thread.join()
+        self.jobs_done += 1
+        return result
+
+    def run(self, exit_when_empty=False, poll_interval=1.0, stop_event=None):
+        """
+        Lease and run jobs until stop_event is set or, with exit_when_empty,
+        until no job is pending anymore.
+        """
+        retry_locked(self.broker.register_worker, self.worker_id)
+        while stop_event is None or not stop_event.is_set():
+            leased = retry_locked(
+                self.broker.lease, self.worker_id, self.lease_time, self.hosts
+            )
+            if leased is not None:
+                self.run_leased_job(*leased)
+                continue
+            if exit_when_empty and not retry_locked(self.broker.is_pending):
+                break
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+        return self.jobs_done
+
+
+def run_workers(
+    broker_path,
+    workers=None,
+    hosts=None,
+    lease_time=60,
+    timeout=3600,
+    warm=False,
+    exit_when_empty=False,
+    poll_interval=1.0,
+    stop_event=None,
+    run_job=None,
+):
+    """
+    Run workers in threads of this process until they return, each running
+    its jobs in its own host process (or in a warm worker, see
+    dccutils.worker). Return the number of jobs done.
+    """
+    workers = workers or cpu_count()
+    broker = Broker(broker_path)
+    runner = batch.BatchRunner(workers, 0, timeout, warm)
+    counts = [0] * workers
+
+    def run(index):
+        worker = CoordinatorWorker(
+            broker,
+            get_worker_id(index),
+            hosts,
+            lease_time,
+            timeout,
+            runner,
+            run_job,
+        )
+        try:
+            counts[index] = worker.run(
+                exit_when_empty, poll_interval, stop_event
+            )
+        finally:
+            broker.close()
+
+    threads = [
+        threading.Thread(target=run, args=(index,)) for index in range(workers)
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for pool in runner.pools.values():
+            pool.close()
+    return sum(counts)
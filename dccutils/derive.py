@@ -0,0 +1,334 @@
+"""
+Module that derives thumbnails and a low bitrate proxy from capture outputs,
+in a process pool. The source is read once: by a single ffmpeg command with
+one output per derivative, or, for PNG files when ffmpeg is not available,
+decoded once in Python and downscaled from the largest size to the
+smallest.
+
+What was derived is recorded next to the output, in <output>.derived.json,
+so the derivatives are not computed again for the same file.
+"""
+import array
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+from .compat import replace_file
+from .encode import get_ffmpeg_path
+from .image import ImageBuffer, get_png_size, read_png, write_png
+
+VIDEO_EXTENSIONS = (".avi", ".mkv", ".mov", ".mp4", ".webm")
+PYTHON_EXECUTABLES = ("python", "mayapy", "hython")
+
+
+def get_record_path(path):
+    return path + ".derived.json"
+
+
+def get_settings(thumbnail_sizes, proxy_width, proxy_bitrate):
+    return {
+        "thumbnail_sizes": sorted(thumbnail_sizes, reverse=True),
+        "proxy_width": proxy_width,
+        "proxy_bitrate": proxy_bitrate,
+    }
+
+
+def load_record(path, settings=None):
+    """
+    Return the derivation record of the file at path, or None if there is
+    none, or if the file or the settings changed since it was written.
+    """
+    record_path = get_record_path(path)
+    if not os.path.isfile(record_path) or not os.path.isfile(path):
+        return None
+    try:
+        with open(record_path) as record_file:
+            record = json.load(record_file)
+    except ValueError:
+        return None
+    stat = os.stat(path)
+    if record.get("source_size") != stat.st_size:
+        return None
+    if record.get("source_mtime") != stat.st_mtime:
+        return None
+    if settings is not None and record.get("settings") != settings:
+        return None
+    return record
+
+
+def write_record(path, record):
+    record_path = get_record_path(path)
+    tmp_path = "%s.%d.tmp" % (record_path, os.getpid())
+    with open(tmp_path, "w") as record_file:
+        json.dump(record, record_file, indent=2)
+    replace_file(tmp_path, record_path)
+    return record_path
+
+
+def get_derivative_path(path, suffix, extension):
+    return "%s.%s%s" % (os.path.splitext(path)[0], suffix, extension)
+
+
+def resize_pixels(pixels, width, height, channels, new_width, new_height):
+    """
+    Downscale 8-bit pixels (rows of bytes, top row first) by averaging the
+    source pixels covered by each target pixel.
+    """
+    stride = width * channels
+    columns = []
+    for x in range(new_width):
+        start = x * width // new_width
+        end = max(start + 1, (x + 1) * width // new_width)
+        columns.append((start * channels, end * channels, end - start))
+    resized = bytearray(new_width * new_height * channels)
+    position = 0
+    for y in range(new_height):
+        start = y * height // new_height
+        end = max(start + 1, (y + 1) * height // new_height)
+        sums = [0] * stride
+        for row in range(start, end):
+            line = pixels[row * stride : (row + 1) * stride]
+            sums = [total + value for total, value in zip(sums, line)]
+        row_count = end - start
+        for column_start, column_end, column_count in columns:
+            count = row_count * column_count
+            for channel in range(channels):
+                total = sum(
+                    sums[column_start + channel : column_end : channels]
+                )
+                resized[position] = (total + count // 2) // count
+                position += 1
+    return resized
+
+
+def get_target_size(width, height, size):
+    """
+    Return the size of the image scaled to the given width, keeping its
+    aspect ratio. Images are not upscaled.
+    """
+    new_width = min(size, width)
+    new_height = max(1, int(round(height * float(new_width) / width)))
+    return new_width, new_height
+
+
+def derive_with_python(path, settings):
+    """
+    Derive the thumbnails and the proxy of a PNG file in pure Python. The
+    proxy is a downscaled PNG file.
+    """
+    width, height, channels, pixels = read_png(path)
+    sizes = [("thumbnail", size) for size in settings["thumbnail_sizes"]]
+    if settings["proxy_width"]:
+        sizes.append(("proxy", settings["proxy_width"]))
+    # Downscale from the largest size to the smallest, each step from the
+    # previous one, so the full size pixels are only read once.
+    sizes.sort(key=lambda item: item[1], reverse=True)
+    thumbnails = []
+    proxy = None
+    current = (width, height, pixels)
+    for kind, size in sizes:
+        new_width, new_height = get_target_size(width, height, size)
+        resized = resize_pixels(
+            current[2], current[0], current[1], channels, new_width, new_height
+        )
+        current = (new_width, new_height, resized)
+        image = ImageBuffer(
+            new_width,
+            new_height,
+            channels,
+            array.array("f", [value / 255.0 for value in resized]),
+        )
+        suffix = "proxy" if kind == "proxy" else "thumbnail_%d" % size
+        output_path = get_derivative_path(path, suffix, ".png")
+        write_png(output_path, image, 9 if kind == "proxy" else 6)
+        derivative = {
+            "path": os.path.basename(output_path),
+            "width": new_width,
+            "height": new_height,
+        }
+        if kind == "proxy":
+            proxy = derivative
+        else:
+            derivative["size"] = size
+            thumbnails.append(derivative)
+    return thumbnails, proxy
+
+
+def derive_with_ffmpeg(ffmpeg, path, settings):
+    """
+    Derive the thumbnails and the proxy of an image or a movie with a single
+    ffmpeg command. The thumbnails show the first frame. The proxy of a
+    movie is an H.264 movie, the one of an image a JPEG file.
+    """
+    is_video = os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+    outputs = []
+    for size in settings["thumbnail_sizes"]:
+        output_path = get_derivative_path(path, "thumbnail_%d" % size, ".png")
+        outputs.append(
+            (
+                "thumbnail",
+                size,
+                output_path,
+                "w='min(%d,iw)':h=-1" % size,
+                ["-frames:v", "1", "-update", "1"],
+            )
+        )
+    if settings["proxy_width"]:
+        scale = "w='min(%d,iw)':h=-2" % settings["proxy_width"]
+        if is_video:
+            arguments = [
+                "-c:v",
+                "libx264",
+                "-pix_fmt",
+                "yuv420p",
+                "-b:v",
+                settings["proxy_bitrate"],
+                "-an",
+                "-movflags",
+                "+faststart",
+            ]
+            output_path = get_derivative_path(path, "proxy", ".mp4")
+        else:
+            arguments = ["-frames:v", "1", "-update", "1", "-q:v", "5"]
+            output_path = get_derivative_path(path, "proxy", ".jpg")
+        outputs.append(
+            ("proxy", settings["proxy_width"], output_path, scale, arguments)
+        )
+    if not outputs:
+        return [], None
+
+    labels = ["[out%d]" % index for index in range(len(outputs))]
+    filters = ["[0:v]split=%d%s" % (len(outputs), "".join(labels))]
+    output_arguments = []
+    for index, (_, _, output_path, scale, arguments) in enumerate(outputs):
+        filters.append("%sscale=%s[scaled%d]" % (labels[index], scale, index))
+        output_arguments += ["-map", "[scaled%d]" % index] + arguments
+        output_arguments.append(output_path)
+    command = [ffmpeg, "-y", "-loglevel", "error", "-i", path]
+    command += ["-filter_complex", ";".join(filters)] + output_arguments
+    subprocess.check_call(command)
+
+    thumbnails = []
+    proxy = None
+    for kind, size, output_path, _, _ in outputs:
+        derivative = {"path": os.path.basename(output_path)}
+        if kind == "proxy":
+            derivative["bitrate"] = settings["proxy_bitrate"]
+            proxy = derivative
+        else:
+            width, height = get_png_size(output_path)
+            derivative.update({"size": size, "width": width, "height": height})
+            thumbnails.append(derivative)
+    return thumbnails, proxy
+
+
+def derive_output(path, settings):
+    """
+    Derive the thumbnails and the proxy of the file at path, unless they are
+    already recorded, and return the derivation record. Run in the workers
+    of the process pool.
+    """
+    record = load_record(path, settings)
+    if record is not None:
+        return record
+    start = time.time()
+    stat = os.stat(path)
+    ffmpeg = get_ffmpeg_path()
+    if ffmpeg is not None:
+        method = "ffmpeg"
+        thumbnails, proxy = derive_with_ffmpeg(ffmpeg, path, settings)
+    elif path.lower().endswith(".png"):
+        method = "python"
+        thumbnails, proxy = derive_with_python(path, settings)
+    else:
+        raise RuntimeError(
+            "ffmpeg is required to derive %s. Install it or set the "
+            "DCCUTILS_FFMPEG environment variable." % path
+        )
+    record = {
+        "source": os.path.basename(path),
+        "source_size": stat.st_size,
+        "source_mtime": stat.st_mtime,
+        "settings": settings,
+        "method": method,
+        "thumbnails": thumbnails,
+        "proxy": proxy,
+        "duration": time.time() - start,
+    }
+    write_record(path, record)
+    return record
+
+
+def can_spawn_processes():
+    """
+    Return whether worker processes can be spawned: inside Blender, Maya or
+    Houdini GUI sessions, sys.executable is the DCC itself.
+    """
+    name = os.path.basename(sys.executable or "").lower()
+    return name.startswith(PYTHON_EXECUTABLES)
+
+
+class Deriver(object):
+    def __init__(
+        self,
+        thumbnail_sizes=(512, 128),
+        proxy_width=960,
+        proxy_bitrate="1M",
+        processes=None,
+        executor=None,
+    ):
+        """
+        :param thumbnail_sizes: Widths of the thumbnails, in pixels
+        :param proxy_width: Width of the proxy, None to skip it
+        :param proxy_bitrate: Bitrate of the proxies of movies
+        :param processes: Size of the process pool (default: number of cores)
+        :param executor: Executor running the derivations, instead of the
+        process pool
+        """
+        self.settings = get_settings(
+            thumbnail_sizes, proxy_width, proxy_bitrate
+        )
+        self.processes = processes
+        self.executor = executor
+
+    def get_executor(self):
+        if self.executor is None:
+            if can_spawn_processes():
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            else:
+                self.executor = concurrent.futures.ThreadPoolExecutor(
+                    self.processes
+                )
+        return self.executor
+
+    def derive(self, path):
+        """
+        Queue the derivation of the file at path and return at once. Return
+        a concurrent.futures.Future whose result is the derivation record.
+        """
+        return self.get_executor().submit(derive_output, path, self.settings)
+
+    def load_record(self, path):
+        """
+        Return the derivation record of path if it is up to date with the
+        file and the settings, else None.
+        """
+        return load_record(path, self.settings)
+
+    def close(self, wait=True):
+        if self.executor is not None:
+            self.executor.shutdown(wait)
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,266 @@
+"""
+Module that turns image sequences into movies with ffmpeg.
+"""
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from .compat import queue, which
+from .exceptions import RenderNotSupported
+
+
+def get_ffmpeg_path():
+    """
+    Return the path of the ffmpeg executable, DCCUTILS_FFMPEG first.
+    """
+    return os.environ.get("DCCUTILS_FFMPEG") or which("ffmpeg")
+
+
+def get_encoding_arguments(output_path):
+    """
+    Return the ffmpeg output arguments suited to the container of the given
+    path.
+    """
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension == ".avi":
+        return ["-c:v", "mjpeg", "-q:v", "3"]
+    return [
+        "-c:v",
+        "libx264",
+        "-pix_fmt",
+        "yuv420p",
+        "-vf",
+        "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+    ]
+
+
+def get_required_ffmpeg_path():
+    ffmpeg = get_ffmpeg_path()
+    if ffmpeg is None:
+        raise RenderNotSupported(
+            "ffmpeg is required to encode image sequences. Install it or "
+            "set the DCCUTILS_FFMPEG environment variable."
+        )
+    return ffmpeg
+
+
+def encode_image_sequence(pattern, start_frame, output_path, frame_rate=24):
+    """
+    Encode the image sequence matching pattern (printf style, like
+    frame.%04d.png) into output_path.
+    """
+    ffmpeg = get_required_ffmpeg_path()
+    command = [
+        ffmpeg,
+        "-y",
+        "-loglevel",
+        "error",
+        "-framerate",
+        str(frame_rate),
+        "-start_number",
+        str(start_frame),
+        "-i",
+        pattern,
+    ]
+    command += get_encoding_arguments(output_path)
+    command.append(output_path)
+    subprocess.check_call(command)
+    return output_path
+
+
+def transcode_movie(input_path, output_path):
+    """
+    Encode the movie at input_path again into the container of output_path.
+    """
+    ffmpeg = get_required_ffmpeg_path()
+    command = [ffmpeg, "-y", "-loglevel", "error", "-i", input_path]
+    command += get_encoding_arguments(output_path)
+    command += ["-an", output_path]
+    subprocess.check_call(command)
+    return output_path
+
+
+class StreamingEncoder(object):
+    """
+    Encode frames into a movie while they are rendered: frames are piped to
+    ffmpeg in order as soon as they are pushed (or found by watch), so the
+    movie is ready right after the last frame.
+
+        with StreamingEncoder(output_path, frame_rate) as encoder:
+            for frame in frames:
+                encoder.push(render(frame))
+    """
+
+    def __init__(
+        self, output_path, frame_rate=24, max_buffered=8, input_codec="png"
+    ):
+        """
+        :param max_buffered: Number of frames waiting for ffmpeg above which
+        push blocks
+        :param input_codec: ffmpeg codec of the pushed images
+        """
+        self.output_path = output_path
+        self.queue = queue.Queue(maxsize=max_buffered)
+        self.error = None
+        self.watcher = None
+        self.producer_done = threading.Event()
+        self.aborted = threading.Event()
+        command = [
+            get_required_ffmpeg_path(),
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "image2pipe",
+            "-framerate",
+            str(frame_rate),
+            "-c:v",
+            input_codec,
+            "-i",
+            "-",
+        ]
+        command += get_encoding_arguments(output_path)
+        command.append(output_path)
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        self.writer = threading.Thread(target=self.write_frames)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        if exception_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write_frames(self):
+        try:
+            while True:
+                path = self.queue.get()
+                if path is None:
+                    break
+                with open(path, "rb") as frame_file:
+                    shutil.copyfileobj(frame_file, self.process.stdin)
+        except Exception as exception:
+            self.error = exception
+            # Unblock push calls waiting for room in the queue.
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+        finally:
+            try:
+                self.process.stdin.close()
+            except (IOError, OSError):
+                pass
+
+    def push(self, path):
+        """
+        Queue the image at path as the next frame. Block while
+        max_buffered frames are waiting.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put(path)
+
+    def watch(
+        self,
+        pattern,
+        first_frame,
+        last_frame,
+        settle_time=0.5,
+        poll_interval=0.05,
+    ):
+        """
+        Push the frames of the sequence matching pattern (printf style, like
+        frame.%04d.png), in order, as the renderer writes them. A frame is
+        complete once the next one exists, once its size didn't change for
+        settle_time, or once close is called. Watching happens in a
+        background thread, so the render can block the caller.
+        """
+
+        def is_complete(path, next_path, states):
+            if self.producer_done.is_set() or os.path.exists(next_path):
+                return True
+            stat = os.stat(path)
+            state = (stat.st_size, stat.st_mtime)
+            now = time.time()
+            if states.get(path, (None, 0))[0] != state:
+                states[path] = (state, now)
+                return False
+            return stat.st_size > 0 and now - states[path][1] >= settle_time
+
+        def watch_frames():
+            states = {}
+            try:
+                for frame in range(first_frame, last_frame + 1):
+                    path = pattern % frame
+                    while not self.aborted.is_set():
+                        next_path = pattern % (frame + 1)
+                        if os.path.exists(path):
+                            if is_complete(path, next_path, states):
+                                break
+                        elif self.producer_done.is_set():
+                            raise RenderNotSupported(
+                                "The frame %s was not rendered." % path
+                            )
+                        time.sleep(poll_interval)
+                    if self.aborted.is_set():
+                        return
+                    self.push(path)
+            except Exception as exception:
+                self.error = exception
+
+        self.watcher = threading.Thread(target=watch_frames)
+        self.watcher.daemon = True
+        self.watcher.start()
+
+    def close(self):
+        """
+        Wait until every frame is encoded and the movie is written.
+        """
+        self.producer_done.set()
+        if self.watcher is not None:
+            self.watcher.join()
+        if self.writer.is_alive():
+            self.queue.put(None)
+        self.writer.join()
+        errors = self.process.stderr.read()
+        self.process.stderr.close()
+        self.process.wait()
+        if self.error is not None:
+            raise self.error
+        if self.process.returncode != 0:
+            raise subprocess.CalledProcessError(
+                self.process.returncode,
+                "ffmpeg",
+                output=errors,
+            )
+        return self.output_path
+
+    def abort(self):
+        """
+        Stop encoding, the movie is left incomplete.
+        """
+        self.aborted.set()
+        self.producer_done.set()
+        if self.process.poll() is None:
+            self.process.kill()
+        if self.watcher is not None:
+            self.watcher.join()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put(None)
+        self.writer.join()
+        self.process.wait()
+        self.process.stderr.close()
@@ -28,3 +28,45 @@ class MovieAlreadyInProgress(Exception):
     """
 
     pass
+
+
+class RenderNotSupported(Exception):
+    """
+    Error raised when the renderer can't produce the requested output.
+    """
+
+    pass
+
+
+class CaptureFailed(Exception):
+    """
+    Error raised when a capture returned without writing its output.
+    """
+
+    pass
+
+
+class WorkerError(Exception):
+    """
+    Error raised when a background worker can't be started or reached.
+    """
+
+    pass
+
+
+class PublishError(Exception):
+    """
+    Error raised when an output can't be uploaded.
+    """
+
+    def __init__(self, message, retry=False):
+        Exception.__init__(self, message)
+        self.retry = retry
+
+
+class DeadlineExceeded(Exception):
+    """
+    Error raised when a scheduled capture job misses its deadline.
+    """
+
+    pass
@@ -1,10 +1,16 @@
 """
 Module that implements the software interface for Houdini mode.
 """
+import os
+import shutil
+import tempfile
+import threading
+import time
 
 import hou
 
-from .software import SoftwareContext
+from .encode import StreamingEncoder
+from .software import SoftwareContext, capture
 
 
 class HoudiniContext(SoftwareContext):
@@ -21,17 +27,25 @@ class HoudiniContext(SoftwareContext):
             "vray_renderer": {"name": "vray", "parm_camera": "render_camera"},
         }
 
-    def push_state(self):
-        """
-        Save the variables we need to modify.
-        """
-        pass
+    @staticmethod
+    def get_dcc_version():
+        return hou.applicationVersionString()
 
-    def pop_state(self):
-        """
-        Set back the variables we've modified.
-        """
-        pass
+    @staticmethod
+    def get_dcc_name():
+        return "Houdini"
+
+    @staticmethod
+    def get_current_project_path():
+        return hou.hipFile.path()
+
+    def has_unsaved_changes(self):
+        return hou.hipFile.hasUnsavedChanges()
+
+    def open_scene(self, path):
+        hou.hipFile.load(
+            path, suppress_save_prompt=True, ignore_load_warnings=True
+        )
 
     def setup_preview(self, output_path, extension):
         """
@@ -51,21 +65,48 @@ class HoudiniContext(SoftwareContext):
         """
         pass
 
-    def get_viewport_camera(self):
+    def get_scene_viewer(self):
+        """
+        Return the scene viewer pane tab of the current desktop.
+        """
+        return hou.ui.curDesktop().paneTabOfType(hou.paneTabType.SceneViewer)
+
+    def get_viewport_camera(self, scene_viewer=None):
         """
         Return the name of the viewport camera.
         """
         cur_desktop = hou.ui.curDesktop()
-        desktop = cur_desktop.name()
-        panetab = cur_desktop.paneTabOfType(hou.paneTabType.SceneViewer).name()
-        persp = (
-            cur_desktop.paneTabOfType(hou.paneTabType.SceneViewer)
-            .curViewport()
-            .name()
+        if scene_viewer is None:
+            scene_viewer = cur_desktop.paneTabOfType(
+                hou.paneTabType.SceneViewer
+            )
+        return "%s.%s.world.%s" % (
+            cur_desktop.name(),
+            scene_viewer.name(),
+            scene_viewer.curViewport().name(),
+        )
+
+    def remember_viewport_camera(self, viewport):
+        """
+        Record the camera the viewport looks through (or its free view) for
+        pop_state.
+        """
+
+        def get_camera():
+            return (viewport.camera(), viewport.defaultCamera().stash())
+
+        def set_camera(value):
+            camera, default_camera = value
+            if camera is not None:
+                viewport.setCamera(camera)
+            else:
+                viewport.setDefaultCamera(default_camera)
+
+        self.remember_state(
+            ("viewport_camera", viewport.name()), get_camera, set_camera
         )
-        camera_path = desktop + "." + panetab + "." + "world" "." + persp
-        return camera_path
 
+    @capture()
     def take_viewport_screenshot(self, output_path, extension):
         """
         Take a screenshot of the viewport.
@@ -79,6 +120,7 @@ class HoudiniContext(SoftwareContext):
         )
         self.software_print("Generated screenshot at path " + output_path)
 
+    @capture(cacheable=True)
     def take_render_screenshot(
         self, renderer, output_path, extension, use_viewtransform=True
     ):
@@ -91,13 +133,137 @@ class HoudiniContext(SoftwareContext):
         render_node.render(output_file=output_path, output_format=extension)
         self.software_print("Generated screenshot at path " + output_path)
 
+    @capture()
     def take_viewport_animation(self, output_path, container):
         """
         Take an animation.
         Save the video at the given path with the given extension (container).
         """
-        pass
+        camera_path = self.get_viewport_camera()
+
+        def render(pattern, first_frame, last_frame):
+            hou.hscript(
+                "viewwrite -f %d %d %s '%s'"
+                % (first_frame, last_frame, camera_path, pattern)
+            )
+
+        return self.stream_frame_range(render, output_path)
+
+    def take_viewport_shots(self, shots, max_encoders=4):
+        """
+        Capture several viewport shots, through several cameras and frame
+        ranges, resolving the viewer once. Each shot is a dict with:
+
+            - output_path: image path ($F4 style for frame ranges) or movie
+            path
+            - camera: camera node or path, optional (current view)
+            - frame_range: (first, last), optional (current frame for
+            images, playbar range for movies)
+
+        Each shot is captured with a single hscript call (viewcamera then
+        viewwrite). Movies are encoded while the next shots are captured, up
+        to max_encoders at a time. Return a report per shot with its
+        timings and its error, if any.
+        """
+        scene_viewer = self.get_scene_viewer()
+        viewport = scene_viewer.curViewport()
+        viewport_path = self.get_viewport_camera(scene_viewer)
+        self.remember_viewport_camera(viewport)
+        video_extensions = [
+            extension for extension, _ in self.get_extensions(True)
+        ]
+        frames_dirs = []
+        encodings = []
+        encoding_slots = threading.BoundedSemaphore(max_encoders)
+
+        def finish_encoding(encoder, report):
+            with encoding_slots:
+                start = time.time()
+                try:
+                    encoder.close()
+                except Exception as exception:
+                    report["error"] = str(exception)
+                report["encode_time"] = time.time() - start
+
+        reports = []
+        try:
+            for shot in shots:
+                output_path = shot["output_path"]
+                is_video = (
+                    os.path.splitext(output_path)[1].lower()
+                    in video_extensions
+                )
+                frame_range = shot.get("frame_range")
+                if frame_range is None:
+                    if is_video:
+                        frame_range = self.get_frame_range()
+                    else:
+                        frame_range = (hou.frame(), hou.frame())
+                first_frame, last_frame = [int(f) for f in frame_range]
+                camera = shot.get("camera")
+                if camera is not None and not isinstance(camera, str):
+                    camera = camera.path()
+                report = {
+                    "output_path": output_path,
+                    "camera": camera,
+                    "frame_range": (first_frame, last_frame),
+                }
+                reports.append(report)
 
+                commands = []
+                if camera is not None:
+                    commands.append(
+                        "viewcamera -c %s %s" % (camera, viewport_path)
+                    )
+                encoder = None
+                pattern = output_path
+                if is_video:
+                    frames_dir = tempfile.mkdtemp(prefix="dccutils-frames-")
+                    frames_dirs.append(frames_dir)
+                    encoder = StreamingEncoder(
+                        output_path, self.get_frame_rate()
+                    )
+                    encoder.watch(
+                        os.path.join(frames_dir, "frame.%04d.png"),
+                        first_frame,
+                        last_frame,
+                    )
+                    pattern = os.path.join(frames_dir, "frame.$F4.png")
+                commands.append(
+                    "viewwrite -f %d %d %s '%s'"
+                    % (first_frame, last_frame, viewport_path, pattern)
+                )
+
+                start = time.time()
+                try:
+                    _, errors = hou.hscript("; ".join(commands))
+                except Exception:
+                    if encoder is not None:
+                        encoder.abort()
+                    raise
+                report["capture_time"] = time.time() - start
+                if errors:
+                    report["error"] = errors.strip()
+                if encoder is not None:
+                    encoding = threading.Thread(
+                        target=finish_encoding, args=(encoder, report)
+                    )
+                    encoding.start()
+                    encodings.append(encoding)
+        finally:
+            for encoding in encodings:
+                encoding.join()
+            for frames_dir in frames_dirs:
+                shutil.rmtree(frames_dir, ignore_errors=True)
+
+        for report in reports:
+            if "error" not in report:
+                self.handle_output(
+                    "take_viewport_shots", report["output_path"]
+                )
+        return reports
+
+    @capture(cacheable=True)
     def take_render_animation(
         self, renderer, output_path, container, use_viewtransform=True
     ):
@@ -105,7 +271,62 @@ class HoudiniContext(SoftwareContext):
         Take an animation.
         Save the video at the given path with the given extension (container).
         """
-        pass
+
+        def render(pattern, first_frame, last_frame):
+            renderer.render(
+                frame_range=(first_frame, last_frame), output_file=pattern
+            )
+
+        return self.stream_frame_range(render, output_path)
+
+    def stream_frame_range(self, render, output_path):
+        """
+        Call render(pattern, first_frame, last_frame), which writes the
+        frames of the playbar range at pattern ($F4 style), and encode the
+        frames into output_path as soon as they are written.
+        """
+        first_frame, last_frame = [int(f) for f in self.get_frame_range()]
+        frames_dir = tempfile.mkdtemp(prefix="dccutils-frames-")
+        try:
+            frame_rate = self.get_frame_rate()
+            with StreamingEncoder(output_path, frame_rate) as encoder:
+                encoder.watch(
+                    os.path.join(frames_dir, "frame.%04d.png"),
+                    first_frame,
+                    last_frame,
+                )
+                render(
+                    os.path.join(frames_dir, "frame.$F4.png"),
+                    first_frame,
+                    last_frame,
+                )
+        finally:
+            shutil.rmtree(frames_dir, ignore_errors=True)
+        return output_path
+
+    def get_frame_range(self):
+        return hou.playbar.frameRange()
+
+    def get_frame_rate(self):
+        return hou.fps()
+
+    def get_current_frame(self):
+        return hou.frame()
+
+    def set_current_frame(self, frame):
+        hou.setFrame(frame)
+
+    def render_frame(self, renderer, frame, output_path, viewport=False):
+        if viewport:
+            hou.hscript(
+                "viewwrite -f %d %d %s '%s'"
+                % (frame, frame, self.get_viewport_camera(), output_path)
+            )
+        else:
+            renderer.render(
+                frame_range=(frame, frame), output_file=output_path
+            )
+        return output_path
 
     def get_cameras(self):
         """
@@ -125,11 +346,89 @@ class HoudiniContext(SoftwareContext):
         render_node = kwargs["render_node"]
         renderer = self.get_node_render_type(render_node)
         parm_camera = self.renderers[renderer]["parm_camera"]
-        render_node.parm(parm_camera).set(camera_node.path())
+        self.set_parm(render_node.parm(parm_camera), camera_node.path())
+        self.camera = camera_node
+
+    def set_parm(self, parm, value):
+        """
+        Set a node parameter, recording its previous value for pop_state.
+        """
+        self.set_state_value(parm.path(), parm.eval, parm.set, value)
+
+    def get_render_cache_inputs(self, use_digest=False):
+        inputs = super(HoudiniContext, self).get_render_cache_inputs(
+            use_digest
+        )
+        if inputs is None:
+            return None
+        # Render node parameters may have been edited since the hip file
+        # was saved, by set_camera for instance.
+        inputs.update(
+            {
+                "frame": hou.frame(),
+                "render_nodes": dict(
+                    (
+                        node.path(),
+                        dict(
+                            (parm.name(), parm.evalAsString())
+                            for parm in node.parms()
+                        ),
+                    )
+                    for _, node in self.get_available_renderers()
+                ),
+            }
+        )
+        return inputs
 
     def get_current_color_space(self):
         pass
 
+    def get_color_spaces(self):
+        # OCIO spaces are exposed from Houdini 19.
+        if hasattr(hou.Color, "ocio_spaces"):
+            return list(hou.Color.ocio_spaces())
+        return []
+
+    def get_plugins_signature(self):
+        return [os.environ.get("HOUDINI_PATH", "")] + sorted(
+            hou.hda.loadedFiles()
+        )
+
+    def get_capabilities(self):
+        """
+        Render nodes belong to the hip file, so the manifest lists the render
+        node types supported by this context instead.
+        """
+        node_types = hou.ropNodeTypeCategory().nodeTypes()
+        return {
+            "renderers": [
+                (node_types[name].description(), name)
+                for name in sorted(self.renderers)
+                if name in node_types
+            ],
+            "extensions": {
+                "image": self.get_extensions(False),
+                "video": self.get_extensions(True),
+            },
+            "color_spaces": self.get_color_spaces(),
+        }
+
+    def can_defer(self):
+        return hou.isUIAvailable()
+
+    def execute_deferred(self, function):
+        if hou.isUIAvailable():
+            hou.ui.postEventCallback(function)
+        else:
+            function()
+
+    def free_memory(self):
+        """
+        Clear the texture and geometry caches.
+        """
+        hou.hscript("texcache -c")
+        hou.hscript("geocache -c")
+
     def set_current_color_space(self, color_space, **kwargs):
         pass
 
@@ -148,7 +447,9 @@ class HoudiniContext(SoftwareContext):
         """
         Return a list of available extensions.
         """
-        return [] if is_video else [(".png", ".png"), (".jpg", ".jpg")]
+        if is_video:
+            return [(".mp4", ".mp4"), (".mov", ".mov")]
+        return [(".png", ".png"), (".jpg", ".jpg")]
 
     def get_all_nodes(self):
         """
@@ -0,0 +1,303 @@
+"""
+Module that holds rendered pixels in memory and reads and writes PNG files
+without any imaging library. NumPy is used when it is available.
+"""
+import array
+import os
+import struct
+import threading
+import zlib
+
+from .compat import replace_file
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+LUT_SIZE = 4096
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+_luts = {}
+
+
+def allocate_pixels(count):
+    """
+    Return a zeroed float32 buffer of count values: a NumPy array, or an
+    array.array when NumPy is not installed.
+    """
+    if numpy is not None:
+        return numpy.zeros(count, dtype=numpy.float32)
+    return array.array("f", [0.0]) * count
+
+
+class ImageBuffer(object):
+    def __init__(
+        self,
+        width,
+        height,
+        channels=4,
+        pixels=None,
+        linear=False,
+        bottom_up=False,
+    ):
+        """
+        :param pixels: Flat float32 buffer of width * height * channels
+        values, allocated if not given
+        :param linear: Whether the values are scene linear rather than
+        display (sRGB) encoded
+        :param bottom_up: Whether the first row is the bottom of the image
+        (OpenGL order)
+        """
+        self.width = width
+        self.height = height
+        self.channels = channels
+        if pixels is None:
+            pixels = allocate_pixels(width * height * channels)
+        self.pixels = pixels
+        self.linear = linear
+        self.bottom_up = bottom_up
+        # Set when the image is written to disk in the background.
+        self.future = None
+
+    def get_memoryview(self):
+        return memoryview(self.pixels)
+
+    def to_numpy(self):
+        """
+        Return the pixels as a (height, width, channels) NumPy array, top row
+        first. No data is copied.
+        """
+        if numpy is None:
+            raise ImportError("NumPy is required to get a NumPy array.")
+        pixels = numpy.asarray(self.pixels, dtype=numpy.float32)
+        pixels = pixels.reshape(self.height, self.width, self.channels)
+        return pixels[::-1] if self.bottom_up else pixels
+
+    def wait(self):
+        """
+        Wait until the background write of the image, if any, is done.
+        """
+        if self.future is not None:
+            return self.future.result()
+
+
+def get_lut(linear):
+    """
+    Return the table converting floats between 0 and 1 (sampled at LUT_SIZE
+    steps) to 8-bit values, applying the sRGB transfer function to linear
+    values.
+    """
+    if linear in _luts:
+        return _luts[linear]
+    lut = bytearray(LUT_SIZE)
+    for index in range(LUT_SIZE):
+        value = float(index) / (LUT_SIZE - 1)
+        if linear:
+            value = _linear_to_srgb(value)
+        lut[index] = int(value * 255 + 0.5)
+    _luts[linear] = lut
+    return lut
+
+
+def _linear_to_srgb(value):
+    if value <= 0.0031308:
+        return value * 12.92
+    return 1.055 * value ** (1 / 2.4) - 0.055
+
+
+def get_color_channels(channels):
+    """
+    Return the number of channels that are not alpha.
+    """
+    return channels - 1 if channels in (2, 4) else channels
+
+
+def _to_bytes_numpy(image):
+    pixels = image.to_numpy()
+    if image.linear:
+        color_channels = get_color_channels(image.channels)
+        color = numpy.clip(pixels[:, :, :color_channels], 0.0, 1.0)
+        color = numpy.where(
+            color <= 0.0031308,
+            color * 12.92,
+            1.055 * numpy.power(color, 1 / 2.4) - 0.055,
+        )
+        pixels = numpy.concatenate(
+            [color, pixels[:, :, color_channels:]], axis=2
+        )
+    pixels = (numpy.clip(pixels, 0.0, 1.0) * 255 + 0.5).astype(numpy.uint8)
+    rows = pixels.reshape(image.height, image.width * image.channels)
+    filters = numpy.zeros((image.height, 1), dtype=numpy.uint8)
+    return numpy.concatenate([filters, rows], axis=1).tobytes()
+
+
+def _to_bytes_python(image):
+    channels = image.channels
+    color_lut = get_lut(image.linear)
+    alpha_lut = get_lut(False) if image.linear else color_lut
+    color_channels = get_color_channels(channels)
+    luts = [color_lut] * color_channels + [alpha_lut] * (
+        channels - color_channels
+    )
+    scale = LUT_SIZE - 1
+    row_size = image.width * channels
+    rows = range(image.height)
+    if image.bottom_up:
+        rows = reversed(rows)
+    data = bytearray()
+    for row in rows:
+        values = image.pixels[row * row_size : (row + 1) * row_size]
+        row_bytes = bytearray(row_size)
+        for channel in range(channels):
+            lut = luts[channel]
+            row_bytes[channel::channels] = bytearray(
+                lut[min(scale, max(0, int(value * scale)))]
+                for value in values[channel::channels]
+            )
+        data.append(0)
+        data += row_bytes
+    return bytes(data)
+
+
+def _chunk(tag, data):
+    return (
+        struct.pack(">I", len(data))
+        + tag
+        + data
+        + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+    )
+
+
+def write_png(path, image, compression=6):
+    """
+    Write image (an ImageBuffer) to path as an 8-bit PNG file. Linear images
+    are converted to sRGB, except their alpha.
+    """
+    color_types = {1: 0, 2: 4, 3: 2, 4: 6}
+    if image.channels not in color_types:
+        raise ValueError("Can't write %d channels images." % image.channels)
+    if numpy is not None:
+        raw = _to_bytes_numpy(image)
+    else:
+        raw = _to_bytes_python(image)
+    header = struct.pack(
+        ">IIBBBBB",
+        image.width,
+        image.height,
+        8,
+        color_types[image.channels],
+        0,
+        0,
+        0,
+    )
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_path = "%s.%d.%d.tmp" % (
+        path,
+        os.getpid(),
+        threading.current_thread().ident,
+    )
+    with open(tmp_path, "wb") as png_file:
+        png_file.write(PNG_SIGNATURE)
+        png_file.write(_chunk(b"IHDR", header))
+        png_file.write(_chunk(b"IDAT", zlib.compress(raw, compression)))
+        png_file.write(_chunk(b"IEND", b""))
+    replace_file(tmp_path, path)
+    return path
+
+
+def get_png_size(path):
+    """
+    Return the width and height of a PNG file, read from its header.
+    """
+    with open(path, "rb") as png_file:
+        header = png_file.read(24)
+    if header[:8] != PNG_SIGNATURE or header[12:16] != b"IHDR":
+        raise ValueError("%s is not a PNG file." % path)
+    return struct.unpack(">II", header[16:24])
+
+
+def read_png(path):
+    """
+    Read an 8-bit, non interlaced, grayscale or RGB(A) PNG file. Return its
+    width, height, number of channels and pixels, as a bytearray of rows,
+    top row first.
+    """
+    with open(path, "rb") as png_file:
+        data = png_file.read()
+    if data[:8] != PNG_SIGNATURE:
+        raise ValueError("%s is not a PNG file." % path)
+    position = 8
+    header = None
+    compressed = []
+    while position < len(data):
+        length, tag = struct.unpack(">I4s", data[position : position + 8])
+        chunk = data[position + 8 : position + 8 + length]
+        position += length + 12
+        if tag == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif tag == b"IDAT":
+            compressed.append(chunk)
+        elif tag == b"IEND":
+            break
+    if header is None:
+        raise ValueError("%s has no PNG header." % path)
+    width, height, depth, color_type, _, _, interlace = header
+    if depth != 8 or interlace or color_type not in PNG_CHANNELS:
+        raise ValueError(
+            "Can't read %s: only 8-bit, non interlaced, grayscale or RGB(A) "
+            "PNG files are supported." % path
+        )
+    channels = PNG_CHANNELS[color_type]
+    raw = zlib.decompress(b"".join(compressed))
+    return width, height, channels, _unfilter(raw, width, height, channels)
+
+
+def _unfilter(raw, width, height, channels):
+    stride = width * channels
+    pixels = bytearray(stride * height)
+    previous = bytearray(stride)
+    for row in range(height):
+        start = row * (stride + 1)
+        filter_type = raw[start]
+        line = bytearray(raw[start + 1 : start + 1 + stride])
+        if filter_type == 1:
+            for index in range(channels, stride):
+                line[index] = (line[index] + line[index - channels]) & 0xFF
+        elif filter_type == 2:
+            line = bytearray(
+                (value + above) & 0xFF for value, above in zip(line, previous)
+            )
+        elif filter_type == 3:
+            for index in range(stride):
+                left = line[index - channels] if index >= channels else 0
+                line[index] = (
+                    line[index] + ((left + previous[index]) >> 1)
+                ) & 0xFF
+        elif filter_type == 4:
+            for index in range(stride):
+                if index >= channels:
+                    left = line[index - channels]
+                    upper_left = previous[index - channels]
+                else:
+                    left = upper_left = 0
+                line[index] = (
+                    line[index] + _paeth(left, previous[index], upper_left)
+                ) & 0xFF
+        pixels[row * stride : (row + 1) * stride] = line
+        previous = line
+    return pixels
+
+
+def _paeth(left, above, upper_left):
+    estimate = left + above - upper_left
+    distance_left = abs(estimate - left)
+    distance_above = abs(estimate - above)
+    distance_upper_left = abs(estimate - upper_left)
+    if distance_left <= min(distance_above, distance_upper_left):
+        return left
+    if distance_above <= distance_upper_left:
+        return above
+    return upper_left
@@ -0,0 +1,131 @@
+"""
+Module that implements an on-disk manifest of the capabilities of a host
+(renderers, extensions, color spaces). Querying them on a live host can take
+seconds, while the manifest loads instantly and is revalidated later.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+
+from .compat import replace_file
+
+
+def get_default_cache_dir():
+    """
+    Return the directory where dccutils stores its caches, DCCUTILS_CACHE_DIR
+    first.
+    """
+    return os.environ.get("DCCUTILS_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "dccutils"
+    )
+
+
+class CapabilityManifest(object):
+    def __init__(self, context, cache_dir=None):
+        """
+        :param context: Context of the host the capabilities belong to
+        :param cache_dir: Directory of the manifest files
+        """
+        self.context = context
+        self.cache_dir = os.path.join(
+            cache_dir or get_default_cache_dir(), "capabilities"
+        )
+        self.capabilities = None
+        self.revalidated = False
+        self.lock = threading.Lock()
+
+    def get_key(self):
+        """
+        Return what identifies a manifest: the host name and version, and
+        the set of loaded plugins (or add-ons).
+        """
+        return [
+            self.context.get_dcc_name(),
+            self.context.get_dcc_version(),
+            self.context.get_plugins_signature(),
+        ]
+
+    def get_path(self):
+        key = json.dumps(self.get_key(), sort_keys=True, default=str)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        host = re.sub(r"[^a-z0-9]+", "-", self.context.get_dcc_name().lower())
+        return os.path.join(self.cache_dir, "%s-%s.json" % (host, digest))
+
+    def load(self):
+        """
+        Return the capabilities stored on disk, None if there are none.
+        """
+        path = self.get_path()
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path) as manifest_file:
+                capabilities = json.load(manifest_file)
+        except ValueError:
+            return None
+        return _restore_tuples(capabilities)
+
+    def save(self, capabilities):
+        path = self.get_path()
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp_path, "w") as manifest_file:
+            json.dump(capabilities, manifest_file, indent=2, sort_keys=True)
+        replace_file(tmp_path, path)
+
+    def refresh(self):
+        """
+        Query the capabilities on the live host and update the manifest if
+        they changed.
+        """
+        capabilities = _restore_tuples(
+            json.loads(json.dumps(self.context.get_capabilities()))
+        )
+        with self.lock:
+            if capabilities != self.capabilities:
+                self.save(capabilities)
+            self.capabilities = capabilities
+        return capabilities
+
+    def get(self, revalidate=True):
+        """
+        Return the capabilities, from the manifest when there is one. If
+        revalidate is set, the manifest is refreshed once per session, when
+        the host is idle. Hosts without event loop (batch modes) never
+        refresh a manifest they could load.
+        """
+        if self.capabilities is None:
+            self.capabilities = self.load()
+            if self.capabilities is None:
+                self.revalidated = True
+                return self.refresh()
+        if revalidate and not self.revalidated and self.context.can_defer():
+            self.revalidated = True
+            self.context.execute_deferred(self.refresh)
+        return self.capabilities
+
+
+def _restore_tuples(value):
+    """
+    JSON turns tuples into lists: turn the lists nested in lists (like
+    extensions or renderers entries) back into tuples.
+    """
+    if isinstance(value, dict):
+        return dict(
+            (key, _restore_tuples(item)) for key, item in value.items()
+        )
+    if isinstance(value, list):
+        return [
+            _to_tuple(item) if isinstance(item, list) else item
+            for item in value
+        ]
+    return value
+
+
+def _to_tuple(value):
+    return tuple(
+        _to_tuple(item) if isinstance(item, list) else item for item in value
+    )
@@ -2,28 +2,212 @@
 Module that implements the software interface for Maya mode.
 """
 
+import hashlib
 import os
+import shutil
 import subprocess
+import tempfile
 import maya.cmds as cmds
 import maya.mel as mel
+import maya.utils
 
-from .software import SoftwareContext
+from .compat import cpu_count, replace_file
+from .encode import transcode_movie
+from .software import SoftwareContext, capture
+from .exceptions import RenderNotSupported
 
-from gazupublisher.exceptions import RenderNotSupported
+
+# Settings that change every rendered frame, see get_render_settings.
+RENDER_SETTING_ATTRIBUTES = (
+    "defaultResolution.width",
+    "defaultResolution.height",
+    "defaultResolution.pixelAspect",
+    "defaultRenderQuality.edgeAntiAliasing",
+    "defaultRenderQuality.shadingSamples",
+    "hardwareRenderingGlobals.multiSampleEnable",
+    "hardwareRenderingGlobals.multiSampleCount",
+    "defaultArnoldRenderOptions.AASamples",
+    "defaultArnoldRenderOptions.GIDiffuseSamples",
+    "defaultArnoldRenderOptions.GISpecularSamples",
+    "defaultArnoldRenderOptions.GITransmissionSamples",
+)
+
+
+def get_render_threads():
+    # Set by the batch pools, which share the cores between their hosts.
+    threads = os.environ.get("DCCUTILS_THREADS")
+    return int(threads) if threads else cpu_count()
+
+
+TIME_UNIT_FRAME_RATES = {
+    "game": 15,
+    "film": 24,
+    "pal": 25,
+    "ntsc": 30,
+    "show": 48,
+    "palf": 50,
+    "ntscf": 60,
+}
+
+
+# Events after which the settings cached by the context are read again.
+SCENE_EVENTS = ("SceneOpened", "NewSceneOpened")
+SETTINGS_EVENTS = ("Undo", "Redo", "workspaceChanged")
+
+
+def get_bucket_size(width, height, threads):
+    """
+    Return the largest bucket size, from 64 down to 16 pixels, that splits
+    the image in at least four buckets per thread.
+    """
+    for size in (64, 32):
+        if max(1, width // size) * max(1, height // size) >= 4 * threads:
+            return size
+    return 16
 
 
 class MayaContext(SoftwareContext):
-    def push_state(self):
-        # Save renderable cameras
-        self.cameras = []
-        for cam_shape in cmds.ls(type="camera"):
-            is_cam_renderable = cmds.getAttr(cam_shape + ".renderable")
-            self.cameras.append((cam_shape, is_cam_renderable))
+    def __init__(self):
+        super(MayaContext, self).__init__()
+        # Render globals writes dirty the IPR and Arnold scene caches: keep
+        # the values applied in the session to only write real changes.
+        self.state_cache = {}
+        self.script_jobs = []
+        self.watched_attributes = set()
+
+    @staticmethod
+    def get_dcc_version():
+        return cmds.about(version=True)
+
+    @staticmethod
+    def get_dcc_name():
+        return "Maya"
+
+    @staticmethod
+    def get_current_project_path():
+        return cmds.file(q=True, sn=True)
+
+    def has_unsaved_changes(self):
+        return bool(cmds.file(q=True, modified=True))
+
+    def open_scene(self, path):
+        cmds.file(path, open=True, force=True)
+        self.on_scene_opened()
+
+    def watch_scene_events(self):
+        """
+        Clear the cached settings when a scene or a project is opened and
+        after undo or redo, and the color management ones when its
+        preferences change.
+        """
+        if self.script_jobs:
+            return
+        for event in SCENE_EVENTS:
+            self.script_jobs.append(
+                cmds.scriptJob(event=[event, self.on_scene_opened])
+            )
+        for event in SETTINGS_EVENTS:
+            self.script_jobs.append(
+                cmds.scriptJob(event=[event, self.clear_state_cache])
+            )
+        self.script_jobs.append(
+            cmds.scriptJob(
+                event=[
+                    "colorMgtPrefsChanged",
+                    self.clear_color_management_cache,
+                ]
+            )
+        )
+
+    def on_scene_opened(self, *args):
+        self.clear_state_cache()
+        # Attribute jobs are killed with the scene.
+        self.watched_attributes.clear()
+
+    def clear_color_management_cache(self):
+        """
+        Forget the cached color management preferences that don't match the
+        current ones anymore.
+        """
+        prefix = "colorManagementPrefs."
+        for key in list(self.state_cache):
+            if not key.startswith(prefix):
+                continue
+            flag = key[len(prefix) :]
+            value = cmds.colorManagementPrefs(query=True, **{flag: True})
+            if value != self.state_cache[key]:
+                del self.state_cache[key]
+
+    def watch_attribute(self, attribute):
+        """
+        Forget the cached value of the attribute when it is changed by
+        something else than this context (render settings window, other
+        scripts).
+        """
+        if attribute in self.watched_attributes:
+            return
+
+        def on_change():
+            if attribute in self.state_cache and cmds.getAttr(
+                attribute
+            ) != self.state_cache.get(attribute):
+                del self.state_cache[attribute]
 
-    def pop_state(self):
-        for cam_shape, is_cam_renderable in self.cameras:
-            cmds.setAttr(cam_shape + ".renderable", is_cam_renderable)
+        cmds.scriptJob(
+            attributeChange=[attribute, on_change], killWithScene=True
+        )
+        self.watched_attributes.add(attribute)
+
+    def set_attribute(self, attribute, value, attribute_type=None):
+        """
+        Set a Maya attribute, recording its previous value for pop_state.
+        Nothing is read or written when the value applied last is the same.
+        """
+
+        def get_value():
+            return cmds.getAttr(attribute)
+
+        def set_value(new_value):
+            if attribute_type is None:
+                cmds.setAttr(attribute, new_value)
+            else:
+                cmds.setAttr(attribute, new_value or "", type=attribute_type)
+
+        self.watch_scene_events()
+        self.set_state_value(attribute, get_value, set_value, value)
+        self.watch_attribute(attribute)
+
+    def set_file_rule(self, rule, value):
+        """
+        Set a workspace file rule, recording its previous value for
+        pop_state.
+        """
+        self.watch_scene_events()
+        self.set_state_value(
+            "workspace.fileRule." + rule,
+            lambda: cmds.workspace(fileRuleEntry=rule),
+            lambda new_value: cmds.workspace(fileRule=[rule, new_value]),
+            value,
+        )
+
+    def set_color_management_pref(self, flag, value):
+        """
+        Set a colorManagementPrefs flag, recording its previous value for
+        pop_state.
+        """
+
+        def get_value():
+            return cmds.colorManagementPrefs(query=True, **{flag: True})
 
+        def set_value(new_value):
+            cmds.colorManagementPrefs(edit=True, **{flag: new_value})
+
+        self.watch_scene_events()
+        self.set_state_value(
+            "colorManagementPrefs." + flag, get_value, set_value, value
+        )
+
+    @capture()
     def take_viewport_screenshot(self, output_path, extension):
         """
         Take a screenshot of the current view.
@@ -31,41 +215,82 @@ class MayaContext(SoftwareContext):
         file_extension, _ = extension
         cmds.refresh(cv=True, fe=file_extension, fn=output_path)
 
+    @capture(cacheable=True)
     def take_render_screenshot(
-        self, renderer, output_path, extension, use_view_transform=True
+        self,
+        renderer,
+        output_path,
+        extension,
+        use_view_transform=True,
+        region=None,
+        threads=None,
     ):
         """
         Take a render.
+        :param region: Render only this region, (left, bottom, right, top)
+        in pixels from the bottom left corner
+        :param threads: Number of render threads (default: DCCUTILS_THREADS
+        or the number of cores)
+        """
+        return self.render_image(
+            renderer,
+            output_path,
+            extension,
+            use_view_transform,
+            region,
+            threads,
+        )
+
+    def render_image(
+        self,
+        renderer,
+        output_path,
+        extension,
+        use_view_transform=True,
+        region=None,
+        threads=None,
+    ):
+        """
+        Render the current frame into output_path. Unlike
+        take_render_screenshot, the image is neither cached nor published,
+        which suits the frames of animations.
         """
         string_ext, id_ext = extension
         self.set_current_id_extension(int(id_ext))
-        cmds.setAttr(
-            "defaultRenderGlobals.imageFilePrefix", output_path, type="string"
-        )
         camera = self.get_camera()
         layer = "-layer defaultRenderLayer "
         if self.is_color_management_available(renderer):
             self.activate_color_management(use_view_transform)
+        threads = threads or get_render_threads()
+        self.set_render_region(region)
 
         if renderer == "mayaSoftware":
-            command = "render"
-            tmp_output_path = mel.eval(command + layer + camera)
-            cmds.sysFile(tmp_output_path, rename=output_path)
+            self.set_attribute("defaultRenderGlobals.numCpusToUse", threads)
+            self.render_maya_software(output_path, camera)
 
         elif renderer == "arnold":
             from mtoa.cmds.arnoldRender import arnoldRender
 
+            width = cmds.getAttr("defaultResolution.width")
+            height = cmds.getAttr("defaultResolution.height")
+            self.set_attribute(
+                "defaultRenderGlobals.imageFilePrefix", output_path, "string"
+            )
             string_ext = "jpeg" if string_ext == "jpg" else string_ext
-            cmds.setAttr(
-                "defaultArnoldDriver.ai_translator", string_ext, type="string"
+            self.set_attribute(
+                "defaultArnoldDriver.ai_translator", string_ext, "string"
             )
             path_without_extension = os.path.splitext(output_path)[0]
-            cmds.setAttr(
-                "defaultArnoldDriver.pre",
-                path_without_extension,
-                type="string",
+            self.set_attribute(
+                "defaultArnoldDriver.pre", path_without_extension, "string"
             )
-            arnoldRender(1920, 1080, True, True, camera, layer)
+            if region is None:
+                self.set_arnold_threads(threads, width, height)
+            else:
+                self.set_arnold_threads(
+                    threads, region[2] - region[0], region[3] - region[1]
+                )
+            arnoldRender(width, height, True, True, camera, layer)
 
         elif renderer == "your_favourite_renderer":
             # Launch the render...
@@ -76,20 +301,102 @@ class MayaContext(SoftwareContext):
                 "But you can still adapt the code to make the render accessible. "
                 "You might want to look at the file %s" % (renderer, __file__)
             )
+        return output_path
 
-    def take_viewport_animation(self, output_path, extension):
+    def render_maya_software(self, output_path, camera):
         """
-        Take a playblast of the current view.
+        Render the current frame with Maya Software into output_path. The
+        images rule of the workspace points to the output directory during
+        the render, so the image is moved with a rename on the same
+        filesystem instead of being copied.
         """
-        cmds.playblast(
-            filename=output_path,
-            forceOverwrite=True,
-            quality=100,
-            percent=100,
-            viewer=False,
-            format="qt",
+        directory, filename = os.path.split(os.path.abspath(output_path))
+        self.set_file_rule("images", directory)
+        self.set_attribute(
+            "defaultRenderGlobals.imageFilePrefix",
+            os.path.splitext(filename)[0],
+            "string",
         )
+        rendered_path = mel.eval("render -layer defaultRenderLayer " + camera)
+        if os.path.abspath(rendered_path) != os.path.abspath(output_path):
+            try:
+                replace_file(rendered_path, output_path)
+            except OSError:
+                # Maya wrote the image on another filesystem.
+                shutil.move(rendered_path, output_path)
+            # Remove the folder Maya created under the output one, if any.
+            rendered_dir = os.path.dirname(os.path.abspath(rendered_path))
+            is_subfolder = rendered_dir.startswith(directory + os.sep)
+            if is_subfolder and not os.listdir(rendered_dir):
+                os.rmdir(rendered_dir)
+        return output_path
 
+    def set_render_region(self, region):
+        """
+        Render only region, (left, bottom, right, top) in pixels from the
+        bottom left corner, or the whole image if region is None.
+        """
+        self.set_attribute(
+            "defaultRenderGlobals.useRenderRegion", region is not None
+        )
+        if region is None:
+            return
+        for name, value in zip(("left", "bottom", "right", "top"), region):
+            self.set_attribute(
+                "defaultRenderGlobals.%sRegion" % name, int(value)
+            )
+
+    def set_arnold_threads(self, threads, width, height):
+        """
+        Set the number of Arnold render threads, and a bucket size giving
+        every thread several buckets of the image to render.
+        """
+        self.set_attribute(
+            "defaultArnoldRenderOptions.threads_autodetect", False
+        )
+        self.set_attribute("defaultArnoldRenderOptions.threads", threads)
+        self.set_attribute(
+            "defaultArnoldRenderOptions.bucketSize",
+            get_bucket_size(width, height, threads),
+        )
+
+    @capture()
+    def take_viewport_animation(self, output_path, extension):
+        """
+        Take a playblast of the current view. Playblasts are QuickTime
+        movies, encoded again for the other containers.
+        """
+
+        def playblast(movie_path):
+            cmds.playblast(
+                filename=movie_path,
+                forceOverwrite=True,
+                quality=100,
+                percent=100,
+                viewer=False,
+                format="qt",
+            )
+
+        self.write_through_quicktime(playblast, output_path)
+
+    def write_through_quicktime(self, write_movie, output_path):
+        """
+        Call write_movie(movie_path), which writes a QuickTime movie, with
+        output_path if it is a .mov file. Else with a temporary path, the
+        movie being encoded again into the container of output_path.
+        """
+        if os.path.splitext(output_path)[1].lower() == ".mov":
+            write_movie(output_path)
+            return output_path
+        movie_dir = tempfile.mkdtemp(prefix="dccutils-movie-")
+        try:
+            movie_path = os.path.join(movie_dir, "movie.mov")
+            write_movie(movie_path)
+            return transcode_movie(movie_path, output_path)
+        finally:
+            shutil.rmtree(movie_dir, ignore_errors=True)
+
+    @capture(cacheable=True)
     def take_render_animation(
         self, renderer, output_path, extension, use_view_transform=True
     ):
@@ -107,7 +414,11 @@ class MayaContext(SoftwareContext):
         current_file = self.get_current_file_path()
         output_format = "qt" if ext == ".mov" else None
 
-        if renderer == "mayaSoftware":
+        if renderer == "mayaSoftware" and output_format is None:
+            # The Render executable only writes QuickTime movies.
+            self.stream_animation(renderer, output_path)
+
+        elif renderer == "mayaSoftware":
             renderer_id = "sw"
             self.launch_render(
                 command,
@@ -120,22 +431,24 @@ class MayaContext(SoftwareContext):
             )
 
         elif renderer == "mayaHardware2":
-            renderer_id = "hw2"
-            self.launch_render(
-                command,
-                renderer_id,
-                dirname,
-                filename,
-                output_format,
-                camera,
-                current_file,
-            )
+            # The Render executable only writes QuickTime movies.
+            def render(movie_path):
+                self.launch_render(
+                    command,
+                    "hw2",
+                    os.path.dirname(movie_path),
+                    os.path.splitext(os.path.basename(movie_path))[0],
+                    "qt",
+                    camera,
+                    current_file,
+                )
+
+            self.write_through_quicktime(render, output_path)
 
         elif renderer == "arnold":
-            raise RenderNotSupported(
-                "Arnold can't render videos, only image "
-                "sequences. Please select another renderer"
-            )
+            # Arnold only renders images: frames are encoded while the next
+            # ones render.
+            self.stream_animation(renderer, output_path)
 
         elif renderer == "your_favourite_renderer":
             # Launch the render...
@@ -173,6 +486,70 @@ class MayaContext(SoftwareContext):
         ]
         subprocess.call(command_list)
 
+    def get_frame_range(self):
+        return (
+            cmds.getAttr("defaultRenderGlobals.startFrame"),
+            cmds.getAttr("defaultRenderGlobals.endFrame"),
+        )
+
+    def get_frame_rate(self):
+        time_unit = cmds.currentUnit(query=True, time=True)
+        if time_unit in TIME_UNIT_FRAME_RATES:
+            return TIME_UNIT_FRAME_RATES[time_unit]
+        return float(time_unit.replace("fps", ""))
+
+    def get_current_frame(self):
+        return cmds.currentTime(query=True)
+
+    def set_current_frame(self, frame):
+        cmds.currentTime(frame, update=True)
+
+    def get_frame_fingerprint(self, frame):
+        """
+        Hash the world matrices of the visible transforms, the focal length
+        of the rendering camera, the light colors and intensities, the
+        material colors and the values of the animation curves at the given
+        frame.
+        """
+        self.set_current_frame(frame)
+        digest = hashlib.sha1()
+        for transform in cmds.ls(type="transform", visible=True) or []:
+            matrix = cmds.xform(transform, query=True, ws=True, matrix=True)
+            digest.update(repr((transform, matrix)).encode())
+        camera = self.get_camera()
+        if camera is not None:
+            focal_length = cmds.getAttr(camera + ".focalLength")
+            digest.update(repr((camera, focal_length)).encode())
+        for material in cmds.ls(materials=True) or []:
+            for attribute in ("color", "transparency"):
+                if cmds.attributeQuery(attribute, node=material, exists=True):
+                    value = cmds.getAttr(material + "." + attribute)
+                    digest.update(repr((material, value)).encode())
+        for light in cmds.ls(lights=True) or []:
+            for attribute in ("color", "intensity"):
+                value = cmds.getAttr(light + "." + attribute)
+                digest.update(repr((light, value)).encode())
+        for curve in cmds.ls(type="animCurve") or []:
+            value = cmds.getAttr(curve + ".output")
+            digest.update(repr((curve, value)).encode())
+        return digest.hexdigest()
+
+    def get_render_settings(self):
+        settings = {}
+        for attribute in RENDER_SETTING_ATTRIBUTES:
+            # Renderer settings exist once their plug-in is loaded.
+            if cmds.objExists(attribute):
+                settings[attribute] = cmds.getAttr(attribute)
+        return settings
+
+    def render_frame(self, renderer, frame, output_path, viewport=False):
+        self.set_current_frame(frame)
+        if viewport:
+            cmds.refresh(cv=True, fe="png", fn=output_path)
+        else:
+            self.render_image(renderer, output_path, ("png", 32))
+        return output_path
+
     def get_cameras(self):
         """
         Return a list of tuple representing the Maya cameras.
@@ -196,7 +573,7 @@ class MayaContext(SoftwareContext):
         all_camera_shapes = cmds.ls(type="camera")
         assert camera_shape in all_camera_shapes
         for shape in all_camera_shapes:
-            cmds.setAttr(shape + ".renderable", shape == camera_shape)
+            self.set_attribute(shape + ".renderable", shape == camera_shape)
 
     def get_camera(self):
         """
@@ -209,7 +586,7 @@ class MayaContext(SoftwareContext):
         return None
 
     def set_current_id_extension(self, id_extension):
-        cmds.setAttr("defaultRenderGlobals.imageFormat", id_extension)
+        self.set_attribute("defaultRenderGlobals.imageFormat", id_extension)
 
     def get_available_renderers(self):
         """
@@ -227,12 +604,64 @@ class MayaContext(SoftwareContext):
     def get_current_color_space(self):
         return cmds.colorManagementPrefs(q=True, viewTransformName=True)
 
-    def set_current_color_space(self, **kwargs):
-        color_space = self.get_current_color_space()
-        if color_space:
-            cmds.colorManagementPrefs(e=True, viewTransformName=color_space)
-        else:
-            cmds.colorManagementPrefs(e=True, viewTransformName="sRGB gamma")
+    def get_color_spaces(self):
+        return cmds.colorManagementPrefs(q=True, viewTransformNames=True) or []
+
+    def get_plugins_signature(self):
+        return sorted(cmds.pluginInfo(query=True, listPlugins=True) or [])
+
+    def can_defer(self):
+        # executeDeferred runs the function at once in batch mode.
+        return not cmds.about(batch=True)
+
+    def execute_deferred(self, function):
+        maya.utils.executeDeferred(function)
+
+    def free_memory(self):
+        """
+        Flush the evaluation caches, the Arnold caches when Arnold is loaded
+        and, in batch mode only, the undo queue (artists keep theirs).
+        """
+        if cmds.about(batch=True):
+            cmds.flushUndo()
+        cmds.clearCache(all=True)
+        if cmds.pluginInfo("mtoa", query=True, loaded=True):
+            cmds.arnoldFlushCache(flushall=True)
+
+    def set_current_color_space(self, color_space=None, **kwargs):
+        """
+        Set the view transform. Without color space, only make sure one is
+        set.
+        """
+        if color_space is None:
+            current = self.get_state_value(
+                "colorManagementPrefs.viewTransformName",
+                self.get_current_color_space,
+            )
+            if current:
+                return
+            color_space = "sRGB gamma"
+        self.set_color_management_pref("viewTransformName", color_space)
+
+    def get_render_cache_inputs(self, use_digest=False):
+        inputs = super(MayaContext, self).get_render_cache_inputs(use_digest)
+        if inputs is None:
+            return None
+        inputs.update(
+            {
+                "camera": self.get_camera(),
+                "frame": self.get_current_frame(),
+                "frame_range": (
+                    cmds.getAttr("defaultRenderGlobals.startFrame"),
+                    cmds.getAttr("defaultRenderGlobals.endFrame"),
+                ),
+                "resolution": (
+                    cmds.getAttr("defaultResolution.width"),
+                    cmds.getAttr("defaultResolution.height"),
+                ),
+            }
+        )
+        return inputs
 
     def get_current_file_path(self):
         return cmds.file(q=True, sn=True)
@@ -245,7 +674,7 @@ class MayaContext(SoftwareContext):
         return renderer in ["mayaHardware2", "arnold"]
 
     def activate_color_management(self, enabled):
-        cmds.colorManagementPrefs(edit=True, cmEnabled=enabled)
+        self.set_color_management_pref("cmEnabled", enabled)
         if enabled:
             self.set_current_color_space()
 
@@ -255,7 +684,7 @@ class MayaContext(SoftwareContext):
         algorithm in Maya.
         """
         return (
-            [(".mov", ("mov", 22))]
+            [(".mov", ("mov", 22)), (".mp4", ("mp4", None))]
             if is_video
             else [(".png", ("png", 32)), (".jpg", ("jpg", 8))]
         )
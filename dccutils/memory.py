@@ -0,0 +1,212 @@
+"""
+Module that measures the memory used by the current process and frees the
+host caches when it grows too much.
+"""
+import os
+import sys
+import threading
+
+_memory_info = []
+
+
+def get_windows_memory_info():
+    """
+    Return the PROCESS_MEMORY_COUNTERS of the current process, None if they
+    can't be read (on other systems).
+    """
+    if os.name != "nt":
+        return None
+    import ctypes
+    from ctypes import wintypes
+
+    if not _memory_info:
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        kernel32 = ctypes.windll.kernel32
+        # Exported by kernel32 since Windows 7, by psapi before.
+        get_info = getattr(kernel32, "K32GetProcessMemoryInfo", None)
+        if get_info is None:
+            get_info = ctypes.windll.psapi.GetProcessMemoryInfo
+        get_info.argtypes = [
+            wintypes.HANDLE,
+            ctypes.POINTER(ProcessMemoryCounters),
+            wintypes.DWORD,
+        ]
+        get_info.restype = wintypes.BOOL
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        _memory_info.append((ProcessMemoryCounters, get_info, kernel32))
+    counters_class, get_info, kernel32 = _memory_info[0]
+    counters = counters_class()
+    counters.cb = ctypes.sizeof(counters)
+    if not get_info(
+        kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb
+    ):
+        return None
+    return counters
+
+
+def get_rss():
+    """
+    Return the resident set size (working set on Windows) of the current
+    process in bytes, None if it can't be measured (macOS without psutil).
+    """
+    try:
+        with open("/proc/self/statm") as statm_file:
+            pages = int(statm_file.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, AttributeError):
+        pass
+    counters = get_windows_memory_info()
+    if counters is not None:
+        return counters.WorkingSetSize
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+def get_peak_rss():
+    """
+    Return the highest resident set size of the current process in bytes,
+    since it started or since reset_peak_rss, None if it can't be measured.
+    Unlike sampling get_rss, it catches the peaks reached while the host
+    holds the GIL.
+    """
+    try:
+        with open("/proc/self/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    counters = get_windows_memory_info()
+    if counters is not None:
+        return counters.PeakWorkingSetSize
+    try:
+        import resource
+    except ImportError:
+        return None
+    # In kilobytes, bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size to the current one (Linux 4.0 and
+    later). Return False if it can't be reset.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs_file:
+            clear_refs_file.write("5")
+        return True
+    except (IOError, OSError):
+        return False
+
+
+class MemoryGovernor(object):
+    """
+    Keep the memory of a host running many captures in check: the memory
+    used by each job is measured, and the host caches are freed after a job
+    when the process uses more than threshold.
+
+        governor = MemoryGovernor(context, threshold=8 * 1024**3)
+        for shot in shots:
+            result, report = governor.run(
+                context.take_render_screenshot, renderer, shot, extension
+            )
+    """
+
+    def __init__(self, context, threshold=None, sample_interval=0.05):
+        """
+        :param context: Context of the host running the jobs
+        :param threshold: Memory usage in bytes above which the host caches
+        are freed, never by default
+        :param sample_interval: Time in seconds between two measures of the
+        memory used during a job
+        """
+        self.context = context
+        self.threshold = threshold
+        self.sample_interval = sample_interval
+        self.last_report = None
+        self.peak_rss = 0
+        self.free_count = 0
+        self.warned = False
+
+    def run(self, function, *args, **kwargs):
+        """
+        Run function (a capture job) and return its result along with a
+        report of the memory used: before and after the job, the high-water
+        mark during the job and, if the caches were freed, after freeing.
+        The high-water mark comes from the kernel when it tells, else from
+        samples taken while the job runs.
+        """
+        rss_before = get_rss()
+        peak_reset = reset_peak_rss()
+        peak_before = get_peak_rss()
+        peak = [rss_before or 0]
+        stop = threading.Event()
+
+        def sample():
+            while not stop.wait(self.sample_interval):
+                rss = get_rss()
+                if rss is not None and rss > peak[0]:
+                    peak[0] = rss
+
+        sampler = threading.Thread(target=sample)
+        sampler.daemon = True
+        sampler.start()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            stop.set()
+            sampler.join()
+            peak_after = get_peak_rss()
+            if peak_after is not None and (
+                peak_reset or peak_after > (peak_before or 0)
+            ):
+                # Otherwise the peak was reached before the job.
+                peak[0] = max(peak[0], peak_after)
+            self.last_report = self.check(rss_before, peak[0])
+        return result, self.last_report
+
+    def check(self, rss_before=None, peak=0):
+        """
+        Free the host caches if the process uses more memory than the
+        threshold. Return a memory report.
+        """
+        rss = get_rss()
+        report = {
+            "rss_before": rss_before,
+            "rss_after": rss,
+            "rss_peak": max(peak, rss or 0) or None,
+            "freed": False,
+        }
+        if self.threshold and rss is None and not self.warned:
+            self.warned = True
+            self.context.software_print(
+                "The memory used can't be measured (install psutil): the "
+                "caches are never freed."
+            )
+        if self.threshold and rss is not None and rss > self.threshold:
+            self.context.free_memory()
+            self.free_count += 1
+            report["freed"] = True
+            report["rss_after_free"] = get_rss()
+        self.peak_rss = max(self.peak_rss, report["rss_peak"] or 0)
+        return report
@@ -0,0 +1,526 @@
+"""
+Module that uploads capture outputs in the background. Uploads run on an
+asyncio event loop in a separate thread, so the DCC keeps rendering the
+next capture while earlier outputs are sent.
+
+Files are sent in chunks with PUT requests carrying a Content-Range header,
+which the server answers with 308. A POST request to the same URL then
+completes the upload, with a JSON body holding the SHA-256 of the file,
+computed while it is read, and its metadata:
+
+    {"sha256": "<hex digest>", "metadata": {...}}
+
+The server answers 200 or 201. When a request fails, the upload resumes from
+the offset the server reports for a HEAD request (its Range header,
+"bytes=0-<last byte>"), or is done if the server answers 200 or 201.
+Connecting and each read time out after request_timeout seconds, which is
+retried like a lost connection.
+
+The module needs Python 3.5.3 or later.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import ssl
+import threading
+import urllib.parse
+
+from .exceptions import PublishError
+
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+def get_all_tasks(loop):
+    # asyncio.all_tasks was added in Python 3.7.
+    if hasattr(asyncio, "all_tasks"):
+        return asyncio.all_tasks(loop)
+    return asyncio.Task.all_tasks(loop)
+
+
+class ConnectionPool(object):
+    def __init__(self, max_size=4, timeout=None):
+        """
+        :param max_size: Number of idle connections kept per server
+        :param timeout: Time in seconds to wait for a connection
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle = {}
+        self.opened = 0
+        self.reused = 0
+
+    async def acquire(self, key):
+        scheme, host, port = key
+        idle = self.idle.get(key, [])
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.transport.is_closing() and not reader.at_eof():
+                self.reused += 1
+                return reader, writer
+            writer.close()
+        ssl_context = None
+        if scheme == "https":
+            ssl_context = ssl.create_default_context()
+        connection = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl_context), self.timeout
+        )
+        self.opened += 1
+        return connection
+
+    def release(self, key, connection, reusable=True):
+        idle = self.idle.setdefault(key, [])
+        if reusable and len(idle) < self.max_size:
+            idle.append(connection)
+        else:
+            connection[1].close()
+
+    def close(self):
+        for idle in self.idle.values():
+            for reader, writer in idle:
+                writer.close()
+        self.idle = {}
+
+
+class HTTPClient(object):
+    """
+    Minimal HTTP/1.1 client sending requests over pooled keep-alive
+    connections.
+    """
+
+    def __init__(self, max_connections=4, timeout=None):
+        """
+        :param timeout: Time in seconds to wait for a connection, for the
+        request to be sent and for each read of the response
+        """
+        self.pool = ConnectionPool(max_connections, timeout)
+        self.timeout = timeout
+
+    def wait(self, awaitable):
+        return asyncio.wait_for(awaitable, self.timeout)
+
+    async def request(self, method, url, headers=None, body=b""):
+        """
+        Send a request and return its status, its headers (with lower case
+        names) and its body.
+        """
+        parsed = urllib.parse.urlsplit(url)
+        default_port = 443 if parsed.scheme == "https" else 80
+        key = (parsed.scheme, parsed.hostname, parsed.port or default_port)
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        lines = [
+            "%s %s HTTP/1.1" % (method, path),
+            "Host: %s" % parsed.netloc,
+            "Content-Length: %d" % len(body),
+        ]
+        lines += ["%s: %s" % item for item in (headers or {}).items()]
+        data = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        try:
+            reader, writer = await self.pool.acquire(key)
+        except asyncio.TimeoutError:
+            raise PublishError(
+                "Connection to %s timed out." % parsed.netloc, retry=True
+            )
+        try:
+            writer.write(data + body)
+            await self.wait(writer.drain())
+            status, response_headers, response_body = await self.read(
+                reader, method
+            )
+        except asyncio.TimeoutError:
+            writer.close()
+            raise PublishError(
+                "%s didn't answer in time." % parsed.netloc, retry=True
+            )
+        except (IndexError, ValueError) as exception:
+            writer.close()
+            raise PublishError(
+                "Malformed response from %s: %s" % (parsed.netloc, exception),
+                retry=True,
+            )
+        except BaseException:
+            writer.close()
+            raise
+        reusable = response_headers.get("connection", "").lower() != "close"
+        self.pool.release(key, (reader, writer), reusable)
+        return status, response_headers, response_body
+
+    async def read(self, reader, method):
+        status_line = await self.wait(reader.readline())
+        if not status_line:
+            raise ConnectionError("Connection closed by the server.")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.wait(reader.readline())
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if method == "HEAD" or status in (204, 304):
+            body = b""
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int(
+                    (await self.wait(reader.readline())).split(b";")[0], 16
+                )
+                chunk = await self.wait(reader.readexactly(size + 2))
+                if size == 0:
+                    break
+                body += chunk[:-2]
+        elif "content-length" in headers:
+            body = await self.wait(
+                reader.readexactly(int(headers["content-length"]))
+            )
+        else:
+            body = await self.wait(reader.read())
+            headers["connection"] = "close"
+        return status, headers, body
+
+    def close(self):
+        self.pool.close()
+
+
+class Upload(object):
+    """
+    Progress of a file upload: the offset acknowledged by the server and the
+    digest of the bytes before it.
+    """
+
+    def __init__(self, path, url):
+        self.path = path
+        self.url = url
+        self.size = os.path.getsize(path)
+        self.offset = 0
+        self.digest = hashlib.sha256()
+        self.attempts = 0
+
+    def rewind(self, offset):
+        """
+        Resume the upload from offset, hashing again the bytes before it.
+        """
+        self.digest = hashlib.sha256()
+        with open(self.path, "rb") as upload_file:
+            remaining = offset
+            while remaining > 0:
+                chunk = upload_file.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                self.digest.update(chunk)
+                remaining -= len(chunk)
+        self.offset = offset
+
+
+def read_chunk(upload_file, size, digest):
+    """
+    Read a chunk of the file and return it with a copy of the digest
+    updated with it.
+    """
+    chunk = upload_file.read(size)
+    digest = digest.copy()
+    digest.update(chunk)
+    return chunk, digest
+
+
+def get_upload_id(path):
+    """
+    Return an identifier of the current version of the file, stable across
+    processes, so an interrupted upload can be resumed later.
+    """
+    stat = os.stat(path)
+    data = "%s:%d:%f" % (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+class Publisher(object):
+    def __init__(
+        self,
+        endpoint,
+        headers=None,
+        chunk_size=8 * 1024**2,
+        concurrency=4,
+        retries=3,
+        retry_delay=1.0,
+        request_timeout=60.0,
+    ):
+        """
+        :param endpoint: URL under which files are uploaded, to
+        <endpoint>/<upload id>/<file name>
+        :param headers: Headers added to every request (authentication)
+        :param chunk_size: Size in bytes of the uploaded chunks
+        :param concurrency: Number of files uploaded at the same time
+        :param retries: Times a failed request is sent again, resuming the
+        upload where the server stopped receiving it
+        :param retry_delay: Delay in seconds before the first retry, doubled
+        for each retry
+        :param request_timeout: Time in seconds to wait for a connection and
+        for each read of a response before retrying
+        """
+        self.endpoint = endpoint.rstrip("/")
+        self.headers = dict(headers or {})
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.request_timeout = request_timeout
+        self.futures = []
+        self.results = []
+        self.errors = []
+        self.loop = None
+        self.thread = None
+        self.client = None
+        self.semaphore = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the event loop thread. It is started by the first publish.
+        """
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            self.thread = threading.Thread(
+                target=self.run_loop, args=(ready,), daemon=True
+            )
+            self.thread.start()
+            ready.wait()
+
+    def run_loop(self, ready):
+        asyncio.set_event_loop(self.loop)
+        self.client = HTTPClient(self.concurrency, self.request_timeout)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.loop.call_soon(ready.set)
+        self.loop.run_forever()
+        tasks = get_all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(
+            asyncio.gather(*tasks, return_exceptions=True)
+        )
+        self.client.close()
+        self.loop.close()
+
+    def get_upload_url(self, path):
+        return "%s/%s/%s" % (
+            self.endpoint,
+            get_upload_id(path),
+            urllib.parse.quote(os.path.basename(path)),
+        )
+
+    def publish(self, path, metadata=None, url=None):
+        """
+        Queue the upload of the file at path and return at once. Return a
+        concurrent.futures.Future whose result is the upload report.
+
+        :param metadata: JSON serializable dict sent in the body of the
+        request completing the upload
+        :param url: Upload URL, derived from the endpoint if not given
+        """
+        self.start()
+        upload = Upload(path, url or self.get_upload_url(path))
+        future = asyncio.run_coroutine_threadsafe(
+            self.upload(upload, metadata or {}), self.loop
+        )
+        with self.lock:
+            self.futures.append(future)
+        future.add_done_callback(self.on_upload_done)
+        return future
+
+    def on_upload_done(self, future):
+        with self.lock:
+            if future in self.futures:
+                self.futures.remove(future)
+            if future.cancelled():
+                return
+            if future.exception() is not None:
+                self.errors.append(future.exception())
+            else:
+                self.results.append(future.result())
+
+    async def upload(self, upload, metadata):
+        async with self.semaphore:
+            while True:
+                try:
+                    if upload.attempts and await self.resume(upload):
+                        # The upload was completed but the response was lost.
+                        return self.get_report(upload, None, metadata)
+                    await self.send_chunks(upload)
+                    return await self.complete(upload, metadata)
+                except (OSError, asyncio.IncompleteReadError) as exception:
+                    error = exception
+                except PublishError as exception:
+                    if not exception.retry:
+                        raise
+                    error = exception
+                upload.attempts += 1
+                if upload.attempts > self.retries:
+                    raise PublishError(
+                        "Upload of %s failed: %s" % (upload.path, error)
+                    )
+                await asyncio.sleep(
+                    self.retry_delay * 2 ** (upload.attempts - 1)
+                )
+
+    async def resume(self, upload):
+        """
+        Ask the server how many bytes of the upload it received. Return True
+        if the upload is already completed.
+        """
+        status, headers, _ = await self.client.request(
+            "HEAD", upload.url, self.headers
+        )
+        completed = status in (200, 201)
+        if completed:
+            offset = upload.size
+        elif status == 308 and headers.get("range", "").startswith("bytes="):
+            try:
+                offset = int(headers["range"].split("-")[-1]) + 1
+            except ValueError:
+                offset = 0
+        elif status in (308, 404):
+            offset = 0
+        else:
+            raise PublishError(
+                "Can't resume the upload of %s (HTTP %d)."
+                % (upload.path, status),
+                retry=status in RETRY_STATUSES,
+            )
+        if offset != upload.offset:
+            await asyncio.get_event_loop().run_in_executor(
+                None, upload.rewind, min(offset, upload.size)
+            )
+        return completed
+
+    async def send_chunks(self, upload):
+        loop = asyncio.get_event_loop()
+        with open(upload.path, "rb") as upload_file:
+            upload_file.seek(upload.offset)
+            while upload.offset < upload.size:
+                chunk, digest = await loop.run_in_executor(
+                    None,
+                    read_chunk,
+                    upload_file,
+                    self.chunk_size,
+                    upload.digest,
+                )
+                if not chunk:
+                    raise PublishError(
+                        "%s was truncated during its upload." % upload.path
+                    )
+                end = upload.offset + len(chunk)
+                headers = dict(self.headers)
+                headers["Content-Type"] = "application/octet-stream"
+                headers["Content-Range"] = "bytes %d-%d/%d" % (
+                    upload.offset,
+                    end - 1,
+                    upload.size,
+                )
+                status, _, body = await self.client.request(
+                    "PUT", upload.url, headers, chunk
+                )
+                if status != 308:
+                    raise PublishError(
+                        "Upload of %s failed (HTTP %d): %s"
+                        % (upload.path, status, body[:200]),
+                        retry=status in RETRY_STATUSES,
+                    )
+                upload.offset, upload.digest = end, digest
+
+    async def complete(self, upload, metadata):
+        """
+        Complete the upload with the checksum and the metadata of the file.
+        They go in the body since servers limit the size of the headers, and
+        the metadata lists the derivatives.
+        """
+        headers = dict(self.headers)
+        headers["Content-Type"] = "application/json"
+        body = json.dumps(
+            {"sha256": upload.digest.hexdigest(), "metadata": metadata}
+        ).encode("utf-8")
+        status, _, response = await self.client.request(
+            "POST", upload.url, headers, body
+        )
+        if status not in (200, 201):
+            raise PublishError(
+                "Upload of %s failed (HTTP %d): %s"
+                % (upload.path, status, response[:200]),
+                # 308: the server misses bytes, resume the upload.
+                retry=status in RETRY_STATUSES or status == 308,
+            )
+        return self.get_report(upload, response, metadata)
+
+    def get_report(self, upload, body, metadata):
+        response = None
+        if body:
+            try:
+                response = json.loads(body.decode("utf-8"))
+            except ValueError:
+                response = body.decode("utf-8", "replace")
+        return {
+            "path": upload.path,
+            "url": upload.url,
+            "size": upload.size,
+            "sha256": upload.digest.hexdigest(),
+            "attempts": upload.attempts + 1,
+            "metadata": metadata,
+            "response": response,
+        }
+
+    def get_stats(self):
+        with self.lock:
+            stats = {"pending": len(self.futures), "done": len(self.results)}
+        if self.client is not None:
+            stats["connections_opened"] = self.client.pool.opened
+            stats["connections_reused"] = self.client.pool.reused
+        return stats
+
+    def wait(self, timeout=None):
+        """
+        Wait until the queued uploads are done. Raise the first upload error.
+        """
+        with self.lock:
+            futures = list(self.futures)
+        concurrent.futures.wait(futures, timeout)
+        with self.lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            raise errors[0]
+        return futures
+
+    def close(self, wait=True):
+        """
+        Stop the event loop, after the queued uploads are done if wait is
+        True, else cancelling them.
+        """
+        if self.thread is None:
+            return
+        if wait:
+            try:
+                self.wait()
+            finally:
+                self.stop()
+        else:
+            with self.lock:
+                futures = list(self.futures)
+            for future in futures:
+                future.cancel()
+            self.stop()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(wait=exc_type is None)
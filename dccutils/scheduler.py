@@ -0,0 +1,393 @@
+"""
+Module that schedules the captures of several submitters on one context.
+
+Captures run one at a time on the host main thread, through
+execute_deferred, so the interface stays responsive between them. Jobs are
+lists of captures. After each capture, the next one is taken from:
+
+* the job of the highest priority class (interactive, normal, batch),
+* among them, the submitter that used the least capture time relative to
+  its weight (fair share),
+* among its jobs, the one with the earliest deadline, then the oldest.
+
+A batch job is thus preempted between two of its captures when a preview
+is submitted. A capture that is running is never interrupted. Jobs whose
+deadline passed fail with DeadlineExceeded when the next capture is picked,
+whatever their priority class.
+"""
+import collections
+import itertools
+import threading
+
+from .compat import Future, monotonic, string_types
+from .exceptions import DeadlineExceeded
+
+PRIORITY_CLASSES = ("interactive", "normal", "batch")
+# Number of wait times kept per priority class for the metrics.
+WAIT_SAMPLES = 1000
+
+
+class CaptureJob(object):
+    def __init__(self, job_id, captures, submitter, priority, deadline):
+        self.id = job_id
+        self.captures = captures
+        self.submitter = submitter
+        self.priority = priority
+        self.rank = PRIORITY_CLASSES.index(priority)
+        self.submitted_at = monotonic()
+        self.started_at = None
+        self.deadline = None
+        if deadline is not None:
+            self.deadline = self.submitted_at + deadline
+        self.results = []
+        self.cancelled = False
+        self.future = Future()
+
+    def is_done(self):
+        return self.future.done()
+
+    def get_sort_key(self):
+        deadline = self.deadline if self.deadline is not None else float("inf")
+        return (deadline, self.id)
+
+
+def get_capture(capture):
+    """
+    Return the (method name, args, kwargs) tuple of a capture given as a
+    method name or as a (name, args) or (name, args, kwargs) tuple.
+    """
+    if isinstance(capture, string_types):
+        return capture, (), {}
+    name = capture[0]
+    args = tuple(capture[1]) if len(capture) > 1 else ()
+    kwargs = dict(capture[2]) if len(capture) > 2 else {}
+    return name, args, kwargs
+
+
+class CaptureScheduler(object):
+    def __init__(self, context, weights=None, time_slice=0.0):
+        """
+        :param context: Context running the captures
+        :param weights: Dict of submitter weights for the fair share
+        (default: 1)
+        :param time_slice: Time in seconds the scheduler can keep the main
+        thread busy before giving it back to the host. With 0, a single
+        capture runs each time the host is idle.
+        """
+        self.context = context
+        self.weights = weights or {}
+        self.time_slice = time_slice
+        self.lock = threading.Lock()
+        self.jobs = []
+        self.usage = {}
+        self.job_ids = itertools.count(1)
+        self.current_job = None
+        # Job whose last capture is asynchronous and still writing.
+        self.writing_job = None
+        self.wake_pending = False
+        self.wake_requested = False
+        self.draining = False
+        self.wait_times = dict(
+            (priority, collections.deque(maxlen=WAIT_SAMPLES))
+            for priority in PRIORITY_CLASSES
+        )
+        self.counters = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "deadline_misses": 0,
+            "preemptions": 0,
+            "captures": 0,
+        }
+
+    def submit(
+        self, captures, submitter="default", priority="normal", deadline=None
+    ):
+        """
+        Queue a job and return it at once. Can be called from any thread.
+        job.future gives the list of the capture results, or the error of
+        the first capture that failed.
+
+        :param captures: List of captures, each a context method name or a
+        (name, args[, kwargs]) tuple
+        :param priority: One of PRIORITY_CLASSES
+        :param deadline: Time in seconds after which the job fails if it is
+        not done
+        """
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError("Unknown priority class: %s" % priority)
+        captures = [get_capture(capture) for capture in captures]
+        with self.lock:
+            job = CaptureJob(
+                next(self.job_ids), captures, submitter, priority, deadline
+            )
+            if not any(queued.submitter == submitter for queued in self.jobs):
+                # A submitter coming back doesn't get the time it didn't use
+                # while it was away.
+                active = [self.usage[queued.submitter] for queued in self.jobs]
+                self.usage[submitter] = max(
+                    self.usage.get(submitter, 0.0), min(active or [0.0])
+                )
+            self.jobs.append(job)
+            self.counters["submitted"] += 1
+        if not captures:
+            self.finish(job)
+        self.wake()
+        return job
+
+    def get_client(self, submitter="default", priority="normal"):
+        """
+        Return an object whose capture methods submit a job, like
+        scheduler.get_client("layout", "interactive").take_viewport_screenshot
+        (path, extension). They return the job future.
+        """
+        return SchedulerClient(self, submitter, priority)
+
+    def cancel(self, job):
+        """
+        Cancel a job. The capture running, if any, is not interrupted.
+        """
+        with self.lock:
+            if job.is_done() or job.cancelled:
+                return False
+            # finish won't count the job nor set its result.
+            job.cancelled = True
+            self.counters["cancelled"] += 1
+        job.future.cancel()
+        self.remove(job)
+        return True
+
+    def remove(self, job):
+        with self.lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+            if self.current_job is job:
+                self.current_job = None
+
+    def finish(self, job, error=None):
+        self.remove(job)
+        with self.lock:
+            if job.cancelled:
+                return
+            self.counters["failed" if error else "completed"] += 1
+        if job.future.done():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(job.results)
+
+    def pick_job(self):
+        """
+        Return the job whose next capture runs first, or None. Jobs whose
+        deadline passed fail first, whatever their priority class.
+        """
+        now = monotonic()
+        with self.lock:
+            overdue = [
+                job
+                for job in self.jobs
+                if job.deadline is not None
+                and now > job.deadline
+                and not job.cancelled
+            ]
+            self.counters["deadline_misses"] += len(overdue)
+        for job in overdue:
+            self.finish(
+                job,
+                DeadlineExceeded(
+                    "Job %d of %s missed its deadline by %.3fs"
+                    % (job.id, job.submitter, now - job.deadline)
+                ),
+            )
+        with self.lock:
+            if not self.jobs:
+                return None
+            rank = min(job.rank for job in self.jobs)
+            jobs = [job for job in self.jobs if job.rank == rank]
+            submitter = min(
+                set(job.submitter for job in jobs),
+                key=lambda name: (self.usage.get(name, 0.0), name),
+            )
+            return min(
+                (job for job in jobs if job.submitter == submitter),
+                key=CaptureJob.get_sort_key,
+            )
+
+    def run_next(self):
+        """
+        Run the next capture on the calling thread, which must be the host
+        main thread. Return False if there is nothing to run or if the host
+        is still busy with an asynchronous capture.
+        """
+        if self.context.is_capture_in_progress():
+            return False
+        if self.writing_job is not None:
+            self.finish(self.writing_job)
+            self.writing_job = None
+        job = self.pick_job()
+        if job is None:
+            return False
+        now = monotonic()
+        with self.lock:
+            current = self.current_job
+            if current is not None and current is not job:
+                self.counters["preemptions"] += 1
+            self.current_job = job
+            if job.started_at is None:
+                job.started_at = now
+                self.wait_times[job.priority].append(now - job.submitted_at)
+        name, args, kwargs = job.captures[len(job.results)]
+        error = None
+        start = monotonic()
+        try:
+            job.results.append(getattr(self.context, name)(*args, **kwargs))
+        except Exception as exception:
+            error = exception
+        elapsed = monotonic() - start
+        with self.lock:
+            self.counters["captures"] += 1
+            self.usage[job.submitter] = self.usage.get(
+                job.submitter, 0.0
+            ) + elapsed / self.weights.get(job.submitter, 1.0)
+        if error is not None or len(job.results) == len(job.captures):
+            if error is None and self.context.is_capture_in_progress():
+                self.remove(job)
+                self.writing_job = job
+            else:
+                self.finish(job, error)
+        return True
+
+    def run_pending(self, max_time=None):
+        """
+        Run captures until the queue is empty, the host is busy or max_time
+        seconds passed. Return the number of captures run.
+        """
+        start = monotonic()
+        count = 0
+        while self.run_next():
+            count += 1
+            if max_time is not None and monotonic() - start >= max_time:
+                break
+        return count
+
+    def wake(self):
+        """
+        Ask the host to run the pending captures when it is idle.
+        """
+        with self.lock:
+            if self.wake_pending:
+                return
+            self.wake_pending = True
+        self.context.execute_deferred(self.on_idle)
+
+    def on_idle(self):
+        with self.lock:
+            self.wake_pending = False
+            if self.draining:
+                # execute_deferred ran this call inline (hython, no UI): the
+                # loop below goes on instead of recursing.
+                self.wake_requested = True
+                return
+            self.draining = True
+        try:
+            while True:
+                with self.lock:
+                    self.wake_requested = False
+                count = self.run_pending(self.time_slice)
+                with self.lock:
+                    has_jobs = bool(self.jobs) or self.writing_job is not None
+                if not has_jobs:
+                    break
+                self.wake()
+                with self.lock:
+                    if not self.wake_requested or count == 0:
+                        # The host calls on_idle later, or nothing can run
+                        # until the next submission.
+                        break
+        finally:
+            with self.lock:
+                self.draining = False
+
+    def get_metrics(self):
+        """
+        Return the queue depths, the wait times (from submission to the first
+        capture, in seconds) per priority class and the job counters.
+        """
+        with self.lock:
+            queue_depth = dict((priority, 0) for priority in PRIORITY_CLASSES)
+            queued_captures = 0
+            for job in self.jobs:
+                queue_depth[job.priority] += 1
+                queued_captures += len(job.captures) - len(job.results)
+            wait_times = {}
+            for priority, samples in self.wait_times.items():
+                samples = sorted(samples) or [0.0]
+                wait_times[priority] = {
+                    "count": len(self.wait_times[priority]),
+                    "mean": sum(samples) / len(samples),
+                    "p95": samples[len(samples) * 95 // 100],
+                    "max": samples[-1],
+                }
+            metrics = dict(self.counters)
+            metrics.update(
+                {
+                    "queue_depth": queue_depth,
+                    "queued_captures": queued_captures,
+                    "wait_time": wait_times,
+                    "usage": dict(self.usage),
+                }
+            )
+        return metrics
+
+
+class SchedulerClient(object):
+    def __init__(self, scheduler, submitter, priority):
+        self.scheduler = scheduler
+        self.submitter = submitter
+        self.priority = priority
+
+    def __getattr__(self, name):
+        if not name.startswith("take_"):
+            raise AttributeError(name)
+
+        def submit(*args, **kwargs):
+            deadline = kwargs.pop("deadline", None)
+            job = self.scheduler.submit(
+                [(name, args, kwargs)], self.submitter, self.priority, deadline
+            )
+            return job.future
+
+        return submit
+
+
+def format_prometheus(metrics, prefix="dccutils_scheduler"):
+    """
+    Return the scheduler metrics in the Prometheus text format.
+    """
+    lines = []
+    for priority, depth in sorted(metrics["queue_depth"].items()):
+        lines.append(
+            '%s_queue_depth{priority="%s"} %d' % (prefix, priority, depth)
+        )
+    for priority, wait_time in sorted(metrics["wait_time"].items()):
+        for key in ("mean", "p95", "max"):
+            lines.append(
+                '%s_wait_seconds{priority="%s",stat="%s"} %.6f'
+                % (prefix, priority, key, wait_time[key])
+            )
+    lines.append(
+        "%s_queued_captures %d" % (prefix, metrics["queued_captures"])
+    )
+    for key in (
+        "submitted",
+        "completed",
+        "failed",
+        "cancelled",
+        "deadline_misses",
+        "preemptions",
+        "captures",
+    ):
+        lines.append("%s_%s_total %d" % (prefix, key, metrics[key]))
+    return "\n".join(lines) + "\n"
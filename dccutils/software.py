@@ -2,11 +2,62 @@
 Module that act as a (loose) interface. Its purpose is to uniform the results
 coming from different contexts (Standalone, Blender, Maya, ...).
 """
+import contextlib
+import functools
+import inspect
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from .cache import RenderCache, get_file_signature
+from .compat import replace_file
+from .encode import StreamingEncoder, encode_image_sequence
+from .exceptions import RenderNotSupported
+from .image import write_png
+from .manifest import CapabilityManifest
+
+
+def capture(cacheable=False):
+    """
+    Decorator for the take_* methods of the contexts. It routes the call
+    through SoftwareContext.run_capture. Outputs of cacheable captures can be
+    served from the render cache, when it is enabled.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            return self.run_capture(method, cacheable, args, kwargs)
+
+        # Set by functools.wraps on Python 3 only.
+        wrapper.__wrapped__ = method
+        return wrapper
+
+    return decorator
 
 
 class SoftwareContext(object):
     def __init__(self):
         self.camera = None
+        self.render_cache = None
+        self.incremental_stats = None
+        self.state_stack = []
+        # Whether the scene had unsaved changes when the outermost
+        # push_state was called, before the contexts changed its settings.
+        self.had_unsaved_changes = False
+        self.capability_manifest = None
+        self.publisher = None
+        self.deriver = None
+        # Outputs of asynchronous captures, queued once they are written.
+        self.pending_outputs = {}
+        self.trace_recorder = None
+        self.traced_methods = []
+        # Last known values of the host settings, keyed like the state
+        # entries. Contexts that can tell when their settings change behind
+        # their back enable it with a dict.
+        self.state_cache = None
 
     @staticmethod
     def get_dcc_version():
@@ -29,6 +80,208 @@ class SoftwareContext(object):
         """
         return None
 
+    def has_unsaved_changes(self):
+        """
+        Return whether the scene was modified since it was saved.
+        """
+        return False
+
+    def open_scene(self, path):
+        """
+        Open the scene file at the given path, discarding unsaved changes.
+        """
+        pass
+
+    def enable_render_cache(
+        self, cache_dir, max_size=10 * 1024**3, use_digest=False
+    ):
+        """
+        Serve the outputs of render captures from a local cache when the
+        scene file and the capture settings didn't change.
+        """
+        self.render_cache = RenderCache(cache_dir, max_size, use_digest)
+        return self.render_cache
+
+    def disable_render_cache(self):
+        self.render_cache = None
+
+    def enable_publishing(self, publisher):
+        """
+        Upload the outputs of the captures with the given publisher (see
+        dccutils.publish) while the next captures run.
+        """
+        self.publisher = publisher
+        return publisher
+
+    def disable_publishing(self):
+        self.publisher = None
+
+    def enable_derivation(self, deriver):
+        """
+        Derive thumbnails and proxies of the outputs of the captures with the
+        given deriver (see dccutils.derive), in worker processes. When
+        publishing is enabled too, outputs are published with their
+        derivatives once these are done.
+        """
+        self.deriver = deriver
+        return deriver
+
+    def disable_derivation(self):
+        self.deriver = None
+
+    def enable_tracing(self, recorder):
+        """
+        Record the calls made to the context, with their arguments and
+        timings, with the given recorder (see dccutils.trace). The trace can
+        be replayed later to load test a host.
+        """
+        self.disable_tracing()
+        self.trace_recorder = recorder
+        self.traced_methods = recorder.attach(self)
+        return recorder
+
+    def disable_tracing(self):
+        if self.trace_recorder is not None:
+            self.trace_recorder.detach(self, self.traced_methods)
+        self.trace_recorder = None
+        self.traced_methods = []
+
+    def get_render_cache_inputs(self, use_digest=False):
+        """
+        Return a dict describing the scene state that decides the render
+        output, besides the capture arguments. Return None if the output
+        can't be cached (unsaved scene or unsaved changes, which the project
+        file doesn't hold). Settings changed by the contexts since push_state
+        don't count as unsaved changes: the inputs cover them.
+        """
+        project_path = self.get_current_project_path()
+        if not project_path or not os.path.isfile(project_path):
+            return None
+        if self.state_stack:
+            has_unsaved_changes = self.had_unsaved_changes
+        else:
+            has_unsaved_changes = self.has_unsaved_changes()
+        if has_unsaved_changes:
+            return None
+        return {
+            "dcc": self.get_dcc_name(),
+            "dcc_version": self.get_dcc_version(),
+            "project_path": project_path,
+            "project_file": get_file_signature(project_path, use_digest),
+            "color_space": self.get_current_color_space(),
+        }
+
+    def run_capture(self, method, cacheable, args, kwargs):
+        """
+        Run a capture method. Look its output up in the render cache first if
+        the capture is cacheable, then store the new output in the cache.
+        """
+        call_args = inspect.getcallargs(method, self, *args, **kwargs)
+        call_args.pop("self")
+        output_path = call_args.pop("output_path", None)
+        key = None
+        if cacheable and self.render_cache is not None and output_path:
+            inputs = self.get_render_cache_inputs(
+                use_digest=self.render_cache.use_digest
+            )
+            if inputs is not None:
+                inputs["capture"] = method.__name__
+                inputs["arguments"] = call_args
+                inputs["output_extension"] = os.path.splitext(output_path)[1]
+                key = self.render_cache.get_key(inputs)
+                if self.render_cache.restore(key, output_path):
+                    self.handle_output(method.__name__, output_path)
+                    return output_path
+                if (
+                    os.path.isfile(output_path)
+                    and os.stat(output_path).st_nlink > 1
+                ):
+                    # Don't render into a file shared with a cache entry.
+                    os.remove(output_path)
+        result = method(self, *args, **kwargs)
+        if key is not None:
+            self.render_cache.store(key, output_path)
+        self.handle_output(
+            method.__name__, output_path, getattr(result, "future", None)
+        )
+        return result
+
+    def handle_output(self, capture_name, output_path, future=None):
+        """
+        Queue the output of a capture for derivation and publishing, when
+        they are enabled. If future is given, the output is queued once it is
+        done (background writes). Outputs of asynchronous captures are queued
+        when the context calls on_capture_finished.
+        """
+        if not output_path:
+            return
+        if self.publisher is None and self.deriver is None:
+            return
+        # Read from the DCC here, callbacks can run in other threads.
+        metadata = {
+            "capture": capture_name,
+            "dcc": self.get_dcc_name(),
+            "project_path": self.get_current_project_path(),
+        }
+        publisher = self.publisher
+        deriver = self.deriver
+
+        def queue(_=None):
+            if not os.path.isfile(output_path):
+                return
+            if deriver is None:
+                publisher.publish(output_path, metadata)
+                return
+            derivation = deriver.derive(output_path)
+            if publisher is not None:
+                derivation.add_done_callback(
+                    lambda derivation: self.publish_output(
+                        publisher, output_path, metadata, derivation
+                    )
+                )
+
+        if future is not None:
+            future.add_done_callback(queue)
+        elif self.is_capture_in_progress():
+            # The file at output_path, if any, is from an earlier capture.
+            self.pending_outputs[output_path] = queue
+        else:
+            queue()
+
+    def on_capture_finished(self, output_path, success=True):
+        """
+        Called by the contexts whose captures finish after the capture call
+        returned, once output_path is written.
+        """
+        queue = self.pending_outputs.pop(output_path, None)
+        if queue is not None and success:
+            queue()
+
+    def publish_output(self, publisher, output_path, metadata, derivation):
+        """
+        Publish an output with the derivatives listed in its derivation
+        record. The output is published alone if the derivation failed.
+        """
+        metadata = dict(metadata)
+        if derivation.exception() is None:
+            record = derivation.result()
+            metadata["derivatives"] = record
+            directory = os.path.dirname(output_path)
+            derivatives = list(record["thumbnails"])
+            if record["proxy"] is not None:
+                derivatives.append(record["proxy"])
+            for derivative in derivatives:
+                publisher.publish(
+                    os.path.join(directory, derivative["path"]),
+                    {
+                        "capture": metadata["capture"],
+                        "source": record["source"],
+                    },
+                )
+        else:
+            metadata["derivation_error"] = str(derivation.exception())
+        return publisher.publish(output_path, metadata)
+
     def take_render_screenshot(
         self, renderer, output_path, extension, use_colorspace=True
     ):
@@ -57,18 +310,283 @@ class SoftwareContext(object):
         """
         pass
 
-    def push_state(self):
+    def take_render_pixels(
+        self,
+        renderer,
+        output_path=None,
+        use_colorspace=True,
+        buffer=None,
+        executor=None,
+    ):
         """
-        A function to save the current state (global variables) of the software.
+        Render the current frame and return its pixels as an ImageBuffer,
+        without going through the disk. The pixels are written to buffer if
+        given, and to output_path (as PNG) if given, in the background if
+        an executor is given.
         """
         pass
 
-    def pop_state(self):
+    def take_viewport_pixels(
+        self, output_path=None, buffer=None, executor=None
+    ):
+        """
+        Same as take_render_pixels, drawing the viewport instead.
+        """
+        pass
+
+    def save_pixels(self, image, output_path, executor=None):
+        """
+        Write image to output_path as PNG. With an executor, the write
+        happens in the background and image.future is set.
+        """
+        if executor is None:
+            write_png(output_path, image)
+        else:
+            image.future = executor.submit(write_png, output_path, image)
+        return image
+
+    def get_frame_range(self):
+        """
+        Return the (first, last) frames of the animation.
+        """
+        pass
+
+    def get_frame_rate(self):
+        """
+        Return the number of frames per second of the animation.
+        """
+        return 24
+
+    def get_current_frame(self):
+        """
+        Return the current frame.
+        """
+        pass
+
+    def set_current_frame(self, frame):
+        """
+        Set the current frame.
+        """
+        pass
+
+    def get_frame_fingerprint(self, frame):
+        """
+        Return a digest of the evaluated scene state at the given frame.
+        take_incremental_animation renders again the frames whose digest
+        changed, edits the digest doesn't cover need a full render.
+        """
+        pass
+
+    def render_frame(self, renderer, frame, output_path, viewport=False):
         """
-        A function to set back the old state (global variables) of the software.
+        Render the given frame to a PNG image, with the renderer or with the
+        viewport.
         """
         pass
 
+    def get_render_settings(self):
+        """
+        Return a JSON serializable dict of the settings that change every
+        rendered frame (resolution, samples, view transform).
+        """
+        return {}
+
+    @capture()
+    def take_incremental_animation(
+        self, renderer, output_path, viewport=False, frames_dir=None
+    ):
+        """
+        Take an animation, rendering only the frames whose fingerprint
+        changed since the previous call. Frames are kept in frames_dir
+        (next to output_path by default) and encoded again into output_path,
+        whose extension sets the container.
+        """
+        frame_range = self.get_frame_range()
+        if frame_range is None:
+            raise RenderNotSupported(
+                "Incremental animations are not available in %s."
+                % self.get_dcc_name()
+            )
+        first_frame, last_frame = int(frame_range[0]), int(frame_range[1])
+        if frames_dir is None:
+            frames_dir = os.path.splitext(output_path)[0] + "_frames"
+        if not os.path.isdir(frames_dir):
+            os.makedirs(frames_dir)
+        manifest_path = os.path.join(frames_dir, "manifest.json")
+        settings = {
+            "renderer": str(renderer),
+            "viewport": viewport,
+            "render": self.get_render_settings(),
+        }
+        # Compare with the manifest as loaded from JSON (no tuples).
+        settings = json.loads(json.dumps(settings))
+        manifest = {"settings": settings, "frames": {}}
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as manifest_file:
+                previous_manifest = json.load(manifest_file)
+            if previous_manifest.get("settings") == settings:
+                manifest = previous_manifest
+
+        pattern = os.path.join(frames_dir, "frame.%04d.png")
+        current_frame = self.get_current_frame()
+        rendered_frames = []
+        try:
+            for frame in range(first_frame, last_frame + 1):
+                fingerprint = self.get_frame_fingerprint(frame)
+                frame_path = pattern % frame
+                previous_fingerprint = manifest["frames"].get(str(frame))
+                if (
+                    fingerprint is not None
+                    and previous_fingerprint == fingerprint
+                    and os.path.isfile(frame_path)
+                ):
+                    continue
+                self.render_frame(renderer, frame, frame_path, viewport)
+                manifest["frames"][str(frame)] = fingerprint
+                rendered_frames.append(frame)
+        finally:
+            tmp_path = manifest_path + ".tmp"
+            with open(tmp_path, "w") as manifest_file:
+                json.dump(manifest, manifest_file)
+            replace_file(tmp_path, manifest_path)
+            if current_frame is not None:
+                self.set_current_frame(current_frame)
+
+        frame_count = last_frame - first_frame + 1
+        self.incremental_stats = {
+            "rendered": rendered_frames,
+            "reused": frame_count - len(rendered_frames),
+        }
+        encode_image_sequence(
+            pattern, first_frame, output_path, self.get_frame_rate()
+        )
+        return output_path
+
+    def stream_animation(self, renderer, output_path, viewport=False):
+        """
+        Render the frames of the animation one by one with render_frame and
+        encode them into output_path while the next ones render. The
+        extension of output_path sets the container.
+        """
+        frame_range = self.get_frame_range()
+        if frame_range is None:
+            raise RenderNotSupported(
+                "Animations can't be rendered frame by frame in %s."
+                % self.get_dcc_name()
+            )
+        first_frame, last_frame = int(frame_range[0]), int(frame_range[1])
+        frames_dir = tempfile.mkdtemp(prefix="dccutils-frames-")
+        pattern = os.path.join(frames_dir, "frame.%04d.png")
+        current_frame = self.get_current_frame()
+        try:
+            frame_rate = self.get_frame_rate()
+            with StreamingEncoder(output_path, frame_rate) as encoder:
+                for frame in range(first_frame, last_frame + 1):
+                    frame_path = pattern % frame
+                    self.render_frame(renderer, frame, frame_path, viewport)
+                    encoder.push(frame_path)
+        finally:
+            if current_frame is not None:
+                self.set_current_frame(current_frame)
+            shutil.rmtree(frames_dir, ignore_errors=True)
+        return output_path
+
+    def push_state(self):
+        """
+        A function to save the state (global variables) of the software that
+        the next calls modify. Calls can be nested.
+        """
+        if not self.state_stack:
+            self.had_unsaved_changes = self.has_unsaved_changes()
+        self.state_stack.append([])
+
+    def pop_state(self):
+        """
+        A function to set back the state modified since the matching
+        push_state. Only the values that changed are written back.
+        """
+        self.restore_state(self.state_stack.pop())
+
+    def restore_state(self, entries):
+        """
+        Set back the values recorded in entries, a frame taken off the state
+        stack. Captures that end after their call returns (latent commands)
+        take their frame off the stack and restore it when they are done.
+        """
+        for key, getter, setter, value in reversed(entries):
+            if self.get_state_value(key, getter) != value:
+                setter(value)
+                if self.state_cache is not None:
+                    self.state_cache[key] = value
+
+    @contextlib.contextmanager
+    def preserved_state(self):
+        """
+        Context manager version of push_state/pop_state:
+
+            with context.preserved_state():
+                context.take_render_screenshot(...)
+        """
+        self.push_state()
+        try:
+            yield self
+        finally:
+            self.pop_state()
+
+    def remember_state(self, key, getter, setter):
+        """
+        Record the current value of a host setting, identified by key, so the
+        current pop_state sets it back. Only the first value recorded for a
+        key between push_state and pop_state is kept. Return the current
+        value.
+        """
+        value = self.get_state_value(key, getter)
+        if self.state_stack:
+            entries = self.state_stack[-1]
+            if not any(entry[0] == key for entry in entries):
+                entries.append((key, getter, setter, value))
+        return value
+
+    def set_state_value(self, key, getter, setter, value):
+        """
+        Record the current value of a host setting then set it to value.
+        Nothing is written if the setting already has this value.
+        """
+        if self.remember_state(key, getter, setter) != value:
+            setter(value)
+            if self.state_cache is not None:
+                self.state_cache[key] = value
+
+    def get_state_value(self, key, getter):
+        """
+        Return the current value of a host setting, from the state cache
+        when it is enabled and knows it.
+        """
+        if self.state_cache is None:
+            return getter()
+        if key not in self.state_cache:
+            self.state_cache[key] = getter()
+        return self.state_cache[key]
+
+    def clear_state_cache(self, *args):
+        """
+        Forget the cached values of the host settings, to read them again
+        from the host.
+        """
+        if self.state_cache is not None:
+            self.state_cache.clear()
+
+    def set_property(self, owner, name, value):
+        """
+        Shortcut of set_state_value for settings stored as Python attributes.
+        """
+        self.set_state_value(
+            (owner, name),
+            lambda: getattr(owner, name),
+            lambda new_value: setattr(owner, name, new_value),
+            value,
+        )
+
     def get_extensions(self, is_video):
         """
         Return a list of tuple representing the extensions.
@@ -107,6 +625,73 @@ class SoftwareContext(object):
         """
         pass
 
+    def get_color_spaces(self):
+        """
+        Return the names of the available color spaces.
+        """
+        return []
+
+    def get_plugins_signature(self):
+        """
+        Return the names of the plugins (or add-ons) loaded in the software.
+        The capabilities of a host depend on them.
+        """
+        return []
+
+    def get_capabilities(self):
+        """
+        Return the renderers, extensions and color spaces available in the
+        live host.
+        """
+        return {
+            "renderers": self.get_available_renderers() or [],
+            "extensions": {
+                "image": self.get_extensions(False) or [],
+                "video": self.get_extensions(True) or [],
+            },
+            "color_spaces": self.get_color_spaces(),
+        }
+
+    def load_capabilities(self, cache_dir=None, revalidate=True):
+        """
+        Return the capabilities of the host from the on-disk manifest of
+        this host version and plugin set, computing it the first time.
+        With revalidate, the manifest is refreshed when the host is idle.
+        """
+        if self.capability_manifest is None:
+            self.capability_manifest = CapabilityManifest(self, cache_dir)
+        return self.capability_manifest.get(revalidate)
+
+    def is_capture_in_progress(self):
+        """
+        Return whether an asynchronous capture is still writing its output.
+        No other capture can start meanwhile.
+        """
+        return False
+
+    def can_defer(self):
+        """
+        Return whether execute_deferred runs functions later, rather than at
+        once like in some batch modes.
+        """
+        return True
+
+    def execute_deferred(self, function):
+        """
+        Run function later, when the software is idle. Without a host event
+        loop, it runs in a background thread.
+        """
+        thread = threading.Thread(target=function)
+        thread.daemon = True
+        thread.start()
+
+    def free_memory(self):
+        """
+        Free the memory the software keeps between captures (render
+        buffers, caches, unused data).
+        """
+        pass
+
     @staticmethod
     def software_print(data):
         pass
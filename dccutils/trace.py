@@ -0,0 +1,468 @@
+"""
+Module that records the calls made to a context into a trace file and
+replays them, to load test and profile dccutils with real workloads.
+
+Traces are gzipped JSON lines, each line in its own gzip member so a trace
+stays readable up to its last line when the host crashes. The first line
+describes the host and the scene, then each line is a call:
+
+    {"t": 1.25, "d": 0.031, "m": "set_camera", "a": ["Camera"],
+     "k": {}, "n": 0}
+
+t is the start of the call in seconds since the recording started, d its
+duration, n its nesting depth (calls made by other context methods are
+recorded with n > 0 but are not replayed) and e its error, if any. Host
+objects given as arguments are recorded as references ({"$ref": kind,
+"value": name}) and resolved again on replay.
+"""
+import gzip
+import inspect
+import io
+import json
+import os
+import struct
+import threading
+import time
+
+from .compat import integer_types, perf_counter, string_types
+
+TRACE_FORMAT = 1
+# Methods of the contexts that are not recorded.
+UNTRACED_METHODS = ("enable_tracing", "disable_tracing")
+# Collections of bpy.data searched for the Blender data given as arguments.
+DATABLOCK_COLLECTIONS = (
+    "objects",
+    "cameras",
+    "scenes",
+    "collections",
+    "materials",
+    "meshes",
+    "lights",
+    "worlds",
+    "images",
+    "actions",
+    "node_groups",
+)
+
+
+def get_public_methods(context):
+    names = []
+    for name in dir(type(context)):
+        if name.startswith("_") or name in UNTRACED_METHODS:
+            continue
+        if callable(getattr(type(context), name)):
+            names.append(name)
+    return names
+
+
+def get_scene_stats(context):
+    """
+    Return the size of the current scene, as far as the context can tell.
+    """
+    stats = {"project_path": context.get_current_project_path()}
+    for key, function in (
+        ("cameras", context.get_cameras),
+        ("renderers", context.get_available_renderers),
+    ):
+        try:
+            stats[key] = len(function() or [])
+        except Exception:
+            stats[key] = None
+    return stats
+
+
+def encode_value(value):
+    """
+    Return a JSON serializable version of a call argument. Host objects are
+    replaced by references: Houdini nodes by their path, Unreal actors by
+    their label and Blender data by their name.
+    """
+    if value is None or isinstance(
+        value, (bool, float) + integer_types + string_types
+    ):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [encode_value(item) for item in value]
+    if isinstance(value, dict):
+        return dict(
+            (
+                key if isinstance(key, string_types) else str(key),
+                encode_value(item),
+            )
+            for key, item in value.items()
+        )
+    if hasattr(value, "get_actor_label"):
+        return {"$ref": "actor", "value": value.get_actor_label()}
+    if hasattr(value, "path") and callable(value.path):
+        return {"$ref": "node", "value": value.path()}
+    if isinstance(getattr(value, "name", None), string_types):
+        reference = {"$ref": "datablock", "value": value.name}
+        rna_type = getattr(value, "rna_type", None)
+        if rna_type is not None:
+            reference["type"] = rna_type.identifier
+        return reference
+    if callable(value):
+        return {"$ref": "function", "value": getattr(value, "__name__", "")}
+    return {"$ref": "object", "value": type(value).__name__}
+
+
+def resolve_value(context, value):
+    """
+    Turn the references of encode_value back into host objects. Functions
+    become no-ops and other objects None.
+    """
+    if isinstance(value, list):
+        return [resolve_value(context, item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "$ref" not in value:
+        return dict(
+            (key, resolve_value(context, item)) for key, item in value.items()
+        )
+    kind, name = value["$ref"], value["value"]
+    if kind == "actor":
+        return context.find_camera(name)
+    if kind == "node":
+        import hou
+
+        return hou.node(name)
+    if kind == "datablock":
+        return resolve_datablock(name, value.get("type"))
+    if kind == "function":
+        return _noop
+    return None
+
+
+def resolve_datablock(name, type_name=None):
+    """
+    Return the Blender data with the given name, of the given RNA type if
+    it is known, looking in the objects first.
+    """
+    import bpy
+
+    for collection_name in DATABLOCK_COLLECTIONS:
+        collection = getattr(bpy.data, collection_name, None)
+        if collection is None:
+            continue
+        datablock = collection.get(name)
+        if datablock is None:
+            continue
+        rna_type = getattr(datablock, "rna_type", None)
+        if type_name is None or rna_type is None:
+            return datablock
+        if rna_type.identifier == type_name:
+            return datablock
+    return None
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+def compress(data):
+    """
+    Return data as a gzip member, like gzip.compress (Python 3 only).
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode="wb") as gzip_file:
+        gzip_file.write(data)
+    return buffer.getvalue()
+
+
+def get_argument_names(method):
+    """
+    Return the names of the positional parameters of a bound method, after
+    self. The capture decorator keeps the decorated method in __wrapped__.
+    """
+    function = getattr(method, "__func__", method)
+    function = getattr(function, "__wrapped__", function)
+    if hasattr(inspect, "getfullargspec"):
+        names = inspect.getfullargspec(function).args
+    else:
+        names = inspect.getargspec(function).args
+    return names[1:] if names and names[0] == "self" else names
+
+
+class TraceRecorder(object):
+    def __init__(self, path):
+        """
+        :param path: Trace file to write (gzipped JSON lines)
+        """
+        self.path = path
+        self.file = None
+        self.start_time = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.calls = 0
+
+    def write(self, record):
+        line = json.dumps(record, separators=(",", ":"), default=str)
+        data = compress(line.encode("utf-8") + b"\n")
+        with self.lock:
+            if self.file is not None:
+                if record.get("type", "call") == "call":
+                    self.calls += 1
+                self.file.write(data)
+                self.file.flush()
+
+    def write_scene_stats(self, context):
+        # The calls made to measure the scene are not part of the workload.
+        self.local.paused = True
+        try:
+            self.write({"type": "scene", "scene": get_scene_stats(context)})
+        finally:
+            self.local.paused = False
+
+    def attach(self, context):
+        """
+        Start recording the public method calls of the context. Methods are
+        wrapped on the instance, so other contexts are not affected.
+        """
+        if self.file is None:
+            self.file = open(self.path, "wb")
+            self.start_time = perf_counter()
+            self.write(
+                {
+                    "type": "header",
+                    "format": TRACE_FORMAT,
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "dcc": context.get_dcc_name(),
+                    "dcc_version": context.get_dcc_version(),
+                    "scene": get_scene_stats(context),
+                }
+            )
+        names = get_public_methods(context)
+        for name in names:
+            setattr(context, name, self.wrap(context, name))
+        return names
+
+    def detach(self, context, names):
+        for name in names:
+            context.__dict__.pop(name, None)
+
+    def wrap(self, context, name):
+        method = getattr(context, name)
+        recorder = self
+
+        def traced(*args, **kwargs):
+            if getattr(recorder.local, "paused", False):
+                return method(*args, **kwargs)
+            depth = getattr(recorder.local, "depth", 0)
+            record = {
+                "t": round(perf_counter() - recorder.start_time, 6),
+                "m": name,
+                "a": encode_value(args),
+                "k": encode_value(kwargs),
+                "n": depth,
+            }
+            recorder.local.depth = depth + 1
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception as exception:
+                record["e"] = "%s: %s" % (type(exception).__name__, exception)
+                raise
+            finally:
+                record["d"] = round(perf_counter() - start, 6)
+                recorder.local.depth = depth
+                recorder.write(record)
+                if name == "open_scene" and "e" not in record:
+                    recorder.write_scene_stats(context)
+
+        traced.__name__ = name
+        traced.__doc__ = method.__doc__
+        return traced
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def load_trace(path):
+    """
+    Return the header of the trace and its calls.
+    """
+    header = None
+    calls = []
+    with gzip.open(path, "rb") as trace_file:
+        try:
+            for line in trace_file:
+                record = json.loads(line.decode("utf-8"))
+                record_type = record.get("type", "call")
+                if record_type == "header":
+                    header = record
+                elif record_type == "call":
+                    calls.append(record)
+        except (EOFError, IOError, struct.error):
+            # The host stopped in the middle of the last line (Python 2
+            # raises IOError or struct.error).
+            pass
+    if header is None or header.get("format") != TRACE_FORMAT:
+        raise ValueError("Unsupported trace format in %s" % path)
+    return header, calls
+
+
+def get_percentile(values, ratio):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+class TraceReplayer(object):
+    def __init__(
+        self, path, speed=0, concurrency=1, output_dir=None, after_call=None
+    ):
+        """
+        :param speed: Replay speed relative to the recording (2 replays
+        twice as fast), 0 to run the calls back to back
+        :param concurrency: Number of replays running at the same time, each
+        with its own context. Keep 1 against a real DCC, whose API is not
+        thread safe
+        :param output_dir: Folder where the outputs of the captures are
+        written instead of the recorded paths
+        :param after_call: Function called with the context after each call
+        (to tick an event loop for instance)
+        """
+        self.header, calls = load_trace(path)
+        self.path = path
+        self.calls = [call for call in calls if call.get("n", 0) == 0]
+        self.speed = speed
+        self.concurrency = concurrency
+        self.output_dir = output_dir
+        self.after_call = after_call
+
+    def get_arguments(self, context, call):
+        """
+        Return the positional and keyword arguments of a recorded call, with
+        host objects resolved and output paths moved to output_dir.
+        """
+        args = resolve_value(context, call.get("a", []))
+        kwargs = resolve_value(context, call.get("k", {}))
+        if self.output_dir is None:
+            return args, kwargs
+        if "output_path" in kwargs:
+            kwargs["output_path"] = self.move_output(kwargs["output_path"])
+            return args, kwargs
+        names = get_argument_names(getattr(context, call["m"]))
+        if "output_path" in names:
+            index = names.index("output_path")
+            if index < len(args):
+                args[index] = self.move_output(args[index])
+        return args, kwargs
+
+    def move_output(self, output_path):
+        if not isinstance(output_path, string_types):
+            return output_path
+        return os.path.join(self.output_dir, os.path.basename(output_path))
+
+    def replay_once(self, context, timings):
+        start = perf_counter()
+        for call in self.calls:
+            if self.speed:
+                delay = call["t"] / self.speed - (perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            entry = timings.setdefault(
+                call["m"], {"recorded": [], "replayed": [], "errors": []}
+            )
+            entry["recorded"].append(call.get("d", 0))
+            call_start = perf_counter()
+            try:
+                args, kwargs = self.get_arguments(context, call)
+                getattr(context, call["m"])(*args, **kwargs)
+                if self.after_call is not None:
+                    self.after_call(context)
+            except Exception as exception:
+                entry["errors"].append(
+                    "%s: %s" % (type(exception).__name__, exception)
+                )
+            entry["replayed"].append(perf_counter() - call_start)
+
+    def replay(self, context_factory):
+        """
+        Replay the trace with contexts returned by context_factory() and
+        return a report comparing the recorded and replayed timings.
+        """
+        all_timings = [{} for _ in range(self.concurrency)]
+        contexts = [context_factory() for _ in range(self.concurrency)]
+        start = perf_counter()
+        if self.concurrency == 1:
+            self.replay_once(contexts[0], all_timings[0])
+        else:
+            threads = [
+                threading.Thread(
+                    target=self.replay_once, args=(context, timings)
+                )
+                for context, timings in zip(contexts, all_timings)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        wall_time = perf_counter() - start
+
+        methods = {}
+        errors = []
+        for timings in all_timings:
+            for name, entry in timings.items():
+                merged = methods.setdefault(
+                    name, {"recorded": [], "replayed": [], "errors": 0}
+                )
+                merged["recorded"] += entry["recorded"]
+                merged["replayed"] += entry["replayed"]
+                merged["errors"] += len(entry["errors"])
+                errors += entry["errors"]
+        report = {}
+        for name, entry in methods.items():
+            replayed = entry["replayed"]
+            report[name] = {
+                "count": len(replayed),
+                "errors": entry["errors"],
+                "recorded_total": sum(entry["recorded"]),
+                "replayed_total": sum(replayed),
+                "replayed_mean": sum(replayed) / len(replayed),
+                "replayed_p95": get_percentile(replayed, 0.95),
+                "replayed_max": max(replayed),
+            }
+        return {
+            "trace": self.path,
+            "dcc": self.header.get("dcc"),
+            "calls": len(self.calls) * self.concurrency,
+            "speed": self.speed,
+            "concurrency": self.concurrency,
+            "wall_time": wall_time,
+            "methods": report,
+            "errors": errors[:20],
+        }
+
+
+def format_report(report):
+    lines = [
+        "%d calls of %s replayed in %.3fs (speed %s, concurrency %d)"
+        % (
+            report["calls"],
+            report["trace"],
+            report["wall_time"],
+            report["speed"] or "max",
+            report["concurrency"],
+        ),
+        "%-34s%8s%8s%14s%14s%14s"
+        % ("method", "calls", "errors", "recorded", "replayed", "p95"),
+    ]
+    for name, entry in sorted(report["methods"].items()):
+        count = entry["count"]
+        lines.append(
+            "%-34s%8d%8d%12.2fus%12.2fus%12.2fus"
+            % (
+                name,
+                count,
+                entry["errors"],
+                entry["recorded_total"] / count * 1e6,
+                entry["replayed_mean"] * 1e6,
+                entry["replayed_p95"] * 1e6,
+            )
+        )
+    for error in report["errors"]:
+        lines.append("error: %s" % error)
+    return "\n".join(lines)
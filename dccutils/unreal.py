@@ -4,8 +4,10 @@ Module that implements the software interface for Unreal mode.
 import unreal
 import os
 import shutil
+import threading
 
-from .software import SoftwareContext
+from .encode import StreamingEncoder, transcode_movie
+from .software import SoftwareContext, capture
 from .exceptions import (
     CameraNotFound,
     SequenceNotFound,
@@ -16,6 +18,101 @@ from .exceptions import (
 on_finished_callback = unreal.OnRenderMovieStopped()
 automation_scheduler = unreal.AutomationScheduler()
 
+# Editor delegates after which the camera index is rebuilt.
+CAMERA_INDEX_DELEGATES = (
+    (
+        "EditorActorSubsystem",
+        (
+            "on_new_actors_dropped",
+            "on_delete_actors_end",
+            "on_duplicate_actors_end",
+            "on_edit_paste_actors_end",
+            "on_edit_cut_actors_end",
+        ),
+    ),
+    ("LevelEditorSubsystem", ("on_map_changed", "on_map_opened")),
+)
+
+
+class ViewportAnimationCapture(object):
+    """
+    Step a level sequence frame by frame with latent commands, taking a
+    viewport screenshot of each frame and streaming it into an encoder.
+    """
+
+    def __init__(
+        self, encoder, first_frame, end_frame, resolution, on_finished
+    ):
+        """
+        :param end_frame: Frame after the last captured one
+        :param on_finished: Function called with the error that stopped the
+        capture, or None, once the movie is written
+        """
+        self.encoder = encoder
+        self.frame = first_frame
+        self.end_frame = end_frame
+        self.width, self.height = resolution
+        self.on_finished = on_finished
+        self.directory = os.path.realpath(unreal.Paths.screen_shot_dir())
+        self.prefix = "dccutils_viewport_%d_%d" % (os.getpid(), id(self))
+        self.pending_path = None
+        self.pending_size = None
+        self.frame_paths = []
+
+    def start(self):
+        automation_scheduler.add_latent_command(self.step)
+
+    def step(self):
+        try:
+            if self.pending_path is not None:
+                if not self.is_written(self.pending_path):
+                    automation_scheduler.add_latent_command(self.step)
+                    return
+                self.encoder.push(self.pending_path)
+                self.frame_paths.append(self.pending_path)
+                self.pending_path = None
+                self.frame += 1
+            if self.frame >= self.end_frame:
+                self.finish(None)
+                return
+            unreal.LevelSequenceEditorBlueprintLibrary.set_current_time(
+                self.frame
+            )
+            filename = "%s.%d.png" % (self.prefix, self.frame)
+            unreal.AutomationLibrary.take_high_res_screenshot(
+                self.width, self.height, filename
+            )
+            self.pending_path = os.path.join(self.directory, filename)
+            self.pending_size = None
+            automation_scheduler.add_latent_command(self.step)
+        except Exception as exception:
+            self.finish(exception)
+
+    def is_written(self, path):
+        """
+        Screenshots are written in the background: consider one written
+        once its size didn't change between two ticks.
+        """
+        if not os.path.exists(path):
+            return False
+        size = os.path.getsize(path)
+        written = size > 0 and size == self.pending_size
+        self.pending_size = size
+        return written
+
+    def finish(self, error):
+        if error is None:
+            try:
+                self.encoder.close()
+            except Exception as exception:
+                error = exception
+        else:
+            self.encoder.abort()
+        for path in self.frame_paths + [self.pending_path]:
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+        self.on_finished(error)
+
 
 class UnrealContext(SoftwareContext):
     def __init__(self):
@@ -27,6 +124,8 @@ class UnrealContext(SoftwareContext):
         self.export_in_progress_movie_path = None
         self.future_screenshot_path = None
         self.future_movie_path = None
+        self.camera_index = None
+        self.camera_index_delegates_bound = False
 
     @staticmethod
     def software_print(data):
@@ -47,43 +146,66 @@ class UnrealContext(SoftwareContext):
     def get_current_project_path():
         return os.path.abspath(unreal.Paths.get_project_file_path())
 
-    def push_state(self):
+    def has_unsaved_changes(self):
+        return bool(
+            unreal.EditorLoadingAndSavingUtils.get_dirty_map_packages()
+            or unreal.EditorLoadingAndSavingUtils.get_dirty_content_packages()
+        )
+
+    def open_scene(self, path):
         """
-        Save the variables we need to modify.
+        Open the level (map) at the given path.
         """
-        self.current_level_sequence = (
-            unreal.LevelSequenceEditorBlueprintLibrary.get_current_level_sequence()
-        )
-        self.level_viewport_camera_info = (
-            unreal.UnrealEditorSubsystem().get_level_viewport_camera_info()
-        )
+        unreal.EditorLoadingAndSavingUtils.load_map(path)
+        self.invalidate_camera_index()
 
-    def pop_state(self):
+    def open_level_sequence(self, sequence_object):
         """
-        Set back the variables we've modified.
+        Open the level sequence in the Sequencer, recording the previous one
+        for pop_state.
         """
-        unreal.LevelSequenceEditorBlueprintLibrary.open_level_sequence(
-            self.current_level_sequence
+        library = unreal.LevelSequenceEditorBlueprintLibrary
+        self.set_state_value(
+            "level_sequence",
+            library.get_current_level_sequence,
+            library.open_level_sequence,
+            sequence_object,
         )
-        unreal.UnrealEditorSubsystem().set_level_viewport_camera_info(
-            self.level_viewport_camera_info[0],
-            self.level_viewport_camera_info[1],
+
+    def remember_viewport_camera(self):
+        """
+        Record the level viewport camera location and rotation for
+        pop_state, before piloting an actor.
+        """
+
+        def get_camera_info():
+            return tuple(
+                unreal.UnrealEditorSubsystem().get_level_viewport_camera_info()
+            )
+
+        def set_camera_info(camera_info):
+            unreal.UnrealEditorSubsystem().set_level_viewport_camera_info(
+                camera_info[0], camera_info[1]
+            )
+
+        self.remember_state(
+            "level_viewport_camera_info", get_camera_info, set_camera_info
         )
 
     def on_render_screenshot_finished(self):
         if os.path.exists(self.export_in_progress_screenshot_path):
-            shutil.move(
-                self.export_in_progress_screenshot_path,
-                self.future_screenshot_path,
-            )
+            output_path = self.future_screenshot_path
+            shutil.move(self.export_in_progress_screenshot_path, output_path)
             self.export_in_progress_screenshot_path = None
             self.future_screenshot_path = None
             self.take_screenshot_in_progress = False
+            self.on_capture_finished(output_path)
         else:
             automation_scheduler.add_latent_command(
                 self.on_render_screenshot_finished
             )
 
+    @capture()
     def take_render_screenshot(self, output_path, **kwargs):
         """
         Take a screenshot using given renderer.
@@ -99,6 +221,7 @@ class UnrealContext(SoftwareContext):
             os.path.realpath(unreal.Paths.screen_shot_dir()), filename
         )
         self.future_screenshot_path = output_path
+        self.remember_viewport_camera()
         unreal.LevelEditorSubsystem().pilot_level_actor(self.camera)
         unreal.AutomationLibrary.take_high_res_screenshot(
             1920, 1080, filename, self.camera
@@ -109,6 +232,7 @@ class UnrealContext(SoftwareContext):
         )
         return output_path
 
+    @capture()
     def take_viewport_screenshot(self, output_path, **kwargs):
         """
         Save the image at the given path with the given extension.
@@ -157,11 +281,53 @@ class UnrealContext(SoftwareContext):
         return self.sequence_path
 
     def on_render_movie_finished(self, success):
-        shutil.move(self.export_in_progress_movie_path, self.future_movie_path)
+        # The sequence capture writes AVI movies, other containers are
+        # encoded from it in a thread, not to block the editor. The movie
+        # stays in progress until it is written.
+        rendered_path = self.export_in_progress_movie_path
+        output_path = self.future_movie_path
         self.export_in_progress_movie_path = None
+        if output_path.lower().endswith(".avi"):
+            try:
+                shutil.move(rendered_path, output_path)
+            except Exception:
+                self.on_render_movie_written(output_path, False)
+                raise
+            self.on_render_movie_written(output_path, success)
+            return
+        errors = []
+
+        def transcode():
+            try:
+                transcode_movie(rendered_path, output_path)
+            except Exception as exception:
+                errors.append(exception)
+            finally:
+                if os.path.exists(rendered_path):
+                    os.remove(rendered_path)
+
+        thread = threading.Thread(target=transcode)
+        thread.daemon = True
+        thread.start()
+
+        def wait_for_transcode():
+            if thread.is_alive():
+                automation_scheduler.add_latent_command(wait_for_transcode)
+                return
+            if errors:
+                self.software_print(
+                    "Encoding of %s failed: %s" % (output_path, errors[0])
+                )
+            self.on_render_movie_written(output_path, success and not errors)
+
+        automation_scheduler.add_latent_command(wait_for_transcode)
+
+    def on_render_movie_written(self, output_path, success):
         self.future_movie_path = None
         self.take_movie_in_progress = False
+        self.on_capture_finished(output_path, success)
 
+    @capture()
     def take_render_animation(self, output_path, extension, **kwargs):
         """
         Render a sequence.
@@ -176,14 +342,13 @@ class UnrealContext(SoftwareContext):
         filename_ext = os.path.basename(output_path)
         filename, _ = os.path.splitext(filename_ext)
         self.export_in_progress_movie_path = os.path.join(
-            os.path.realpath(unreal.Paths.video_capture_dir()), filename_ext
+            os.path.realpath(unreal.Paths.video_capture_dir()),
+            filename + ".avi",
         )
         self.future_movie_path = output_path
 
         sequence_object = unreal.load_asset(self.sequence_path)
-        unreal.LevelSequenceEditorBlueprintLibrary.open_level_sequence(
-            sequence_object
-        )
+        self.open_level_sequence(sequence_object)
 
         capture_settings = unreal.AutomatedLevelSequenceCapture()
         capture_settings.settings.output_format = filename
@@ -202,26 +367,169 @@ class UnrealContext(SoftwareContext):
 
         return output_path
 
-    def take_viewport_animation(self, output_path, extension, **kwargs):
+    @capture()
+    def take_viewport_animation(
+        self, output_path, extension, resolution=(960, 540), **kwargs
+    ):
         """
-        Take animation of the viewport.
-        Save the video at the given path with the given extension.
+        Step the sequence frame by frame, capture the viewport at the given
+        preview resolution and stream the frames into ffmpeg, through the
+        camera if one is set, else through the camera cuts. Frames are
+        captured by latent commands: the movie is written after the next
+        editor ticks.
+        """
+        if self.sequence_path is None:
+            raise SequenceNotFound
+        if self.take_movie_in_progress:
+            raise MovieAlreadyInProgress
+        sequence_object = unreal.load_asset(self.sequence_path)
+        display_rate = sequence_object.get_display_rate()
+        encoder = StreamingEncoder(
+            output_path,
+            float(display_rate.numerator) / display_rate.denominator,
+        )
+        self.take_movie_in_progress = True
+        self.future_movie_path = output_path
+
+        # The capture ends after this call returns: its state is restored
+        # by on_viewport_animation_finished.
+        self.push_state()
+        library = unreal.LevelSequenceEditorBlueprintLibrary
+        try:
+            self.open_level_sequence(sequence_object)
+            self.remember_state(
+                "sequence_time",
+                library.get_current_time,
+                library.set_current_time,
+            )
+            if self.camera is not None:
+                self.remember_viewport_camera()
+                unreal.LevelEditorSubsystem().pilot_level_actor(self.camera)
+            else:
+                self.set_state_value(
+                    "camera_cut_locked_to_viewport",
+                    library.is_camera_cut_locked_to_viewport,
+                    library.set_lock_camera_cut_to_viewport,
+                    True,
+                )
+        except Exception as exception:
+            encoder.abort()
+            self.on_viewport_animation_finished(
+                self.state_stack.pop(), exception
+            )
+            raise
+        state = self.state_stack.pop()
+
+        def on_finished(error):
+            self.on_viewport_animation_finished(state, error)
+
+        ViewportAnimationCapture(
+            encoder,
+            sequence_object.get_playback_start(),
+            sequence_object.get_playback_end(),
+            resolution,
+            on_finished,
+        ).start()
+        return output_path
+
+    def on_viewport_animation_finished(self, state, error):
+        if self.camera is not None:
+            unreal.LevelEditorSubsystem().eject_pilot_level_actor()
+        self.restore_state(state)
+        if error is not None:
+            self.software_print(
+                "Viewport capture of %s failed: %s"
+                % (self.future_movie_path, error)
+            )
+        output_path = self.future_movie_path
+        self.future_movie_path = None
+        self.take_movie_in_progress = False
+        self.on_capture_finished(output_path, error is None)
+
+    def get_camera_index(self):
         """
-        pass
+        Return the cameras of the level, indexed by label and by path name.
+        The index is built on the first call and cleared by editor delegates
+        when actors are added or deleted or when another map is opened. Call
+        invalidate_camera_index after spawning cameras from a script.
+        """
+        if self.camera_index is None:
+            self.bind_camera_index_delegates()
+            cameras = [
+                (obj.get_actor_label(), obj)
+                for obj in unreal.GameplayStatics.get_all_actors_of_class(
+                    unreal.UnrealEditorSubsystem().get_editor_world(),
+                    unreal.CameraActor,
+                )
+            ]
+            self.camera_index = {
+                "cameras": cameras,
+                # With duplicate labels, the last camera wins.
+                "labels": dict(cameras),
+                "paths": dict(
+                    (obj.get_path_name(), obj) for _, obj in cameras
+                ),
+            }
+        return self.camera_index
+
+    def invalidate_camera_index(self, *args):
+        self.camera_index = None
+
+    def bind_camera_index_delegates(self):
+        if self.camera_index_delegates_bound:
+            return
+        for subsystem_name, delegate_names in CAMERA_INDEX_DELEGATES:
+            subsystem_class = getattr(unreal, subsystem_name, None)
+            if subsystem_class is None:
+                continue
+            subsystem = unreal.get_editor_subsystem(subsystem_class)
+            for delegate_name in delegate_names:
+                delegate = getattr(subsystem, delegate_name, None)
+                if delegate is not None:
+                    delegate.add_callable(self.invalidate_camera_index)
+        self.camera_index_delegates_bound = True
+
+    def find_camera(self, camera):
+        """
+        Return the camera actor matching a label or an actor, or None. The
+        index is rebuilt once on a miss or when the camera found was renamed
+        or deleted since it was indexed.
+        """
+        for rebuilt in (False, True):
+            index = self.get_camera_index()
+            if isinstance(camera, str):
+                found = index["labels"].get(camera)
+                if found is not None and (
+                    not unreal.SystemLibrary.is_valid(found)
+                    or found.get_actor_label() != camera
+                ):
+                    found = None
+            else:
+                found = index["paths"].get(camera.get_path_name())
+                if found is not None and not unreal.SystemLibrary.is_valid(
+                    found
+                ):
+                    found = None
+            if found is not None or rebuilt:
+                return found
+            self.invalidate_camera_index()
 
     def get_cameras(self, with_objects=False):
         """
         Return a list of tuple representing the Unreal cameras.
-        Each tuple contains a camera object and its name.
+        Each tuple contains a camera object and its name. The index is
+        rebuilt when a camera was renamed or deleted since it was indexed.
         """
+        cameras = self.get_camera_index()["cameras"]
+        if not all(
+            unreal.SystemLibrary.is_valid(obj)
+            and obj.get_actor_label() == label
+            for label, obj in cameras
+        ):
+            self.invalidate_camera_index()
+            cameras = self.get_camera_index()["cameras"]
         return [
-            (obj.get_actor_label(), obj)
-            if with_objects
-            else obj.get_actor_label()
-            for obj in unreal.GameplayStatics.get_all_actors_of_class(
-                unreal.UnrealEditorSubsystem().get_editor_world(),
-                unreal.CameraActor,
-            )
+            (label, obj) if with_objects else label for label, obj in cameras
         ]
 
     def set_camera(self, camera, **kwargs):
@@ -230,17 +538,8 @@ class UnrealContext(SoftwareContext):
         Check first if the camera is well-defined.
         """
         camera_found = None
-        if isinstance(camera, str):
-            for c in self.get_cameras(with_objects=True):
-                if c[0] == camera:
-                    camera_found = c[1]
-            camera = camera_found
-        elif isinstance(camera, unreal.CameraActor):
-            if camera in unreal.GameplayStatics.get_all_actors_of_class(
-                unreal.UnrealEditorSubsystem().get_editor_world(),
-                unreal.CameraActor,
-            ):
-                camera_found = camera
+        if isinstance(camera, (str, unreal.CameraActor)):
+            camera_found = self.find_camera(camera)
         if camera_found is None:
             raise CameraNotFound
         self.camera = camera_found
@@ -263,6 +562,24 @@ class UnrealContext(SoftwareContext):
             color_space
         ]
 
+    def get_color_spaces(self):
+        return [color_space.name for color_space in unreal.TextureColorSpace]
+
+    def get_plugins_signature(self):
+        library = getattr(unreal, "PluginBlueprintLibrary", None)
+        if library is None:
+            return []
+        return sorted(str(name) for name in library.get_enabled_plugin_names())
+
+    def is_capture_in_progress(self):
+        return self.take_screenshot_in_progress or self.take_movie_in_progress
+
+    def execute_deferred(self, function):
+        automation_scheduler.add_latent_command(function)
+
+    def free_memory(self):
+        unreal.SystemLibrary.collect_garbage()
+
     def get_available_renderers(self):
         """
         Return a list of renderers
@@ -274,4 +591,6 @@ class UnrealContext(SoftwareContext):
         Return a list of available extensions along with the ID of their
         compression algorithm in Blender.
         """
-        return [(".avi", "AVI")] if is_video else [(".png", "PNG")]
+        if is_video:
+            return [(".avi", "AVI"), (".mp4", "MP4")]
+        return [(".png", "PNG")]
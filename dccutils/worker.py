@@ -0,0 +1,559 @@
+"""
+Module that keeps DCC processes running in the background so capture jobs
+don't pay the host startup time.
+
+A worker runs inside a host process and serves jobs on a localhost socket.
+A pool starts, recycles and shares workers. Both speak line-delimited JSON:
+{"id": 1, "method": "run_job", "params": {"job": {...}}} is answered with
+{"id": 1, "result": {...}} or {"id": 1, "error": "..."}.
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from . import batch
+from .compat import cpu_count, queue, replace_file
+from .exceptions import WorkerError
+from .memory import MemoryGovernor, get_rss
+
+# Time in seconds a client waits for the answer of a job after its timeout.
+TIMEOUT_GRACE = 10
+
+
+def send_message(stream, message):
+    stream.write((json.dumps(message) + "\n").encode("utf-8"))
+    stream.flush()
+
+
+def read_message(stream):
+    """
+    Return the next message of stream, None when the connection is closed.
+    """
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line.decode("utf-8"))
+
+
+class Worker(object):
+    def __init__(self, context, max_jobs=50, max_rss=None, free_rss=None):
+        """
+        :param context: Context of the host running the jobs
+        :param max_jobs: Number of jobs after which the worker exits
+        :param max_rss: Memory usage in bytes above which the worker exits
+        :param free_rss: Memory usage in bytes above which the host caches
+        are freed after a job
+        """
+        self.context = context
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.governor = MemoryGovernor(context, free_rss)
+        self.jobs_done = 0
+        self.running = False
+
+    def must_recycle(self):
+        if self.max_jobs and self.jobs_done >= self.max_jobs:
+            return True
+        if self.max_rss:
+            rss = get_rss()
+            return rss is not None and rss > self.max_rss
+        return False
+
+    def handle(self, method, params):
+        if method == "run_job":
+            result, memory = self.governor.run(
+                batch.run_job_safely, self.context, params["job"]
+            )
+            self.jobs_done += 1
+            result["worker"] = os.getpid()
+            result["memory"] = memory
+            return result
+        elif method == "ping":
+            return {
+                "pid": os.getpid(),
+                "dcc": self.context.get_dcc_name(),
+                "jobs_done": self.jobs_done,
+                "rss": get_rss(),
+                "peak_rss": self.governor.peak_rss,
+                "free_count": self.governor.free_count,
+            }
+        elif method == "shutdown":
+            self.running = False
+            return {}
+        raise ValueError("Unknown method %s." % method)
+
+    def serve_connection(self, stream):
+        while self.running:
+            message = read_message(stream)
+            if message is None:
+                return
+            response = {"id": message.get("id")}
+            try:
+                response["result"] = self.handle(
+                    message.get("method"), message.get("params") or {}
+                )
+            except Exception as exception:
+                response["error"] = batch.get_error_message(exception)
+            if self.running and self.must_recycle():
+                self.running = False
+            # Tell the client the worker exits after this response.
+            response["recycle"] = not self.running
+            send_message(stream, response)
+
+    def serve(self, port_file=None, port=0):
+        """
+        Serve jobs on localhost, one connection at a time, until the worker
+        is shut down or recycled. The port is written to port_file once the
+        worker is ready.
+        """
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind(("127.0.0.1", port))
+        server.listen(1)
+        if port_file:
+            tmp_path = port_file + ".tmp"
+            with open(tmp_path, "w") as tmp_file:
+                tmp_file.write(str(server.getsockname()[1]))
+            replace_file(tmp_path, port_file)
+        self.running = True
+        try:
+            while self.running:
+                connection, _ = server.accept()
+                # Python 2 sockets and socket files are not context managers.
+                stream = connection.makefile("rwb")
+                try:
+                    self.serve_connection(stream)
+                except (EnvironmentError, ValueError):
+                    # The client went away or sent garbage.
+                    pass
+                finally:
+                    try:
+                        stream.close()
+                    except EnvironmentError:
+                        pass
+                    connection.close()
+        finally:
+            server.close()
+
+
+def serve_worker(arguments):
+    """
+    Entry point of the worker mode of the batch host script.
+    """
+    parser = argparse.ArgumentParser(prog="dccutils worker")
+    parser.add_argument("--port-file")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--max-jobs", type=int, default=50)
+    parser.add_argument("--max-rss", type=int)
+    parser.add_argument("--free-rss", type=int)
+    args = parser.parse_args(arguments)
+
+    from .guess import GuessedContext
+
+    worker = Worker(
+        GuessedContext(), args.max_jobs, args.max_rss, args.free_rss
+    )
+    worker.serve(args.port_file, args.port)
+    return 0
+
+
+class WorkerClient(object):
+    def __init__(self, address, timeout=None):
+        """
+        :param address: (host, port) tuple of a worker or of a pool
+        :param timeout: Default time in seconds to wait for a response
+        """
+        self.address = tuple(address)
+        self.timeout = timeout
+        self.connection = None
+        self.stream = None
+        self.recycled = False
+        self.ids = itertools.count(1)
+
+    def connect(self):
+        self.connection = socket.create_connection(self.address)
+        self.stream = self.connection.makefile("rwb")
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def call(self, method, timeout=None, **params):
+        """
+        Call method on the worker and return its result. The connection is
+        closed and socket.timeout raised if no response comes in time.
+        """
+        if self.connection is None:
+            self.connect()
+        self.connection.settimeout(timeout or self.timeout)
+        message = {"id": next(self.ids), "method": method, "params": params}
+        try:
+            send_message(self.stream, message)
+            response = read_message(self.stream)
+        except (OSError, ValueError):
+            self.close()
+            raise
+        if response is None:
+            self.close()
+            raise WorkerError("The worker closed the connection.")
+        if response.get("recycle"):
+            self.recycled = True
+            self.close()
+        if "error" in response:
+            raise WorkerError(response["error"])
+        return response.get("result")
+
+    def run_job(self, job, timeout=None):
+        """
+        Run job and return its result. A pool server kills the job after
+        timeout seconds and answers a bit later, so the connection waits a
+        little longer than that.
+        """
+        connection_timeout = timeout + TIMEOUT_GRACE if timeout else None
+        return self.call(
+            "run_job", connection_timeout, job=job, job_timeout=timeout
+        )
+
+    def ping(self):
+        return self.call("ping")
+
+    def shutdown(self):
+        return self.call("shutdown")
+
+
+class WorkerProcess(object):
+    def __init__(
+        self,
+        host,
+        max_jobs=50,
+        max_rss=None,
+        startup_timeout=120,
+        free_rss=None,
+        threads=None,
+    ):
+        """
+        :param host: Name of the DCC running the worker (blender, maya or
+        houdini)
+        :param threads: Number of render threads of the host (default: number
+        of cores)
+        """
+        self.host = host
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.free_rss = free_rss
+        self.threads = threads
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.client = None
+        self.tmp_dir = None
+
+    def get_log(self):
+        log_path = os.path.join(self.tmp_dir, "worker.log")
+        if not os.path.isfile(log_path):
+            return ""
+        with open(log_path, "rb") as log_file:
+            return log_file.read()[-4000:].decode("utf-8", "replace")
+
+    def start(self):
+        """
+        Start the host process and wait until it serves jobs.
+        """
+        self.tmp_dir = tempfile.mkdtemp(prefix="dccutils-worker-")
+        port_file = os.path.join(self.tmp_dir, "port")
+        arguments = [
+            "worker",
+            "--port-file",
+            port_file,
+            "--max-jobs",
+            str(self.max_jobs),
+        ]
+        if self.max_rss:
+            arguments += ["--max-rss", str(self.max_rss)]
+        if self.free_rss:
+            arguments += ["--free-rss", str(self.free_rss)]
+        command = batch.get_host_command(
+            self.host, None, arguments, self.threads
+        )
+        log_path = os.path.join(self.tmp_dir, "worker.log")
+        with open(log_path, "wb") as log_file:
+            self.process = subprocess.Popen(
+                command,
+                stdout=log_file,
+                stderr=subprocess.STDOUT,
+                env=batch.get_host_environment(self.threads),
+            )
+        deadline = time.time() + self.startup_timeout
+        while not os.path.isfile(port_file):
+            if self.process.poll() is not None:
+                log = self.get_log()
+                self.stop()
+                raise WorkerError(
+                    "The %s worker exited with code %d.\n%s"
+                    % (self.host, self.process.returncode, log)
+                )
+            if time.time() > deadline:
+                self.stop()
+                raise WorkerError(
+                    "The %s worker didn't start in %d seconds."
+                    % (self.host, self.startup_timeout)
+                )
+            time.sleep(0.05)
+        with open(port_file) as port_file_object:
+            port = int(port_file_object.read())
+        self.client = WorkerClient(("127.0.0.1", port))
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout=10):
+        """
+        Ask the worker to exit, kill it if it doesn't.
+        """
+        if self.client is not None:
+            if self.is_alive() and not self.client.recycled:
+                try:
+                    self.client.call("shutdown", timeout=timeout)
+                except (OSError, ValueError, WorkerError):
+                    pass
+            self.client.close()
+        if self.process is not None:
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def kill(self):
+        if self.client is not None:
+            self.client.close()
+        if self.is_alive():
+            self.process.kill()
+            self.process.wait()
+        self.stop()
+
+
+class WorkerPool(object):
+    def __init__(
+        self,
+        host,
+        size=None,
+        max_jobs=50,
+        max_rss=None,
+        startup_timeout=120,
+        free_rss=None,
+        threads=None,
+    ):
+        """
+        :param host: Name of the DCC running the workers
+        :param size: Maximum number of workers, the number of cores by default
+        :param max_jobs: Number of jobs after which a worker is recycled
+        :param max_rss: Memory usage in bytes above which a worker is
+        recycled
+        :param free_rss: Memory usage in bytes above which a worker frees the
+        host caches after a job
+        :param threads: Number of render threads of each worker, the cores
+        shared between the workers by default
+        """
+        self.host = host
+        self.size = size or cpu_count()
+        self.threads = threads or batch.get_host_threads(self.size)
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss
+        self.startup_timeout = startup_timeout
+        self.free_rss = free_rss
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+        self.workers = set()
+        self.closed = False
+
+    def create_worker(self):
+        """
+        Start a new worker, if the pool isn't full. Return None otherwise.
+        """
+        with self.lock:
+            if self.closed or len(self.workers) >= self.size:
+                return None
+            worker = WorkerProcess(
+                self.host,
+                self.max_jobs,
+                self.max_rss,
+                self.startup_timeout,
+                self.free_rss,
+                self.threads,
+            )
+            self.workers.add(worker)
+        try:
+            worker.start()
+        except Exception:
+            self.discard(worker)
+            raise
+        return worker
+
+    def discard(self, worker):
+        with self.lock:
+            self.workers.discard(worker)
+
+    def replace(self, worker):
+        """
+        Stop worker and start a new one in the background to keep the pool
+        warm.
+        """
+        worker.stop()
+        self.discard(worker)
+        if self.closed:
+            return
+
+        def start():
+            try:
+                self.add_idle_worker()
+            except WorkerError:
+                # The next acquire starts a worker and reports the error.
+                pass
+
+        thread = threading.Thread(target=start)
+        thread.daemon = True
+        thread.start()
+
+    def start(self):
+        """
+        Start all the workers now rather than at the first jobs.
+        """
+        count = self.size - len(self.workers)
+        if count > 0:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=count) as executor:
+                list(executor.map(self.add_idle_worker, range(count)))
+
+    def add_idle_worker(self, *args):
+        worker = self.create_worker()
+        if worker is not None:
+            self.release(worker)
+
+    def acquire(self):
+        while not self.closed:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            worker = self.create_worker()
+            if worker is not None:
+                return worker
+            try:
+                return self.idle.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        raise WorkerError("The pool is closed.")
+
+    def release(self, worker):
+        if worker.client.recycled or not worker.is_alive():
+            self.replace(worker)
+        elif self.closed:
+            worker.stop()
+            self.discard(worker)
+        else:
+            self.idle.put(worker)
+
+    def run_job(self, job, timeout=None):
+        """
+        Run job on an idle worker and return its result. A worker that
+        times out or crashes is killed and replaced.
+        """
+        worker = self.acquire()
+        try:
+            result = worker.client.run_job(job, timeout)
+        except socket.timeout:
+            worker.kill()
+            self.replace(worker)
+            return {"status": "timeout", "error": "Job timed out."}
+        except (OSError, ValueError, WorkerError) as exception:
+            log = worker.get_log()
+            worker.kill()
+            self.replace(worker)
+            return {
+                "status": "failed",
+                "error": batch.get_error_message(exception),
+                "log": log,
+            }
+        self.release(worker)
+        return result
+
+    def get_stats(self):
+        with self.lock:
+            workers = len(self.workers)
+        return {
+            "host": self.host,
+            "size": self.size,
+            "workers": workers,
+            "idle": self.idle.qsize(),
+        }
+
+    def close(self):
+        self.closed = True
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
+            self.discard(worker)
+
+    def serve(self, address=("127.0.0.1", 0)):
+        """
+        Return a server sharing the pool with other processes, which connect
+        with a WorkerClient. Call its serve_forever method to run it.
+        """
+        return PoolServer(address, self)
+
+
+class PoolRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        pool = self.server.pool
+        while True:
+            try:
+                message = read_message(self.rfile)
+            except (OSError, ValueError):
+                return
+            if message is None:
+                return
+            response = {"id": message.get("id")}
+            method = message.get("method")
+            params = message.get("params") or {}
+            if method == "run_job":
+                response["result"] = pool.run_job(
+                    params["job"], params.get("job_timeout")
+                )
+            elif method == "ping":
+                response["result"] = pool.get_stats()
+            else:
+                response["error"] = "Unknown method %s." % method
+            send_message(self.wfile, response)
+
+
+class PoolServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, pool):
+        self.pool = pool
+        socketserver.ThreadingTCPServer.__init__(
+            self, address, PoolRequestHandler
+        )